@@ -1,62 +1,121 @@
-from langchain_siliconflow import SiliconFlowEmbeddings, ChatSiliconFlow
-from config import Config, llm, embeddings, config
+from config import Config, config, get_llm, get_embedding_client
 from store.kv_store import KeyValueMemoryStore
 from store.vector_store import VectorMemoryStore
 from store.writer import MemoryWriter
-from store.priority import PriorityMemoryManager # 管理不同级别记忆, hierarchy
+from store.priority import PriorityMemoryManager, MemoryPriority # 管理不同级别记忆, hierarchy
 from store.version import MemoryUpdateManager # 负责处理记忆冲突, 写入不同版本
+from store.recall_cache import RecallCache
+from store.consolidation import MemoryConsolidator
+from store.cold_tier import ColdSegmentStore
+from store.frequency import FrequencyTracker
+from store import dump, snapshot
 from prompts.SYSTEM_PROPT import EXTRACTION_PROMPT
 from datetime import datetime
 from memory import MemoryItem, MemoryType
 from evaluator import MemoryValueEvaluator
+from metrics import metrics
+from events import events
+from typing import List, Optional, TYPE_CHECKING
 import json
+import threading
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_siliconflow import SiliconFlowEmbeddings, ChatSiliconFlow
 
 class SmartMemoryAgent:
     """记忆Agent"""
 
-    def __init__(self, embeddings: SiliconFlowEmbeddings, llm: ChatSiliconFlow, config: Config):
+    def __init__(self, embeddings: 'SiliconFlowEmbeddings', llm: 'ChatSiliconFlow', config: Config,
+                 recall_cache_size: int = 256):
         self.embeddings = embeddings
         self.llm = llm
         self.config = config
+        self.recall_cache = RecallCache(recall_cache_size)
+
+        # 写入与快照互斥, 保证快照是某个时刻的一致状态
+        self._lock = threading.RLock()
+
+        # 分级存储的冷存储 (enable_tiered_storage 开启), 换存储时保留
+        self.cold_store: Optional[ColdSegmentStore] = None
+        self.cold_hot_limit = 1000
+
+        # 信号频率追踪 (enable_frequency_tracking 开启), 换存储时保留计数
+        self.frequency_tracker: Optional[FrequencyTracker] = None
 
         # 初始化各组件
         self.evaluator = MemoryValueEvaluator()
+        self._reset_stores()
+
+        events.emit("agent.init")
+
+    def _reset_stores(self):
+        """创建空的各存储组件"""
+        previous = getattr(self, 'consolidator', None)
+        previous_store = getattr(self, 'vector_store', None)
         self.kv_store = KeyValueMemoryStore()
-        self.vector_store = VectorMemoryStore(embeddings) # Vector 需要传 embedding 模型
+        self.vector_store = VectorMemoryStore(self.embeddings) # Vector 需要传 embedding 模型
+        if previous_store is not None:
+            # 压缩阈值/粗排/分片配置沿用到新 store, 旧 store 的进程池与共享内存立即释放
+            self.vector_store.apply_settings(previous_store.settings())
+            previous_store.close()
+            self.recall_cache.clear() # 新 store 的 generation 从头计数, 旧结果不能再命中
         self.writer = MemoryWriter(self.kv_store, self.vector_store)
         self.priority_manager = PriorityMemoryManager(self.evaluator)
+        if self.cold_store is not None:
+            self.cold_store.set_holders([]) # 旧的版本管理随之丢弃, 清空时不必再取回冷记忆
+            self.cold_store.clear()
+            self.priority_manager.enable_tiered_storage(self.cold_store, self.cold_hot_limit)
+        if self.frequency_tracker is not None:
+            self.frequency_tracker.forget_memories()
         self.update_manager = MemoryUpdateManager()
-
-        print("MemoryAgent Initialized!")
+        self._attach_cold_holders()
+        self.consolidator = MemoryConsolidator(
+            self.vector_store, self.update_manager, self.priority_manager, llm=self.llm, lock=self._lock
+        )
+        # 后台整合线程随存储一起换到新的整合器上
+        if previous is not None and previous.background_running:
+            interval, summarize = previous._background_args
+            previous.stop_background(wait=False)
+            self.consolidator.start_background(interval, summarize)
     
     def process_user_input(self, user_input: str):
         """处理用户输入并提取记忆"""
-        print(f"\n用户输入: {user_input}")
-        print(f"分析中……")
+        events.emit("agent.input", user_input=user_input)
 
         memories_to_store = self._extract_memories_with_llm(user_input)
 
         # 存储提取的记忆
         if memories_to_store:
             for memory in memories_to_store:
+                if self.frequency_tracker is not None:
+                    memory = self._track_frequency(memory)
+                    if memory is None:
+                        continue
                 self._store_memory(memory)
         else:
-            print(f"! 未识别到需要存储的记忆（可能需要更明确的表达）\n")
+            events.emit("agent.no_memory")
 
 
 
+    @metrics.timed("extract_memories_with_llm")
     def _extract_memories_with_llm(self, user_input: str):
         """使用 LLM 提取记忆, 判断能否由用户当前输入拿到什么有价值的东西"""
 
         prompt = EXTRACTION_PROMPT.format(user_input=user_input)
     
         response = self.llm.invoke(prompt)
+        if metrics.enabled:
+            metrics.incr(
+                "extract_memories_with_llm", "bytes",
+                len(prompt.encode('utf-8')) + len(response.content.encode('utf-8'))
+            )
 
         # 解析 JSON, 提起记忆数组
         try:
             memories_data = json.loads(response.content)
         except json.JSONDecodeError as e:
-            print(f"LLM 返回格式错误, {e}")
+            events.emit("agent.llm_error", error=e)
             return []
 
         # 转换为 MemoryItem
@@ -86,58 +145,345 @@ class SmartMemoryAgent:
         """存储记忆"""
         # 评估并分级存储
         scores = self.evaluator.evaluate(memory)
-        priority = self.priority_manager.classify_priority(memory)
+        priority = self.priority_manager.classify_priority(memory, scores)
+
+        events.emit("agent.store", memory=memory, priority=priority, score=scores['total_score'])
 
-        print(f"📝 记忆: {memory.content}")
-        print(f"   类型: {memory.memory_type.value}")
-        print(f"   优先级: {priority.value}")
-        print(f"   综合得分: {scores['total_score']:.3f}")
+        # 先在锁外向量化, 锁内只做内存写入, 避免网络请求阻塞快照
+        embedding = self.vector_store.get_embedding(memory.content)
 
         # 存储到各个系统
-        self.priority_manager.store(memory)
-        self.vector_store.add(memory) # 存到向量数据库方便语义检索
-        key = f"{memory.memory_type.value}_{datetime.now().timestamp()}_{str(memory.metadata)}" # 加上 metadata 防止相同类型记忆冲突了
-        self.update_manager.add_or_update(key, memory)
-        print()
-
-    def recall(self, query: str, top_k: int=3):
-        """召回记忆"""
-        print(f"\n🔍 查询: {query}\n")
-        results = self.vector_store.semantic_search(query, top_k)
-
-        print(f"找到 {len(results)} 条相关记忆:\n")
-        for i, (memory, score) in enumerate(results, 1):
-            print(f"{i}. [{memory.memory_type.value}] {memory.content}")
-            print(f"   相似度: {score:.4f}")
-            print()
-        
+        with self._lock:
+            self.priority_manager.store(memory, scores)
+            self.vector_store.add(memory, embedding) # 存到向量数据库方便语义检索
+            key = f"{memory.memory_type.value}_{datetime.now().timestamp()}_{str(memory.metadata)}" # 加上 metadata 防止相同类型记忆冲突了
+            self.update_manager.add_or_update(key, memory)
+            if self.frequency_tracker is not None:
+                self.frequency_tracker.register(memory)
+            self.priority_manager.maybe_spill(self.vector_store)
+
+    def enable_frequency_tracking(self, width: int = 4096, depth: int = 4, top_k: int = 256,
+                                  promote_threshold: int = 3):
+        """
+            开启信号频率追踪: 提取出的记忆先计入 count-min sketch (内存固定为 width * depth 个计数),
+            近似频率写入记忆的 frequency; 重复出现的信号只提高原记忆的频率,
+            低优先级信号出现 promote_threshold 次后才存储
+        """
+        with self._lock:
+            self.frequency_tracker = FrequencyTracker(width, depth, top_k, promote_threshold)
+            self._attach_cold_holders()
+            self._rebuild_frequency_index()
+
+    def _attach_cold_holders(self):
+        """版本管理与频率追踪对换出的记忆只保存冷存储位置, 由冷存储在换出/取回/删除时通知"""
+        if self.cold_store is None:
+            return
+        holders = [self.update_manager.current_version]
+        if self.frequency_tracker is not None:
+            holders.append(self.frequency_tracker)
+        for holder in holders:
+            holder.cold_store = self.cold_store
+        self.cold_store.set_holders(holders)
+
+    def _rebuild_frequency_index(self):
+        """按当前存储重建信号到记忆的对应, 重复信号检测在加载/导入后继续生效"""
+        if self.frequency_tracker is None:
+            return
+        resident = [memory for _, memory in self.update_manager.current_version.resident()]
+        cold = []
+        if self.cold_store is not None:
+            cold = [(ref, memory) for ref, memory, _, _ in self.cold_store.iter_ref_entries()]
+        self.frequency_tracker.rebuild(resident + self.vector_store.memories, cold)
+
+    def _track_frequency(self, memory: MemoryItem) -> Optional[MemoryItem]:
+        """计入频率, 返回需要新存储的记忆; 信号已有对应记忆或未达晋升阈值时返回 None"""
+        tracker = self.frequency_tracker
+        count = tracker.observe(memory)
+        with self._lock:
+            existing = tracker.stored(memory)
+            if existing is not None:
+                # 评估器按签名发现 frequency 变化, 下次评估自动重算; 换层交给 retier
+                existing.frequency = max(existing.frequency, count)
+                tracker.write_back(existing)
+                events.emit("frequency.repeat", memory=existing, count=count)
+                return None
+
+        memory.frequency = max(memory.frequency, count)
+        if count < tracker.promote_threshold and \
+                self.priority_manager.classify_priority(memory) == MemoryPriority.LOW:
+            tracker.mark_pending()
+            events.emit("frequency.pending", memory=memory, count=count, threshold=tracker.promote_threshold)
+            return None
+        return memory
+
+    def recall(self, query: str, top_k: int=3, memory_types: List[MemoryType] = None):
+        """召回记忆, 相同查询在向量库未变化前直接复用缓存结果"""
+        key = RecallCache.make_key(query, top_k, memory_types)
+        generation = self.vector_store.generation
+        results = self.recall_cache.get(key, generation)
+        if results is not None:
+            metrics.incr("recall", "cache_hits")
+        else:
+            metrics.incr("recall", "cache_misses")
+            results = self._search(query, top_k, memory_types)
+            self.recall_cache.put(key, generation, results)
+
+        if events.enabled:
+            events.emit("agent.recall", query=query, count=len(results))
+            for i, (memory, score) in enumerate(results, 1):
+                events.emit("agent.recall_item", rank=i, memory=memory, score=score)
+
+        return results
+
+    def recall_many(self, queries: List[str], top_k: int=3, memory_types: List[MemoryType] = None):
+        """
+            批量召回 (如组装一轮对话上下文时的多个查询): 未命中缓存的查询一次性向量化,
+            与向量库做一次矩阵乘; 返回与 queries 一一对应的结果列表
+        """
+        generation = self.vector_store.generation
+        keys = [RecallCache.make_key(query, top_k, memory_types) for query in queries]
+        results = [self.recall_cache.get(key, generation) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        metrics.incr("recall", "cache_hits", len(queries) - len(misses))
+        metrics.incr("recall", "cache_misses", len(misses))
+
+        if misses:
+            q_embeddings = self.vector_store.get_embeddings([queries[i] for i in misses])
+            with metrics.span("semantic_search_many"):
+                searched = self.vector_store.search_by_vectors(np.asarray(q_embeddings), top_k, memory_types)
+            for i, q_embedding, hits in zip(misses, q_embeddings, searched):
+                results[i] = self._merge_cold(q_embedding, hits, top_k, memory_types)
+                self.recall_cache.put(keys[i], generation, results[i])
+
+        if events.enabled:
+            for query, query_results in zip(queries, results):
+                events.emit("agent.recall", query=query, count=len(query_results))
+                for rank, (memory, score) in enumerate(query_results, 1):
+                    events.emit("agent.recall_item", rank=rank, memory=memory, score=score)
+
         return results
 
-    def get_report(self):
-        """生成记忆系统报告"""
-        print("\n" + "="*70)
-        print("📊 记忆系统报告")
-        print("="*70)
+    def _search(self, query: str, top_k: int, memory_types: List[MemoryType] = None):
+        """检索热层向量库, 开启分级存储时同时检索冷存储并合并结果"""
+        if self.cold_store is None or len(self.cold_store) == 0:
+            return self.vector_store.semantic_search(query, top_k, memory_types)
+        q_embedding = self.vector_store.get_embedding(query)
+        results = self.vector_store.search_by_vector(q_embedding, top_k, memory_types)
+        return self._merge_cold(q_embedding, results, top_k, memory_types)
+
+    def _merge_cold(self, q_embedding, results, top_k: int, memory_types: List[MemoryType] = None):
+        """开启分级存储时, 把冷存储的命中与热层结果合并取 top_k"""
+        if self.cold_store is None or len(self.cold_store) == 0:
+            return results
+        results = results + [
+            (self.cold_store.get(ref), score)
+            for ref, score in self.cold_store.search(q_embedding, top_k, memory_types)
+        ]
+        return sorted(results, key=lambda item: item[1], reverse=True)[:top_k]
+
+    def enable_tiered_storage(self, path: str = None, hot_limit: int = 1000,
+                              segment_size: int = 4096, cache_segments: int = 4):
+        """
+            开启分级存储: 长期记忆常驻内存, 中/短期记忆超过 hot_limit 条时连同向量换出到 path 下的段文件
+            (path 为空时用临时目录); 召回时冷存储一并检索, 命中的段按 LRU 缓存 cache_segments 个
+            换出的记忆在版本管理与频率追踪中只保存位置, 内存中不再保留记忆对象 (见 ColdSegmentStore)
+        """
+        with self._lock:
+            if self.cold_store is not None:
+                self.cold_store.close() # 旧冷存储中的记忆由持有者取回, 之后不再参与检索
+            self.cold_store = ColdSegmentStore(path, segment_size, cache_segments)
+            self.cold_hot_limit = hot_limit
+            self._attach_cold_holders()
+            self.priority_manager.enable_tiered_storage(self.cold_store, hot_limit)
+            self.priority_manager.maybe_spill(self.vector_store)
+
+    def spill_cold_memories(self) -> int:
+        """立即把内存中的中/短期记忆全部换出到冷存储, 返回换出条数"""
+        with self._lock:
+            return self.priority_manager.spill(self.vector_store)
+
+    def promote_cold_memories(self) -> int:
+        """重新评估冷存储中的记忆, 高优先级的晋升回长期记忆, 返回晋升条数"""
+        with self._lock:
+            return self.priority_manager.promote_cold(self.vector_store)
+
+    def update_memory(self, key: str, memory: MemoryItem, source: str = 'user') -> MemoryItem:
+        """按 key 更新记忆 (带版本与冲突解决), 胜出的新记忆替换旧记忆的向量与分级, 返回当前版本"""
+        with self._lock:
+            old = self.update_manager.current_version.get(key)
+            self.update_manager.add_or_update(key, memory, source)
+            resolved = self.update_manager.current_version[key]
+            if old is None:
+                self.priority_manager.store(resolved)
+                self.vector_store.add(resolved)
+            elif resolved is not old:
+                self._replace_memory(old, resolved)
+            return resolved
+
+    def rollback_memory(self, key: str, version_num: int) -> bool:
+        """回滚 key 到指定版本, 向量库与分级同步替换"""
+        with self._lock:
+            old = self.update_manager.current_version.get(key)
+            if not self.update_manager.rollback(key, version_num):
+                return False
+            self._replace_memory(old, self.update_manager.current_version[key])
+            return True
+
+    def expire_memories(self, now: datetime = None) -> int:
+        """删除已过有效期 (temporal_validity) 的记忆, 返回删除条数"""
+        now = now or datetime.now()
+        with self._lock:
+            expired = [
+                m for m in self.vector_store.memories
+                if m.temporal_validity is not None and m.temporal_validity < now
+            ]
+            self.vector_store.remove(expired)
+            self.priority_manager.remove(expired)
+            cold_expired = self.cold_store.expire(now) if self.cold_store is not None else 0
+            if cold_expired:
+                self.vector_store.bump_generation() # 召回缓存里可能有冷存储的命中
+        return len(expired) + cold_expired
+
+    def _replace_memory(self, old: MemoryItem, new: MemoryItem):
+        """用新记忆替换旧记忆的向量 (墓碑 + 追加) 与分级位置; 旧记忆已换出时从冷存储删除"""
+        memory_id = self.vector_store.find_id(old)
+        if memory_id is None:
+            if self.cold_store is not None:
+                self.cold_store.remove([old])
+            self.vector_store.add(new)
+        else:
+            self.vector_store.update(memory_id, new)
+        self.priority_manager.remove([old])
+        self.priority_manager.store(new)
+
+    def consolidate_memories(self, summarize: bool = False):
+        """整合新增的重复记忆 (FACTS/BEHAVIORAL_PATTERNS), 返回本轮统计"""
+        return self.consolidator.consolidate(summarize)
+
+    def start_background_consolidation(self, interval: float = 3600.0, summarize: bool = False):
+        """每隔 interval 秒在后台线程整合一次记忆"""
+        self.consolidator.start_background(interval, summarize)
+
+    def stop_background_consolidation(self):
+        self.consolidator.stop_background()
+
+    def apply_time_decay(self, days_passed: float = 1.0, retier: bool = True):
+        """对当前记忆应用时间衰减, 并使召回缓存失效; retier 时随后批量重新分级, 返回移动统计"""
+        with self._lock:
+            self.update_manager.apply_time_decay(days_passed)
+            self.vector_store.bump_generation()
+            if not retier:
+                return None
+            moves = self.priority_manager.retier(self.vector_store)
+            self.priority_manager.maybe_spill(self.vector_store)
+            return moves
+
+    def get_report(self) -> str:
+        """打印记忆系统报告, 并返回报告文本"""
+        report = self.format_report()
+        print(report)
+        return report
+
+    def format_report(self) -> str:
+        """生成记忆系统报告文本 (不输出), 多线程并发调用也不会互相干扰输出"""
+        lines = []
+        out = lines.append
+        out("\n" + "="*70)
+        out("📊 记忆系统报告")
+        out("="*70)
 
         # 优先级统计
         priority_stats = self.priority_manager.get_statistics()
-        print("\n📈 优先级分布:")
+        out("\n📈 优先级分布:")
         for layer, count in priority_stats.items():
-            print(f"  {layer}: {count} 条")
+            out(f"  {layer}: {count} 条")
 
         # 写入统计
         write_stats = self.writer.get_write_statistics()
         if write_stats:
-            print("\n✍️  写入策略统计:")
+            out("\n✍️  写入策略统计:")
             for strategy, count in write_stats.items():
-                print(f"  {strategy}: {count} 次")
+                out(f"  {strategy}: {count} 次")
+            total_rates = self.writer.get_write_rates()['total']
+            out(f"  写入速率: 1m {total_rates['1m']:.3f} 次/秒 | 5m {total_rates['5m']:.3f} 次/秒")
 
-        print("\n" + "="*70)
+        # 召回缓存
+        cache_stats = self.recall_cache.get_statistics()
+        if cache_stats['hits'] + cache_stats['misses']:
+            out("\n🗃️  召回缓存:")
+            out(f"  命中 {cache_stats['hits']} 次 | 未命中 {cache_stats['misses']} 次 | "
+                  f"命中率 {cache_stats['hit_rate']:.1%} | 缓存 {cache_stats['size']}/{cache_stats['max_size']} 条")
 
-############################### 测试部分 ###############################
-agent = SmartMemoryAgent(embeddings, llm, config)
+        # 信号频率
+        if self.frequency_tracker is not None:
+            frequency_stats = self.frequency_tracker.get_statistics()
+            out("\n🔁 信号频率:")
+            out(f"  已记录 {frequency_stats['observed']} 次 | sketch {frequency_stats['sketch_bytes'] / 1024:.0f}KB | "
+                  f"暂缓 {frequency_stats['pending']} 次 | 误差上界 {frequency_stats['error_bound']:.1f}")
+            for signal, count in self.frequency_tracker.top(5):
+                out(f"  {signal}: 约 {count} 次")
+
+        # 热路径耗时统计
+        latency_stats = self.get_metrics_snapshot()
+        if latency_stats:
+            out("\n⏱️  热路径耗时:")
+            for op, stats in latency_stats.items():
+                latency = stats.get('latency')
+                extra = "".join(
+                    f" | {name}: {value}" for name, value in stats.items()
+                    if name not in ('calls', 'latency')
+                )
+                if latency:
+                    out(f"  {op}: {stats.get('calls', 0)} 次 | "
+                          f"平均 {latency['mean_ms']:.2f}ms | p50 {latency['p50_ms']:.2f}ms | "
+                          f"p95 {latency['p95_ms']:.2f}ms | p99 {latency['p99_ms']:.2f}ms{extra}")
+                else:
+                    out(f"  {op}: {stats.get('calls', 0)} 次{extra}")
+
+        out("\n" + "="*70)
+        return "\n".join(lines)
+
+    def export_memories(self, path: str, fmt: str = None, include_embeddings: bool = True) -> int:
+        """
+            流式导出全部记忆状态 (记忆项, key, 版本, 分级, 可选向量)
+            fmt: 'jsonl' 或 'binary', 默认按扩展名判断; 返回导出的记录数
+            先在锁内截取一致的状态视图, 写文件期间的更新不影响本次导出
+        """
+        state = snapshot.capture_state(self, fold_cold=False)
+        try:
+            return dump.export_agent(state, path, fmt, include_embeddings)
+        finally:
+            if state.cold_store is not None:
+                state.cold_store.close() # 释放冷存储视图, 导出期间删除的段文件此时才真正删除
 
+    def import_memories(self, path: str, fmt: str = None):
+        """流式导入 export_memories 的结果, 缺少向量的记忆会批量重新向量化"""
+        with self._lock:
+            counts = dump.import_agent(self, path, fmt)
+            self._rebuild_frequency_index()
+            self.priority_manager.maybe_spill(self.vector_store)
+            return counts
+
+    def save_snapshot(self, path: str):
+        """把全部存储保存为快照目录 (向量为原始数组文件), 与并发写入互斥, 返回 manifest"""
+        return snapshot.save_snapshot(self, path)
+
+    def load_snapshot(self, path: str):
+        """从快照目录恢复全部存储, 向量通过 np.memmap 按需加载, 返回 manifest"""
+        with self._lock:
+            manifest = snapshot.load_snapshot(self, path)
+            self._rebuild_frequency_index()
+            self.priority_manager.maybe_spill(self.vector_store)
+            return manifest
+
+    def get_metrics_snapshot(self):
+        """获取热路径耗时与计数统计 (未开启统计时为空)"""
+        return metrics.snapshot()
+
+############################### 测试部分 ###############################
 def main():
+    agent = SmartMemoryAgent(get_embedding_client(), get_llm(), config)
+
     # 创建并演示智能Agent
     print("🎬 模拟完整交互场景\n")
     print("="*70)
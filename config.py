@@ -1,8 +1,8 @@
 # 全局 llm 配置
-from langchain_siliconflow import ChatSiliconFlow, SiliconFlowEmbeddings
 from dataclasses import dataclass
 from dotenv import load_dotenv
 import os
+import threading
 
 # 加载环境变量
 load_dotenv()
@@ -11,6 +11,10 @@ SILICONFLOW_BASE_URL = os.getenv("SILICONFLOW_BASE_URL")
 SILICONFLOW_EMBED_MODEL = os.getenv("SILICONFLOW_EMBED_MODEL")
 SILICONFLOW_CHAT_MODEL = os.getenv("SILICONFLOW_CHAT_MODEL")
 TEMPERATURE = float(os.getenv("TEMPERATURE", 0.0))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", 8))
+EMBED_RATE_LIMIT = float(os.getenv("EMBED_RATE_LIMIT", 0)) or None # 每秒请求数上限, 0 表示不限
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 5))
+EMBED_POOLED = os.getenv("EMBED_POOLED", "1").lower() not in ("0", "false", "no", "off") # agent 是否走并发 embedding 客户端
 
 # 配置类, 全局单例
 @dataclass
@@ -21,10 +25,65 @@ class Config:
     embed_model = SILICONFLOW_EMBED_MODEL
     chat_model = SILICONFLOW_CHAT_MODEL
     temperature = TEMPERATURE
+    embed_max_concurrency = EMBED_MAX_CONCURRENCY
+    embed_rate_limit = EMBED_RATE_LIMIT
+    embed_max_retries = EMBED_MAX_RETRIES
+    embed_pooled = EMBED_POOLED
 config = Config()
 
-embeddings = SiliconFlowEmbeddings(model=config.embed_model)
-llm = ChatSiliconFlow(
-    model=config.chat_model,
-    temperature=config.temperature
-)
\ No newline at end of file
+# 客户端在第一次使用时才构建, LangChain 也在那时才导入, import config 不需要凭证也不联网
+_embeddings = None
+_embedding_client = None
+_llm = None
+_client_lock = threading.Lock()
+
+def get_embeddings():
+    """获取全局 embedding 客户端 (首次调用时构建)"""
+    global _embeddings
+    if _embeddings is None:
+        with _client_lock:
+            if _embeddings is None:
+                from langchain_siliconflow import SiliconFlowEmbeddings
+                _embeddings = SiliconFlowEmbeddings(model=config.embed_model)
+    return _embeddings
+
+def get_embedding_client():
+    """
+        获取 agent 使用的 embedding 客户端: config.embed_pooled 为真 (默认, 环境变量 EMBED_POOLED) 时
+        返回并发客户端, 否则返回 get_embeddings() 的原始客户端
+    """
+    if config.embed_pooled:
+        return get_pooled_embedding_client()
+    return get_embeddings()
+
+def get_pooled_embedding_client():
+    """获取全局并发 embedding 客户端 (连接池 + 限流 + 重试), 可直接替代 get_embeddings()"""
+    global _embedding_client
+    if _embedding_client is None:
+        embeddings = get_embeddings()
+        with _client_lock:
+            if _embedding_client is None:
+                from embedding_client import PooledEmbeddingClient
+                _embedding_client = PooledEmbeddingClient.from_config(config, embeddings)
+    return _embedding_client
+
+def get_llm():
+    """获取全局 LLM 客户端 (首次调用时构建)"""
+    global _llm
+    if _llm is None:
+        with _client_lock:
+            if _llm is None:
+                from langchain_siliconflow import ChatSiliconFlow
+                _llm = ChatSiliconFlow(
+                    model=config.chat_model,
+                    temperature=config.temperature
+                )
+    return _llm
+
+def __getattr__(name: str):
+    """兼容旧写法 `from config import llm, embeddings`, 访问时才构建"""
+    if name == 'embeddings':
+        return get_embeddings()
+    if name == 'llm':
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,373 @@
+# 并发 embedding 客户端: 连接池 + 并发上限 + 令牌桶限流 + 重复请求合并 + 抖动重试
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, TYPE_CHECKING
+from metrics import metrics
+import hashlib
+import json
+import random
+import threading
+import time
+
+if TYPE_CHECKING:
+    from config import Config
+
+# 这些状态码说明是服务端暂时不可用或限流, 值得重试
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# 被包装的 embeddings 对象 (openai/requests/httpx 等) 抛出的这些异常类同样值得重试, 按类名匹配避免依赖具体的库
+_RETRY_ERRORS = {'APIConnectionError', 'APITimeoutError', 'RateLimitError', 'InternalServerError',
+                 'ConnectionError', 'Timeout', 'TimeoutException', 'ConnectError'}
+
+
+class TokenBucket:
+    """令牌桶限流: 每秒补充 rate 个令牌, 最多积攒 capacity 个"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens: float) -> float:
+        """尝试取令牌, 成功返回 0, 否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """取令牌, 不够时立即返回 False"""
+        return self._take(tokens) == 0.0
+
+    def acquire(self, tokens: float = 1.0):
+        """取令牌, 不够时阻塞等待"""
+        while True:
+            wait = self._take(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+
+class EmbeddingRequestError(RuntimeError):
+    """重试耗尽或不可重试的 embedding 请求错误"""
+
+
+class _RetryableError(Exception):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(headers) -> Optional[float]:
+    """解析 Retry-After 头 (秒数), 没有或无法解析时返回 None"""
+    value = headers.get("Retry-After") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _retryable(error: Exception) -> Optional[_RetryableError]:
+    """被包装的 embeddings 抛出的异常: 网络错误/超时/限流/5xx 转为可重试错误, 其它返回 None"""
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if isinstance(error, (ConnectionError, TimeoutError)) or status in _RETRY_STATUS or \
+            any(cls.__name__ in _RETRY_ERRORS for cls in type(error).__mro__):
+        return _RetryableError(f"{type(error).__name__}: {error}", _retry_after(getattr(response, 'headers', None)))
+    return None
+
+
+class PooledEmbeddingClient:
+    """
+        embedding 客户端, 接口与 LangChain Embeddings 一致 (embed_query / embed_documents), 可直接传给 VectorMemoryStore
+        - 配置了 base_url/api_key 时, 用带连接池的 requests.Session 直接调用 OpenAI 兼容的 /embeddings 接口
+          否则退化为调用被包装的 embeddings 对象
+        - 最多 max_concurrency 个请求同时在途, 按 rate_limit (次/秒) 令牌桶限流
+        - 同一文本正在请求中时, 后来者直接等待同一个结果
+        - 限流/5xx/网络错误 (包括被包装对象抛出的同类异常) 按指数退避 + 全抖动重试, 优先遵循 Retry-After;
+          退避期间所有工作线程一起暂停, 避免同时重试把服务端再次打满
+    """
+
+    def __init__(self, embeddings=None, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None, max_concurrency: int = 8, rate_limit: Optional[float] = None,
+                 burst: Optional[float] = None, batch_size: int = 32, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 20.0, timeout: float = 30.0):
+        if embeddings is None and not base_url:
+            raise ValueError("需要提供 embeddings 对象或 base_url")
+        self.embeddings = embeddings
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.api_key = api_key
+        self.model = model or getattr(embeddings, 'model', None)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self._bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._resume_at = 0.0 # 全局退避结束时间 (monotonic)
+        self._closed = False
+        self._session = None
+        if self.base_url and self.api_key:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            self._session.headers.update({
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            })
+
+    @classmethod
+    def from_config(cls, config: 'Config', embeddings=None) -> 'PooledEmbeddingClient':
+        """按全局配置构建, embeddings 对象在没有 HTTP 配置时作为后备"""
+        return cls(
+            embeddings=embeddings,
+            base_url=config.base_url,
+            api_key=config.api_key,
+            model=config.embed_model,
+            max_concurrency=config.embed_max_concurrency,
+            rate_limit=config.embed_rate_limit,
+            max_retries=config.embed_max_retries
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """并发获取一组文本的 embedding, 结果顺序与输入一致"""
+        futures: Dict[str, Future] = {}
+        to_send: List[str] = []
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("embedding 客户端已关闭")
+            for text in texts:
+                if text in futures:
+                    continue
+                future = self._inflight.get(text)
+                if future is None:
+                    future = self._inflight[text] = Future()
+                    to_send.append(text)
+                elif metrics.enabled:
+                    metrics.incr("embedding_client", "coalesced")
+                futures[text] = future
+
+        for start in range(0, len(to_send), self.batch_size):
+            batch = to_send[start:start + self.batch_size]
+            try:
+                self._executor.submit(self._run_batch, batch, [futures[t] for t in batch])
+            except RuntimeError as e:
+                # 检查之后 close 关闭了线程池: 未提交的请求就地失败并移出 _inflight, 合并等待的调用方不会一直挂起
+                error = RuntimeError("embedding 客户端已关闭")
+                unsent = to_send[start:]
+                with self._lock:
+                    for text in unsent:
+                        self._inflight.pop(text, None)
+                for text in unsent:
+                    futures[text].set_exception(error)
+                raise error from e
+
+        return [futures[text].result() for text in texts]
+
+    def _run_batch(self, texts: List[str], futures: List[Future]):
+        """工作线程: 发送一批请求并回填结果"""
+        try:
+            vectors = self._request_with_retry(texts)
+            if len(vectors) != len(texts):
+                # 条数对不上时无法确定对应关系, 整批失败, 不能把错位的向量交给调用方
+                raise EmbeddingRequestError(f"embedding 响应条数不符: 请求 {len(texts)} 条, 返回 {len(vectors)} 条")
+        except BaseException as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future, vector in zip(futures, vectors):
+                future.set_result(vector)
+        finally:
+            with self._lock:
+                for text in texts:
+                    self._inflight.pop(text, None)
+
+    def _request_with_retry(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            wait = self._resume_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if self._bucket is not None:
+                self._bucket.acquire()
+            try:
+                with metrics.span("embedding_request"):
+                    return self._request(texts)
+            except _RetryableError as e:
+                if attempt >= self.max_retries:
+                    raise EmbeddingRequestError(f"embedding 请求重试 {attempt} 次后仍失败: {e}") from e
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay = random.uniform(0, delay) if e.retry_after is None else max(e.retry_after, random.uniform(0, delay))
+                if metrics.enabled:
+                    metrics.incr("embedding_client", "retries")
+                attempt += 1
+                with self._lock:
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        if metrics.enabled:
+            metrics.incr("embedding_client", "requests")
+            metrics.incr("embedding_client", "texts", len(texts))
+        if self._session is None:
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                retryable = _retryable(e)
+                if retryable is None:
+                    raise
+                raise retryable from e
+
+        import requests
+        try:
+            response = self._session.post(
+                f"{self.base_url}/embeddings",
+                json={"model": self.model, "input": texts},
+                timeout=self.timeout
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _RetryableError(str(e)) from e
+
+        if response.status_code in _RETRY_STATUS:
+            raise _RetryableError(f"HTTP {response.status_code}", _retry_after(response.headers))
+        if response.status_code != 200:
+            raise EmbeddingRequestError(f"embedding 请求失败: HTTP {response.status_code} {response.text[:200]}")
+
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def close(self):
+        """关闭客户端: 已提交的请求会完成, 之后的调用抛出 RuntimeError"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        if self._session is not None:
+            self._session.close()
+
+
+def hash_embedding(text: str, dim: int) -> List[float]:
+    """由文本哈希生成确定性的伪向量, 供本地替身服务与测试使用"""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode('utf-8')).digest()
+        values.extend((b - 127.5) / 127.5 for b in digest)
+        counter += 1
+    return values[:dim]
+
+
+class LocalEmbeddingServer:
+    """
+        本地替身 embedding 服务: OpenAI 兼容的 POST /embeddings 接口
+        可设置每次请求的延迟与每秒请求上限 (超出返回 429 + Retry-After), 用于压测客户端
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dim: int = 64,
+                 latency: float = 0.0, rate_limit: Optional[float] = None):
+        self.dim = dim
+        self.latency = latency
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.requests = 0
+        self.rejected = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # 保持长连接, 客户端连接池才有意义
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                server.requests += 1
+                if server.bucket is not None and not server.bucket.try_acquire():
+                    server.rejected += 1
+                    self._send(429, {"error": "rate limited"}, {"Retry-After": f"{1 / server.bucket.rate:.3f}"})
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                self._send(200, {
+                    "object": "list",
+                    "model": body.get("model"),
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": hash_embedding(text, server.dim)}
+                        for i, text in enumerate(inputs)
+                    ]
+                })
+
+            def _send(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'LocalEmbeddingServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+############################### 测试部分 ###############################
+def main():
+    metrics.enable()
+    with LocalEmbeddingServer(latency=0.02, rate_limit=50) as server:
+        client = PooledEmbeddingClient(base_url=server.url, api_key="local", model="local",
+                                       max_concurrency=8, rate_limit=45, batch_size=8)
+        texts = [f"记忆 {i % 400}" for i in range(1000)] # 含大量重复, 测试合并
+
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=client.embed_documents, args=(texts[i::10],))
+            for i in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        client.close()
+
+        print(f"请求文本 {len(texts)} 条, 耗时 {elapsed:.2f}s, 吞吐 {len(texts) / elapsed:.1f} 条/秒")
+        print(f"服务端收到请求 {server.requests} 次, 其中限流拒绝 {server.rejected} 次")
+        print(f"客户端统计: {metrics.snapshot('embedding_client')}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from memory import MemoryType, MemoryItem
-from typing import Dict, Optional
+from metrics import metrics
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
+import math
 import numpy as np
 
 class MemoryValueEvaluator:
@@ -26,7 +28,7 @@ class MemoryValueEvaluator:
     
     def calculate_frequency_score(self, frequency: int) -> float:
         """记住归一化"""
-        return min(1.0, np.log1p(frequency) / np.log1p(10))
+        return min(1.0, math.log1p(frequency) / math.log1p(10))
 
     def calculate_future_utility(self, memory_type: MemoryType) -> float:
         """根据记忆类型估算未来有效性"""
@@ -53,30 +55,71 @@ class MemoryValueEvaluator:
         remaining_duration = (validity - now).total_seconds()
         return remaining_duration / total_duration if total_duration > 0 else 0.0
 
-    def evaluate(self, memory: MemoryItem) -> Dict[str, float]:
+    def _static_scores(self, memory: MemoryItem) -> Tuple[Dict[str, float], float]:
+        """
+            与时间无关的各维度得分及其加权和, 缓存在记忆对象上;
+            评分字段或权重变化后签名对不上, 下次调用时重新计算
+        """
+        signature = (
+            memory.importance, memory.frequency, memory.confidence, memory.memory_type,
+            memory.timestamp, memory.temporal_validity, tuple(self.weights.items())
+        )
+        cache = memory._score_cache
+        if cache is not None and cache[0] == signature:
+            if metrics.enabled:
+                metrics.incr("evaluate", "cache_hits")
+            return cache[1], cache[2]
+
+        if metrics.enabled:
+            metrics.incr("evaluate", "cache_misses")
         scores = {
             'importance': memory.importance,
             'frequency': self.calculate_frequency_score(memory.frequency),
             'future_utility': self.calculate_future_utility(memory.memory_type),
-            'temporal_validity': self.calculate_temporal_score(
-                memory.timestamp,
-                memory.temporal_validity
-            ),
             'confidence': memory.confidence
         }
+        static_total = sum(scores[key] * self.weights[key] for key in scores.keys())
+        memory._score_cache = (signature, scores, static_total)
+        return scores, static_total
 
-        total_score = sum(
-            scores[key] * self.weights[key]
-            for key in scores.keys()
-        )
+    @metrics.timed("evaluate")
+    def evaluate(self, memory: MemoryItem) -> Dict[str, float]:
+        static_scores, static_total = self._static_scores(memory)
+        # 只有时效性随当前时间变化, 每次重新计算; 无有效期时恒为 1
+        temporal_score = self.calculate_temporal_score(memory.timestamp, memory.temporal_validity)
 
-        scores['total_score'] = total_score
+        scores = dict(static_scores)
+        scores['temporal_validity'] = temporal_score
+        scores['total_score'] = static_total + temporal_score * self.weights['temporal_validity']
         return scores
 
+    @metrics.timed("evaluate_many")
+    def evaluate_many(self, memories: List[MemoryItem], now: Optional[datetime] = None) -> np.ndarray:
+        """批量计算综合得分 (与 evaluate 的 total_score 一致), 各维度按列向量化计算"""
+        n = len(memories)
+        if n == 0:
+            return np.empty(0)
+        now = (now or datetime.now()).timestamp()
+        # 与时间无关的部分复用每条记忆上的缓存, 只有时效性按列重新计算
+        static_total = np.fromiter((self._static_scores(m)[1] for m in memories), dtype=np.float64, count=n)
+        created = np.fromiter((m.timestamp.timestamp() for m in memories), dtype=np.float64, count=n)
+        validity = np.fromiter(
+            (m.temporal_validity.timestamp() if m.temporal_validity is not None else np.nan for m in memories),
+            dtype=np.float64, count=n
+        )
+
+        total = validity - created
+        with np.errstate(divide='ignore', invalid='ignore'):
+            temporal_score = np.where(total > 0, (validity - now) / total, 0.0)
+        temporal_score = np.where(now > validity, 0.0, temporal_score)
+        temporal_score = np.where(np.isnan(validity), 1.0, temporal_score)
+
+        return static_total + temporal_score * self.weights['temporal_validity']
+
 ############################### 测试部分 ###############################
-evaluator = MemoryValueEvaluator()
 def main():
     """测试记忆评估器"""
+    evaluator = MemoryValueEvaluator()
     print(f"评估维度权重: ")
     for dim, weight in evaluator.weights.items():
         print(f"    {dim}: {weight:.2f}")
@@ -0,0 +1,170 @@
+from collections import deque
+from typing import Any, Dict, Optional
+import atexit
+import logging
+import os
+import threading
+import time
+
+# 事件名 -> 展示模板, 字段直接传对象, 只有 sink 启用时才会 format
+EVENT_TEMPLATES: Dict[str, str] = {
+    # agent
+    'agent.init': "MemoryAgent Initialized!",
+    'agent.input': "\n用户输入: {user_input}\n分析中……",
+    'agent.no_memory': "! 未识别到需要存储的记忆（可能需要更明确的表达）\n",
+    'agent.llm_error': "LLM 返回格式错误, {error}",
+    'agent.store': "\n📝 记忆: {memory.content}\n   类型: {memory.memory_type.value}\n"
+                   "   优先级: {priority.value}\n   综合得分: {score:.3f}",
+    'agent.recall': "\n🔍 查询: {query}\n\n找到 {count} 条相关记忆:\n",
+    'agent.recall_item': "{rank}. [{memory.memory_type.value}] {memory.content}\n   相似度: {score:.4f}\n",
+    # kv / vector
+    'kv.set': "✅ 已存储: {key} -> {memory.content}",
+    'vector.add': "向量化存储: {memory.content}",
+    'vector.delete': "🗑️  已删除向量: {memory.content}",
+    'vector.update': "♻️  已更新向量: {memory.content}",
+    'vector.compact': "🧹 向量库压缩: 清理 {cleaned} 条墓碑, 剩余 {size} 行",
+    # priority
+    'priority.store': "[{priority.value}] -> {storage}\n    内容: {memory.content}\n    综合得分: {score:.3f}",
+    'priority.spill': "💾 已将 {count} 条中/短期记忆换出到冷存储 (冷存储共 {cold} 条)",
+    'priority.retier': "🔀 重新分级: {total} 条记忆中 {moved} 条换层",
+    'priority.promote': "⬆️  {count} 条冷存储记忆晋升为长期记忆",
+    # version
+    'version.add': "✨ 新增记忆: {key} -> {memory.content}",
+    'version.update': "⚠️  检测到记忆更新: {key}\n   旧版本: {old.content}\n   新版本: {new.content}\n   版本号: v{version}",
+    'version.resolved': "   ✅ 冲突已解决，采用: {memory.content}",
+    'version.strategy_user': "   🎯 策略: 用户反馈优先",
+    'version.strategy_new': "   ⚖️  策略: 高置信度优先 (新:{new:.2f} > 旧:{old:.2f})",
+    'version.strategy_old': "   ⚖️  策略: 保持高置信度 (旧:{old:.2f} > 新:{new:.2f})",
+    'version.strategy_time': "   ⏰ 策略: 时间优先（置信度相同）",
+    'version.rollback': "🔙 已回滚 {key} 到版本 v{version}",
+    'decay.start': "\n⏳ 应用时间衰减 (经过{days}天)...\n",
+    'decay.skip': "    {key}: 不衰减 (类型: {memory.memory_type.value})",
+    'decay.apply': "  {key}: {old:.3f} -> {new:.3f}",
+    # consolidation
+    'consolidation.done': "🧩 记忆整合: 扫描 {scanned} 条, 合并 {clusters} 个簇, 替换 {merged} 条记忆",
+    'consolidation.llm_error': "记忆整合 LLM 总结失败, 沿用默认内容: {error}",
+    'consolidation.error': "记忆整合失败: {error}",
+    # frequency
+    'frequency.repeat': "🔁 重复出现 (约 {count} 次), 提高原记忆频率: {memory.content}",
+    'frequency.pending': "⏸️  低优先级信号出现 {count}/{threshold} 次, 暂不存储: {memory.content}",
+    # writer
+    'writer.realtime': "⚡ [实时写入] 触发",
+    'writer.batch_add': "📦 [批处理] 已加入缓冲区，当前缓冲: {size} 条",
+    'writer.batch_empty': "📦 [批处理] 缓冲区为空，无需写入",
+    'writer.batch_start': "\n📦 [批处理] 开始写入 {size} 条记忆...",
+    'writer.batch_done': "✅ [批处理] 完成，已写入 {size} 条记忆",
+    'writer.event': "🎯 [事件触发] 事件: {event_type}",
+    'writer.feedback': "💬 [用户反馈] 指令: {command}",
+}
+
+
+def format_event(name: str, fields: Dict[str, Any]) -> str:
+    """按模板格式化事件, 没有模板的事件输出 name + 字段"""
+    template = EVENT_TEMPLATES.get(name)
+    if template is None:
+        return f"[{name}] " + " ".join(f"{k}={v}" for k, v in fields.items())
+    return template.format(**fields)
+
+
+class NullSink:
+    """丢弃所有事件, 用于高吞吐的静默模式"""
+    enabled = False
+
+    def handle(self, name: str, fields: Dict[str, Any]):
+        pass
+
+    def flush(self):
+        pass
+
+
+class ConsoleSink:
+    """REPL 展示: 每个事件立即格式化并 print"""
+    enabled = True
+
+    def handle(self, name: str, fields: Dict[str, Any]):
+        print(format_event(name, fields))
+
+    def flush(self):
+        pass
+
+
+class BufferedLogSink:
+    """
+        缓冲日志: 事件在 emit 时即格式化 (记录的是当时的状态, 不持有记忆等对象),
+        文本放入定长缓冲区, 满了、手动 flush 或解释器退出时写入 logging
+    """
+    enabled = True
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO,
+                 capacity: int = 1024):
+        self.logger = logger or logging.getLogger("memolite")
+        self.level = level
+        self.capacity = capacity
+        self.buffer: deque = deque()
+        self._lock = threading.Lock()
+
+    def handle(self, name: str, fields: Dict[str, Any]):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.buffer.append((time.time(), name, format_event(name, fields).strip()))
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            while self.buffer:
+                ts, name, message = self.buffer.popleft()
+                self.logger.log(self.level, "%s %s", name, message)
+
+
+class EventBus:
+    """结构化事件总线: 各模块只调用 emit, 输出方式由可插拔的 sink 决定"""
+
+    def __init__(self, sink=None):
+        self.set_sink(sink if sink is not None else ConsoleSink())
+
+    def set_sink(self, sink):
+        """切换 sink, 返回旧的 sink 方便恢复"""
+        old = getattr(self, 'sink', None)
+        if old is not None:
+            old.flush()
+        self.sink = sink
+        self.enabled = sink.enabled
+        return old
+
+    def emit(self, name: str, **fields):
+        if not self.enabled:
+            return
+        self.sink.handle(name, fields)
+
+    def flush(self):
+        self.sink.flush()
+
+
+def _sink_from_env():
+    """MEMOLITE_EVENTS: console (默认) | log | off"""
+    mode = os.getenv("MEMOLITE_EVENTS", "console").lower()
+    if mode in ("off", "none", "quiet"):
+        return NullSink()
+    if mode == "log":
+        return BufferedLogSink()
+    return ConsoleSink()
+
+
+# 全局事件总线; 退出时把缓冲中的事件写出 (在 logging 自身的退出清理之前执行)
+events = EventBus(_sink_from_env())
+atexit.register(events.flush)
+
+############################### 测试部分 ###############################
+def main():
+    from memory import sample_memories
+    print("控制台输出:")
+    events.emit("vector.add", memory=sample_memories[0])
+
+    old = events.set_sink(NullSink())
+    events.emit("vector.add", memory=sample_memories[1])
+    print("静默模式: 以上事件未输出")
+    events.set_sink(old)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 from agent import SmartMemoryAgent
-from config import llm, embeddings, config
+from config import config, get_llm, get_embedding_client
 import sys
 
 def main():
-    agent = SmartMemoryAgent(embeddings=embeddings, llm=llm, config=config)
+    agent = SmartMemoryAgent(embeddings=get_embedding_client(), llm=get_llm(), config=config)
 
     print("\n" + "="*70)
     print("🤖 欢迎使用 MemoLite - 一个轻量的 Memory Agent")
@@ -35,6 +35,9 @@ class MemoryItem:
     temporal_validity: Optional[datetime] = None
     metadata: Dict[str, Any] = None
 
+    # 评估器的分数缓存 (签名, 各维度得分, 加权和), 不是数据字段, 不参与比较与导出
+    _score_cache = None
+
     def __post_init__(self):
         if self.metadata is None:
             self.metadata = {}
@@ -49,6 +52,21 @@ class MemoryItem:
             data['temporal_validity'] = self.temporal_validity.isoformat()
         return data
 
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'MemoryItem':
+        """从 to_dict 的结果还原"""
+        temporal_validity = data.get('temporal_validity')
+        return cls(
+            content=data['content'],
+            memory_type=MemoryType(data['memory_type']),
+            timestamp=datetime.fromisoformat(data['timestamp']),
+            importance=data.get('importance', 0.5),
+            frequency=data.get('frequency', 1),
+            confidence=data.get('confidence', 0.8),
+            temporal_validity=datetime.fromisoformat(temporal_validity) if temporal_validity else None,
+            metadata=data.get('metadata')
+        )
+
     
 
 ############################### 测试部分 ###############################
@@ -0,0 +1,196 @@
+from collections import defaultdict
+from functools import wraps
+from typing import Dict, Optional
+import bisect
+import os
+import threading
+import time
+
+# 直方图桶上界(微秒): 1us, 2us, 4us, ... 约 134s, 超出的落到最后一个溢出桶
+_BUCKET_BOUNDS_US = tuple(float(2 ** i) for i in range(28))
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图, 记录 O(1), 百分位在桶内线性插值估算"""
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS_US) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        us = seconds * 1e6
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS_US, us)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """估算第 p 百分位 (秒)"""
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            if c == 0:
+                continue
+            if cumulative + c >= rank:
+                lower = _BUCKET_BOUNDS_US[i - 1] if i > 0 else 0.0
+                upper = _BUCKET_BOUNDS_US[i] if i < len(_BUCKET_BOUNDS_US) else self.max * 1e6
+                value = (lower + (upper - lower) * (rank - cumulative) / c) / 1e6
+                return min(max(value, self.min), self.max)
+            cumulative += c
+        return self.max
+
+    def to_dict(self) -> Dict[str, float]:
+        """转换为字典格式, 时间单位为毫秒"""
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1e3,
+            'mean_ms': self.total / self.count * 1e3,
+            'min_ms': self.min * 1e3,
+            'max_ms': self.max * 1e3,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p95_ms': self.percentile(95) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+        }
+
+
+class _Span:
+    """计时上下文, 退出时把耗时记到对应操作"""
+
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    """关闭统计时使用的共享空上下文"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """
+        热路径耗时与计数统计:
+        - 每个操作一个延迟直方图
+        - 每个操作若干计数器 (calls, bytes, cache_hits ...)
+        关闭时 span/timed/incr 只做一次布尔判断, 不分配任何对象
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def span(self, name: str):
+        """计时上下文: with metrics.span('op'): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name: str):
+        """计时装饰器, 关闭时直接调用原函数"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def observe(self, name: str, seconds: float):
+        """记录一次耗时, 同时累加调用次数"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.record(seconds)
+            self._counters[name]['calls'] += 1
+
+    def incr(self, name: str, counter: str = 'calls', n: int = 1):
+        """累加计数器, 参数计算代价较高时调用方应先判断 enabled"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name][counter] += n
+
+    def snapshot(self, name: Optional[str] = None) -> Dict[str, Dict]:
+        """导出当前统计: {操作: {计数器..., 'latency': {...}}}"""
+        with self._lock:
+            names = [name] if name is not None else sorted(set(self._histograms) | set(self._counters))
+            result = {}
+            for op in names:
+                entry = dict(self._counters.get(op, {}))
+                histogram = self._histograms.get(op)
+                if histogram is not None:
+                    entry['latency'] = histogram.to_dict()
+                result[op] = entry
+            return result
+
+
+# 全局统计实例, 通过环境变量 MEMOLITE_METRICS=1 默认开启, 也可以运行时 metrics.enable()
+metrics = MetricsRegistry(
+    enabled=os.getenv("MEMOLITE_METRICS", "0").lower() in ("1", "true", "yes", "on")
+)
+
+############################### 测试部分 ###############################
+def main():
+    metrics.enable()
+    for i in range(1000):
+        with metrics.span("demo"):
+            sum(range(i))
+    metrics.incr("demo", "bytes", 1024)
+
+    for op, stats in metrics.snapshot().items():
+        latency = stats.get('latency', {})
+        print(f"{op}: calls={stats.get('calls', 0)} bytes={stats.get('bytes', 0)} "
+              f"p50={latency.get('p50_ms', 0):.4f}ms p99={latency.get('p99_ms', 0):.4f}ms")
+
+if __name__ == "__main__":
+    main()
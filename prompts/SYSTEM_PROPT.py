@@ -89,3 +89,24 @@ EXTRACTION_PROMPT = """
 
 只返回 JSON，不要其他文字。
 """
+
+
+CONSOLIDATION_PROMPT = """
+下面是若干组语义重复的记忆, 每组都来自同一个用户、同一种记忆类型。
+请把每一组合并成一条简洁、完整、不丢失关键信息的记忆。
+
+{clusters}
+
+请按以下格式返回 JSON（每组一条, cluster 与上面的组号对应）:
+[
+  {{
+    "cluster": 0,
+    "content": "合并后的记忆内容"
+  }}
+]
+
+要求:
+- 只返回 JSON，不要其他文字
+- 组内信息冲突时，以出现次数多、表述更具体的为准
+- 保持与原记忆相同的语言
+"""
@@ -0,0 +1,287 @@
+# 负载回放: 把录制的 JSONL 对话喂给一个或多个 SmartMemoryAgent, 统计各类命令的吞吐与延迟分位数
+from agent import SmartMemoryAgent
+from config import config, get_llm, get_embeddings, get_pooled_embedding_client
+from embedding_client import TokenBucket, hash_embedding
+from memory import MemoryType
+from metrics import MetricsRegistry, metrics
+from events import events, NullSink
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+# 录制格式: 每行一条命令, 与 main.py 的交互输入一致
+#   {"session": "u1", "text": "我是一名数据科学家", "t": 0.0}
+#   {"session": "u1", "text": "recall 用户的职业是什么?", "t": 1.5}
+#   {"session": "u1", "text": "report"}
+# session 缺省为 "default"; t 为相对录制开始的秒数, 仅在按录制节奏回放 (speed) 时使用
+# 同一 session 的命令按顺序串行执行, 不同 session 之间并发
+
+
+@dataclass
+class ReplayCommand:
+    """一条回放命令"""
+    session: str
+    kind: str       # 'input' | 'recall' | 'report'
+    text: str       # input 的原文或 recall 的查询
+    offset: Optional[float] = None
+
+
+def parse_command(text: str) -> Tuple[str, str]:
+    """按 REPL 的规则解析一行输入, 返回 (命令类型, 参数)"""
+    text = text.strip()
+    if text.lower() == 'report':
+        return 'report', ''
+    if text.lower().startswith('recall '):
+        return 'recall', text[7:]
+    return 'input', text
+
+
+def load_transcript(path: str) -> Dict[str, List[ReplayCommand]]:
+    """读取录制文件, 按 session 分组并保持原顺序 (退出命令与空行忽略)"""
+    sessions: Dict[str, List[ReplayCommand]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = record['text'].strip()
+            if not text or text.lower() in ('exit', 'quit', 'q'):
+                continue
+            kind, arg = parse_command(text)
+            session = str(record.get('session', 'default'))
+            sessions.setdefault(session, []).append(ReplayCommand(session, kind, arg, record.get('t')))
+    return sessions
+
+
+def synthesize_transcript(path: str, sessions: int = 8, turns: int = 50, recall_ratio: float = 0.3,
+                          report_every: int = 0, seed: int = 0) -> int:
+    """生成合成的录制文件 (压测/回归用), 返回命令条数"""
+    rng = random.Random(seed)
+    topics = ["职业", "饮食偏好", "项目进度", "出行计划", "学习目标", "家庭成员", "运动习惯", "工作地点"]
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for turn in range(turns):
+            for s in range(sessions):
+                topic = rng.choice(topics)
+                if rng.random() < recall_ratio:
+                    text = f"recall 用户的{topic}是什么?"
+                else:
+                    text = f"关于{topic}: 用户 {s} 第 {turn} 次提到细节 {rng.randint(0, 999)}"
+                record = {'session': f"s{s}", 'text': text, 't': turn + s / sessions}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+            if report_every and (turn + 1) % report_every == 0:
+                f.write(json.dumps({'session': 's0', 'text': 'report', 't': turn + 1}) + '\n')
+                count += 1
+    return count
+
+
+############################### 替身后端 ###############################
+class StubEmbeddings:
+    """确定性的本地 embedding 替身 (文本哈希), 可模拟请求延迟"""
+
+    def __init__(self, dim: int = 64, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return hash_embedding(text, self.dim)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [hash_embedding(text, self.dim) for text in texts]
+
+
+class StubLLM:
+    """LLM 替身: 把用户输入原样作为一条记忆返回, 类型与重要性由文本哈希决定, 可模拟延迟"""
+
+    _INPUT = re.compile(r"用户输入: (.*)")
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def invoke(self, prompt: str):
+        if self.latency:
+            time.sleep(self.latency)
+        match = self._INPUT.search(prompt)
+        if match is None:
+            return SimpleNamespace(content="[]")
+        text = match.group(1).strip()
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        memory = {
+            'content': text,
+            'memory_type': list(MemoryType)[digest[0] % len(MemoryType)].name,
+            'importance': round(digest[1] / 255, 2),
+            'confidence': round(0.5 + digest[2] / 510, 2),
+            'temporal_validity': None,
+            'metadata': {}
+        }
+        return SimpleNamespace(content=json.dumps([memory], ensure_ascii=False))
+
+
+def build_backends(backend: str = 'stub', dim: int = 64, embed_latency: float = 0.0,
+                   llm_latency: float = 0.0) -> Tuple[object, object]:
+    """构建 (embeddings, llm): 'stub' 本地替身, 'real' 配置中的服务, 'pooled' 服务 + 并发 embedding 客户端"""
+    if backend == 'stub':
+        return StubEmbeddings(dim, embed_latency), StubLLM(llm_latency)
+    if backend == 'real':
+        return get_embeddings(), get_llm()
+    if backend == 'pooled':
+        return get_pooled_embedding_client(), get_llm()
+    raise ValueError(f"未知后端: {backend}")
+
+
+############################### 回放 ###############################
+class ReplayHarness:
+    """
+        回放器
+        - 多个 agent: session 按名字哈希固定分配到某个 agent
+        - 并发: concurrency 个工作线程, 每个线程一次串行回放一个 session
+        - 节奏: rate 限制全局每秒命令数; speed 按录制时间戳回放 (2.0 表示两倍速)
+        延迟按命令类型统计, 用独立的 MetricsRegistry, 与全局热路径统计互不干扰
+    """
+
+    def __init__(self, agent_factory: Callable[[], SmartMemoryAgent], agents: int = 1, concurrency: int = 4,
+                 rate: Optional[float] = None, speed: Optional[float] = None):
+        self.agents = [agent_factory() for _ in range(agents)]
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, 1.0) if rate else None # 不积攒突发, 严格按速率放行
+        self.speed = speed
+        self.stats = MetricsRegistry(enabled=True)
+        self.errors: List[str] = []
+        self._errors_lock = threading.Lock()
+
+    def agent_for(self, session: str) -> SmartMemoryAgent:
+        digest = hashlib.md5(session.encode('utf-8')).digest()
+        return self.agents[int.from_bytes(digest[:4], 'little') % len(self.agents)]
+
+    def run(self, sessions: Dict[str, List[ReplayCommand]]) -> Dict:
+        """回放全部 session, 返回统计结果"""
+        self.stats.reset()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="replay") as executor:
+            for future in [executor.submit(self._run_session, commands, start)
+                           for commands in sessions.values()]:
+                future.result()
+        return self.summary(time.perf_counter() - start)
+
+    def _run_session(self, commands: List[ReplayCommand], start: float):
+        agent = self.agent_for(commands[0].session)
+        for command in commands:
+            if self.speed and command.offset is not None:
+                delay = start + command.offset / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if self.bucket is not None:
+                self.bucket.acquire()
+            began = time.perf_counter()
+            try:
+                self._execute(agent, command)
+            except Exception as e:
+                self.stats.incr(command.kind, 'errors')
+                with self._errors_lock:
+                    self.errors.append(f"[{command.session}] {command.kind}: {e}")
+            else:
+                self.stats.observe(command.kind, time.perf_counter() - began)
+
+    def _execute(self, agent: SmartMemoryAgent, command: ReplayCommand):
+        if command.kind == 'input':
+            agent.process_user_input(command.text)
+        elif command.kind == 'recall':
+            agent.recall(command.text)
+        elif events.enabled:
+            agent.get_report()
+        else:
+            agent.format_report() # 静默模式下不输出报告正文, 只计耗时
+
+    def summary(self, elapsed: float) -> Dict:
+        """汇总: 总吞吐与每类命令的次数/吞吐/延迟分位数 (毫秒)"""
+        snapshot = self.stats.snapshot()
+        commands = {}
+        total = 0
+        for kind, stats in snapshot.items():
+            calls = stats.get('calls', 0)
+            total += calls
+            commands[kind] = {
+                'calls': calls,
+                'errors': stats.get('errors', 0),
+                'throughput': calls / elapsed if elapsed > 0 else 0.0,
+                'latency': stats.get('latency', {})
+            }
+        return {
+            'elapsed_s': elapsed,
+            'commands': total,
+            'throughput': total / elapsed if elapsed > 0 else 0.0,
+            'agents': len(self.agents),
+            'concurrency': self.concurrency,
+            'by_command': commands
+        }
+
+
+def print_summary(summary: Dict):
+    print("\n" + "="*70)
+    print("🔁 回放结果")
+    print("="*70)
+    print(f"  agent 数: {summary['agents']} | 并发: {summary['concurrency']} | "
+          f"命令: {summary['commands']} 条 | 耗时 {summary['elapsed_s']:.2f}s | 吞吐 {summary['throughput']:.1f} 条/秒")
+    for kind, stats in sorted(summary['by_command'].items()):
+        latency = stats['latency']
+        line = f"  {kind}: {stats['calls']} 次 | {stats['throughput']:.1f} 次/秒"
+        if latency.get('count'):
+            line += (f" | 平均 {latency['mean_ms']:.2f}ms | p50 {latency['p50_ms']:.2f}ms | "
+                     f"p95 {latency['p95_ms']:.2f}ms | p99 {latency['p99_ms']:.2f}ms | 最大 {latency['max_ms']:.2f}ms")
+        if stats['errors']:
+            line += f" | 错误 {stats['errors']} 次"
+        print(line)
+    print("="*70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的 MemoLite 对话, 统计吞吐与延迟")
+    parser.add_argument("transcript", help="JSONL 录制文件")
+    parser.add_argument("--agents", type=int, default=1, help="agent 实例数, session 按哈希分配")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发回放的 session 数")
+    parser.add_argument("--rate", type=float, default=None, help="全局每秒命令数上限")
+    parser.add_argument("--speed", type=float, default=None, help="按录制时间戳回放的倍速")
+    parser.add_argument("--backend", choices=("stub", "real", "pooled"), default="stub")
+    parser.add_argument("--dim", type=int, default=64, help="替身 embedding 维度")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="替身 embedding 每次请求的延迟 (秒)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="替身 LLM 每次调用的延迟 (秒)")
+    parser.add_argument("--synthesize", type=int, default=0, metavar="TURNS",
+                        help="先生成每个 session TURNS 轮的合成录制文件写到 transcript")
+    parser.add_argument("--sessions", type=int, default=8, help="合成录制的 session 数")
+    parser.add_argument("--verbose", action="store_true", help="保留事件输出 (默认静默)")
+    parser.add_argument("--json", dest="json_path", default=None, help="把统计结果另存为 JSON")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        count = synthesize_transcript(args.transcript, args.sessions, args.synthesize)
+        print(f"已生成合成录制: {args.transcript} ({count} 条命令)")
+    if not args.verbose:
+        events.set_sink(NullSink())
+    metrics.enable() # 同时打开热路径统计, 报告命令可以看到细分耗时
+
+    embeddings, llm = build_backends(args.backend, args.dim, args.embed_latency, args.llm_latency)
+    harness = ReplayHarness(lambda: SmartMemoryAgent(embeddings, llm, config),
+                            args.agents, args.concurrency, args.rate, args.speed)
+    summary = harness.run(load_transcript(args.transcript))
+    print_summary(summary)
+    for error in harness.errors[:10]:
+        print(f"  ❌ {error}")
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
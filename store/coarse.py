@@ -0,0 +1,243 @@
+# 粗排索引: 向量池的低维投影 (PCA 或前缀截断), 先在小矩阵上挑候选, 再用全维向量精排
+from metrics import metrics
+from typing import Optional, Tuple
+import threading
+import numpy as np
+
+COARSE_METHODS = ('pca', 'prefix')
+
+
+class CoarseIndex:
+    """
+        低维粗排矩阵, 行与 VectorMemoryStore 的行一一对应
+        - pca:    在归一化向量的二阶矩 Σxxᵀ 上取前 dim 个主方向投影, 保留点积排序的主要信息;
+                  二阶矩随新增向量增量累加, 新增量超过 refit_ratio 时重新分解并重投影
+        - prefix: 取前 dim 维后归一化, 适用于 Matryoshka 式训练的 embedding 模型
+        新增的行在下次检索前增量投影; 首次累加二阶矩、拟合与整体重投影 (首次/重新拟合/压缩或挂载后)
+        在后台线程进行, 不占用检索线程
+    """
+
+    def __init__(self, dim: int = 128, method: str = 'pca', oversample: int = 8,
+                 min_candidates: int = 64, refit_ratio: float = 0.5, inline_rows: int = 1024):
+        if method not in COARSE_METHODS:
+            raise ValueError(f"未知粗排方式: {method}, 可选 {COARSE_METHODS}")
+        if dim <= 0:
+            raise ValueError(f"粗排维度必须为正数: {dim}")
+        self.dim = dim
+        self.method = method
+        self.oversample = oversample
+        self.min_candidates = min_candidates
+        self.refit_ratio = refit_ratio
+        self.inline_rows = inline_rows # 检索线程顺带累加二阶矩的最大新增行数, 更多时交给后台
+
+        self._compact: Optional[np.ndarray] = None # (容量, dim) 投影后的行
+        self.size = 0                              # 已投影的行数
+        self.layout: Optional[int] = None          # 对应的向量池行布局版本
+        # pca 拟合状态: 二阶矩, 已累加的最大记忆 id, 累加行数, 上次拟合时的行数, 投影矩阵
+        self._moment: Optional[np.ndarray] = None
+        self._moment_id = -1
+        self._moment_rows = 0
+        self._fitted_rows = 0
+        self._components: Optional[np.ndarray] = None
+        # _sync_lock 串行化同步与后台重建的替换; _lock 只保护 (投影矩阵, 粗排矩阵, 行数) 的整体替换
+        self._sync_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._rebuild_thread: Optional[threading.Thread] = None
+
+    def _project(self, normalized: np.ndarray, components: Optional[np.ndarray]) -> np.ndarray:
+        if self.method == 'prefix':
+            prefix = normalized[:, :self.dim]
+            return prefix / np.maximum(np.linalg.norm(prefix, axis=1, keepdims=True), 1e-12)
+        return normalized @ components
+
+    def _fit(self, moment: np.ndarray) -> np.ndarray:
+        """对二阶矩做特征分解, 返回最大的 dim 个特征向量组成的投影矩阵"""
+        _, vectors = np.linalg.eigh(moment)
+        return np.ascontiguousarray(vectors[:, ::-1][:, :self.dim], dtype=np.float32)
+
+    @metrics.timed("coarse_sync")
+    def sync(self, matrix: np.ndarray, norms: np.ndarray, ids: np.ndarray, n: int,
+             layout: int = 0, chunk: int = 16384) -> bool:
+        """
+            把向量池 [0, n) 行同步到粗排矩阵, 返回此刻粗排矩阵能否用于检索
+            - 新增行: 用当前投影矩阵增量投影; 新增不超过 inline_rows 行时顺带累加二阶矩, 开销与新增行数成正比
+            - 首次累加/大批新增/重新拟合/行布局变化: 二阶矩累加、特征分解与整体重投影交给后台线程;
+              期间沿用旧投影, 没有可用投影 (首次或布局已变) 时返回 False, 调用方退回全量检索
+            向量维度不大于粗排维度 (开启时向量池还是空的) 或 layout 比已同步的版本旧时返回 False
+        """
+        with self._sync_lock:
+            full = matrix.shape[1]
+            if self.dim >= full or (self.layout is not None and layout < self.layout):
+                return False
+
+            if self._rebuild_thread is None:
+                rebuild = layout != self.layout
+                if self.method == 'pca':
+                    start = int(np.searchsorted(ids[:n], self._moment_id, side='right'))
+                    if start < n and self._moment is not None and n - start <= self.inline_rows:
+                        self._moment += self._second_moment(matrix, norms, start, n, chunk)
+                        self._moment_rows += n - start
+                        self._moment_id = int(ids[n - 1])
+                        start = n
+                    rebuild = rebuild or start < n or self._needs_refit(self._moment_rows)
+                if rebuild:
+                    # 后台线程运行期间二阶矩只由它累加, 这里不再动
+                    self._rebuild_thread = threading.Thread(
+                        target=self._rebuild, args=(matrix, norms, ids, n, layout, chunk),
+                        name="coarse-rebuild", daemon=True
+                    )
+                    self._rebuild_thread.start()
+            if layout != self.layout or (self.method == 'pca' and self._components is None):
+                return False
+
+            # 增量投影 [size, n): 检索只读 [0, size), 可以原地写; 容量不足时换新数组
+            if self.size < n:
+                compact = self._compact
+                if len(compact) < n:
+                    compact = np.zeros((max(n, 2 * len(compact)), self.dim), dtype=np.float32)
+                    compact[:self.size] = self._compact[:self.size]
+                for s in range(self.size, n, chunk):
+                    e = min(n, s + chunk)
+                    compact[s:e] = self._project(self._normalized(matrix, norms, s, e), self._components)
+                with self._lock:
+                    self._compact, self.size = compact, n
+        return True
+
+    def _needs_refit(self, moment_rows: int) -> bool:
+        return self._components is None or moment_rows - self._fitted_rows > self._fitted_rows * self.refit_ratio
+
+    def _second_moment(self, matrix: np.ndarray, norms: np.ndarray, start: int, end: int, chunk: int) -> np.ndarray:
+        moment = np.zeros((matrix.shape[1], matrix.shape[1]), dtype=np.float64)
+        for s in range(start, end, chunk):
+            rows = self._normalized(matrix, norms, s, min(end, s + chunk))
+            moment += rows.T @ rows # float32 乘, float64 累加
+        return moment
+
+    def _rebuild(self, matrix: np.ndarray, norms: np.ndarray, ids: np.ndarray, n: int, layout: int, chunk: int):
+        """后台: 累加尚未计入的二阶矩, (需要时) 重新拟合, 再把 [0, n) 行整体投影到新数组, 完成后整体替换"""
+        try:
+            refit = False
+            moment, moment_id, moment_rows = self._moment, self._moment_id, self._moment_rows
+            if self.method == 'pca':
+                start = int(np.searchsorted(ids[:n], moment_id, side='right'))
+                if start < n:
+                    added = self._second_moment(matrix, norms, start, n, chunk)
+                    moment = added if moment is None else moment + added
+                    moment_rows += n - start
+                    moment_id = int(ids[n - 1])
+                refit = moment is not None and self._needs_refit(moment_rows)
+            components = self._fit(moment) if refit else self._components
+            compact = None
+            if refit or layout != self.layout:
+                compact = np.zeros((max(n, 64), self.dim), dtype=np.float32)
+                for s in range(0, n, chunk):
+                    e = min(n, s + chunk)
+                    compact[s:e] = self._project(self._normalized(matrix, norms, s, e), components)
+        except BaseException:
+            with self._sync_lock:
+                self._rebuild_thread = None
+            raise
+        with self._sync_lock:
+            self._rebuild_thread = None
+            self._moment, self._moment_id, self._moment_rows = moment, moment_id, moment_rows
+            if compact is None or (self.layout is not None and layout < self.layout):
+                return # 只累加了二阶矩, 或期间已同步到更新的布局
+            if refit:
+                self._fitted_rows = moment_rows
+            # 此后 [n, 当前行数) 由下次 sync 用新投影增量补上
+            with self._lock:
+                self._components, self._compact, self.size, self.layout = components, compact, n, layout
+
+    def wait(self):
+        """等待正在进行的后台重建完成"""
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join()
+
+    @staticmethod
+    def _normalized(matrix: np.ndarray, norms: np.ndarray, start: int, end: int) -> np.ndarray:
+        return np.asarray(matrix[start:end], dtype=np.float32) / np.maximum(norms[start:end], 1e-12)[:, None]
+
+    def candidates(self, Q: np.ndarray, top_k: int, n: int, layout: int = 0,
+                   mask: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+            粗排: 在低维矩阵 [0, n) 行上为每个查询挑出 top_k * oversample 个候选行, shape (m, c)
+            Q 为已归一化的全维查询; mask 为 False 的行不入选; 粗排矩阵与 layout/n 对不上时返回 None
+        """
+        with self._lock:
+            if self.layout != layout or self.size < n:
+                return None
+            components, compact = self._components, self._compact[:n]
+        scores = self._project(np.atleast_2d(Q), components).astype(np.float32) @ compact.T
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        count = min(len(compact), max(top_k * self.oversample, self.min_candidates))
+        if mask is not None:
+            count = min(count, int(mask.sum()))
+        if count <= 0:
+            return np.empty((len(scores), 0), dtype=np.int64)
+        if count >= scores.shape[1]:
+            return np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        return np.argpartition(-scores, count - 1, axis=1)[:, :count]
+
+    def get_statistics(self) -> dict:
+        return {
+            'method': self.method,
+            'dim': self.dim,
+            'rows': self.size,
+            'fitted_rows': self._fitted_rows,
+            'pending_fit_rows': self._moment_rows - self._fitted_rows
+        }
+
+
+def rerank(matrix: np.ndarray, norms: np.ndarray, q: np.ndarray, rows: np.ndarray, top_k: int,
+           mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """精排: 只对候选行计算全维余弦相似度, 返回 (行号, 相似度), 降序"""
+    from store.vector_store import top_k_indices
+    rows = np.sort(rows) # 顺序读取候选行, 对内存更友好
+    scores = (matrix[rows] @ q) / np.maximum(norms[rows], 1e-12)
+    if mask is not None:
+        scores = np.where(mask[rows], scores, -np.inf)
+        top_k = min(top_k, int(mask[rows].sum()))
+    order = top_k_indices(scores, top_k)
+    return rows[order], scores[order]
+
+
+############################### 测试部分 ###############################
+def main():
+    import time
+    from store.vector_store import top_k_indices
+
+    # 合成数据: 少数主方向 + 噪声, 近似真实 embedding 的低秩结构
+    rng = np.random.default_rng(0)
+    n, full, dim = 100000, 1024, 128
+    basis = rng.standard_normal((128, full)).astype(np.float32)
+    matrix = (rng.standard_normal((n, 128)).astype(np.float32) @ basis) + \
+        0.3 * rng.standard_normal((n, full)).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    ids = np.arange(n, dtype=np.int64)
+
+    index = CoarseIndex(dim=dim)
+    start = time.perf_counter()
+    index.sync(matrix, norms, ids, n)
+    index.wait()
+    print(f"拟合并投影 {n} 行: {time.perf_counter() - start:.2f}s, 粗排矩阵 {index._compact.nbytes / 2**20:.1f}MB "
+          f"(全维 {matrix.nbytes / 2**20:.1f}MB)")
+
+    queries = matrix[rng.integers(0, n, 50)] + 0.5 * rng.standard_normal((50, full)).astype(np.float32)
+    Q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    top_k, hits = 10, 0
+    exact_time = coarse_time = 0.0
+    for q in Q:
+        t = time.perf_counter()
+        exact = top_k_indices((matrix @ q) / norms, top_k)
+        exact_time += time.perf_counter() - t
+        t = time.perf_counter()
+        rows, _ = rerank(matrix, norms, q, index.candidates(q[None, :], top_k, n)[0], top_k)
+        coarse_time += time.perf_counter() - t
+        hits += len(set(exact) & set(rows))
+    print(f"recall@{top_k}: {hits / (len(Q) * top_k):.3f} | 全量 {exact_time / len(Q) * 1e3:.2f}ms/次 | "
+          f"粗排+精排 {coarse_time / len(Q) * 1e3:.2f}ms/次")
+
+if __name__ == "__main__":
+    main()
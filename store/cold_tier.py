@@ -0,0 +1,445 @@
+# 冷存储: 分级存储模式下, 中/短期记忆连同向量换出到本地段文件, 内存里每行只留几个字节的索引
+from memory import MemoryItem, MemoryType
+from store.vector_store import top_k_indices
+from metrics import metrics
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+import numpy as np
+
+COLD_TIERS = ('mid_term', 'short_term')
+_MEMORY_TYPES = list(MemoryType)
+_TYPE_CODES = {t: i for i, t in enumerate(_MEMORY_TYPES)}
+
+# 段文件布局 (每次换出写一个或多个段, 段写完后只读):
+#   seg_NNNNNN.f32    向量矩阵, float32 行优先, 检索时只读映射, 由操作系统按页换入
+#   seg_NNNNNN.jsonl  每行一条 MemoryItem.to_dict(), 与向量行一一对应
+# 记忆在冷存储中的位置用 (段号, 行号) 表示; 段文件按 file_id 命名, 清空后重新编号的段不会覆盖仍被导出读取的旧文件
+
+
+@dataclass
+class _Segment:
+    """一个段的常驻索引: 模长/类型/层级/存活标记, 向量矩阵按需映射"""
+    number: int
+    dim: int
+    norms: np.ndarray
+    types: np.ndarray   # 记忆类型编码
+    tiers: np.ndarray   # COLD_TIERS 下标
+    alive: np.ndarray   # 被取回热层或删除的行置 False
+    validity: np.ndarray # 有效期时间戳, 无有效期为 nan; 过期清理不需要解析记忆
+    importance: np.ndarray # 换出后仍会变化的字段 (时间衰减, 重复信号), 解析记忆时覆盖段文件里的旧值
+    frequency: np.ndarray
+    file_id: int = 0
+    matrix: Optional[np.memmap] = None
+
+
+class ColdSegmentStore:
+    """
+        冷记忆段存储
+        - 换出: 记忆与向量按 segment_size 切段写入磁盘
+        - 检索: 逐段扫描只读映射的向量, 不把向量读进堆内存
+        - 取回: 以段为页解析记忆, 最近使用的 cache_segments 个页留在 LRU 缓存;
+          记忆对象仍被其它结构引用时直接复用, 身份与最新状态都不变
+        - 持有者: 版本管理/频率追踪等通过 set_holders 登记, 换出时把记忆对象换成位置, 取回/删除时换回对象,
+          这样换出的记忆不再被强引用, 常驻内存只有热层记忆, 页缓存和每行几个字节的索引
+          (版本历史里的内容字符串仍常驻; 向量库的墓碑行在压缩前也仍引用换出的记忆)
+        - 换出后 importance/frequency 的变化写到常驻列上 (scale_importance/write_back), 页被淘汰后不会丢失
+    """
+
+    def __init__(self, path: Optional[str] = None, segment_size: int = 4096, cache_segments: int = 4):
+        self._owns_path = path is None
+        if path is None:
+            path = tempfile.mkdtemp(prefix="memolite-cold-")
+        else:
+            os.makedirs(path, exist_ok=True)
+            if os.listdir(path):
+                raise ValueError(f"冷存储目录不为空: {path}")
+        self.path = path
+        self.segment_size = segment_size
+        self.cache_segments = cache_segments
+
+        self.segments: List[_Segment] = []
+        self._pages: 'OrderedDict[int, List[MemoryItem]]' = OrderedDict() # LRU 页缓存: 段号 -> 记忆
+        self._live = weakref.WeakValueDictionary() # (段号, 行号) -> 仍在内存中的记忆对象
+        self._holders: List = []
+        self._next_file = 0
+        self._pins = 0          # 未关闭的 ColdSnapshot 数, 期间删除段只记下文件, 关闭后再删
+        self._doomed: List[int] = []
+        self._close_pending = False
+        self._lock = threading.RLock()
+        self.page_hits = 0
+        self.page_misses = 0
+
+    def __len__(self) -> int:
+        return sum(int(s.alive.sum()) for s in self.segments)
+
+    def count(self, tier: str) -> int:
+        """某一层在冷存储中的记忆数"""
+        code = COLD_TIERS.index(tier)
+        return sum(int((s.alive & (s.tiers == code)).sum()) for s in self.segments)
+
+    def _file(self, file_id: int, suffix: str) -> str:
+        return os.path.join(self.path, f"seg_{file_id:06d}.{suffix}")
+
+    def set_holders(self, holders: Iterable):
+        """
+            登记持有记忆引用的结构, 冷存储变化时 (在冷存储锁内) 回调:
+            - cold_spilled([(记忆, 位置)]): 记忆已换出, 持有者应改为只保存位置
+            - cold_restored([(位置, 记忆)]): 记忆已取回内存, 持有者应改回对象
+            - cold_removed([位置]): 位置即将失效 (删除/过期/清空), 仍需要该记忆的持有者此时用 get 取回
+        """
+        with self._lock:
+            self._holders = list(holders)
+
+    def spill(self, entries: List[Tuple[MemoryItem, str, np.ndarray]]) -> int:
+        """把 (记忆, 层级, 向量) 写成新的段, 返回写入条数"""
+        with self._lock:
+            spilled = []
+            for start in range(0, len(entries), self.segment_size):
+                chunk = entries[start:start + self.segment_size]
+                number = len(self.segments)
+                file_id = self._next_file
+                self._next_file += 1
+                matrix = np.asarray([embedding for _, _, embedding in chunk], dtype=np.float32)
+                matrix.tofile(self._file(file_id, 'f32'))
+                with open(self._file(file_id, 'jsonl'), 'w', encoding='utf-8') as f:
+                    for memory, _, _ in chunk:
+                        f.write(json.dumps(memory.to_dict(), ensure_ascii=False, default=str))
+                        f.write('\n')
+                self.segments.append(_Segment(
+                    number=number,
+                    dim=matrix.shape[1],
+                    norms=np.linalg.norm(matrix, axis=1).astype(np.float32),
+                    types=np.array([_TYPE_CODES[m.memory_type] for m, _, _ in chunk], dtype=np.uint8),
+                    tiers=np.array([COLD_TIERS.index(tier) for _, tier, _ in chunk], dtype=np.uint8),
+                    alive=np.ones(len(chunk), dtype=bool),
+                    validity=np.array([
+                        m.temporal_validity.timestamp() if m.temporal_validity is not None else np.nan
+                        for m, _, _ in chunk
+                    ], dtype=np.float64),
+                    importance=np.array([m.importance for m, _, _ in chunk], dtype=np.float64),
+                    frequency=np.array([m.frequency for m, _, _ in chunk], dtype=np.int64),
+                    file_id=file_id
+                ))
+                for row, (memory, _, _) in enumerate(chunk):
+                    self._live[(number, row)] = memory
+                    spilled.append((memory, (number, row)))
+            for holder in self._holders:
+                holder.cold_spilled(spilled)
+        if metrics.enabled:
+            metrics.incr("cold_tier", "spilled", len(entries))
+        return len(entries)
+
+    def _matrix(self, segment: _Segment) -> np.ndarray:
+        if segment.matrix is None:
+            segment.matrix = self._map(segment)
+        return segment.matrix
+
+    def _map(self, segment: _Segment) -> np.memmap:
+        return np.memmap(self._file(segment.file_id, 'f32'), dtype=np.float32, mode='r',
+                         shape=(len(segment.alive), segment.dim))
+
+    @metrics.timed("cold_search")
+    def search(self, q_embedding: np.ndarray, top_k: int = 3,
+               memory_types: Optional[Iterable[MemoryType]] = None) -> List[Tuple[Tuple[int, int], float]]:
+        """逐段打分, 返回 ((段号, 行号), 相似度), 按相似度降序"""
+        q = np.asarray(q_embedding, dtype=np.float32)
+        q = q / max(np.linalg.norm(q), 1e-12)
+        codes = [_TYPE_CODES[t] for t in memory_types] if memory_types is not None else None
+
+        refs: List[Tuple[int, int]] = []
+        scores: List[float] = []
+        with self._lock:
+            for segment in self.segments:
+                mask = segment.alive if codes is None else segment.alive & np.isin(segment.types, codes)
+                candidates = int(mask.sum())
+                if candidates == 0:
+                    continue
+                similarities = (self._matrix(segment) @ q) / np.maximum(segment.norms, 1e-12)
+                similarities = np.where(mask, similarities, -np.inf)
+                rows = top_k_indices(similarities, min(top_k, candidates))
+                refs.extend((segment.number, int(r)) for r in rows)
+                scores.extend(similarities[rows])
+        order = top_k_indices(np.asarray(scores), top_k)
+        return [(refs[i], float(scores[i])) for i in order]
+
+    def get(self, ref: Tuple[int, int]) -> MemoryItem:
+        """按位置取记忆 (需要时把所在段换入页缓存)"""
+        with self._lock:
+            memory = self._live.get(ref)
+            if memory is not None:
+                return memory
+            return self._page(ref[0])[ref[1]]
+
+    def get_many(self, refs: Iterable[Tuple[int, int]]) -> List[MemoryItem]:
+        """按位置批量取记忆, 同一段只解析一次"""
+        refs = list(refs)
+        memories: List[Optional[MemoryItem]] = [None] * len(refs)
+        by_segment: Dict[int, List[int]] = {}
+        with self._lock:
+            for i, ref in enumerate(refs):
+                memories[i] = self._live.get(ref)
+                if memories[i] is None:
+                    by_segment.setdefault(ref[0], []).append(i)
+            for number, indices in by_segment.items():
+                page = self._page(number)
+                for i in indices:
+                    memories[i] = page[refs[i][1]]
+        return memories
+
+    def resident(self, ref: Tuple[int, int]) -> Optional[MemoryItem]:
+        """该位置的记忆对象当前是否在内存中, 不触发换入"""
+        return self._live.get(ref)
+
+    def memory_type(self, ref: Tuple[int, int]) -> MemoryType:
+        return _MEMORY_TYPES[self.segments[ref[0]].types[ref[1]]]
+
+    def scale_importance(self, ref: Tuple[int, int], factor: float) -> Tuple[float, float]:
+        """冷记忆的重要性乘以 factor (时间衰减), 不解析记忆; 返回 (原值, 新值)"""
+        with self._lock:
+            segment = self.segments[ref[0]]
+            old = float(segment.importance[ref[1]])
+            segment.importance[ref[1]] = old * factor
+            memory = self._live.get(ref)
+            if memory is not None:
+                memory.importance = float(segment.importance[ref[1]])
+            return old, float(segment.importance[ref[1]])
+
+    def write_back(self, ref: Tuple[int, int], memory: MemoryItem):
+        """把内存中冷记忆对象的 importance/frequency 写回常驻列, 对象被回收后再次取回时仍是新值"""
+        with self._lock:
+            segment = self.segments[ref[0]]
+            segment.importance[ref[1]] = memory.importance
+            segment.frequency[ref[1]] = memory.frequency
+
+    def _page(self, number: int) -> List[MemoryItem]:
+        page = self._pages.get(number)
+        if page is not None:
+            self._pages.move_to_end(number)
+            self.page_hits += 1
+            return page
+
+        self.page_misses += 1
+        page = self._read_page(self.segments[number], register=True)
+        self._pages[number] = page
+        while len(self._pages) > self.cache_segments:
+            self._pages.popitem(last=False)
+        return page
+
+    def _read_page(self, segment: _Segment, register: bool) -> List[MemoryItem]:
+        """解析段文件; register 时复用/登记内存中的对象 (只对仍属于本存储的段)"""
+        page = []
+        with open(self._file(segment.file_id, 'jsonl'), 'r', encoding='utf-8') as f:
+            for row, line in enumerate(f):
+                memory = self._live.get((segment.number, row)) if register else None
+                if memory is None:
+                    memory = MemoryItem.from_dict(json.loads(line))
+                    memory.importance = float(segment.importance[row])
+                    memory.frequency = int(segment.frequency[row])
+                    if register:
+                        self._live[(segment.number, row)] = memory
+                page.append(memory)
+        return page
+
+    def take(self, refs: Iterable[Tuple[int, int]]) -> List[Tuple[MemoryItem, str, np.ndarray]]:
+        """把记忆移出冷存储 (如晋升回热层), 返回 (记忆, 层级, 向量); 整段都被取走后删除段文件"""
+        refs = list(refs)
+        taken = []
+        restored = []
+        with self._lock:
+            for number, row in refs:
+                segment = self.segments[number]
+                if not segment.alive[row]:
+                    continue
+                memory = self.get((number, row))
+                embedding = np.array(self._matrix(segment)[row])
+                segment.alive[row] = False
+                taken.append((memory, COLD_TIERS[segment.tiers[row]], embedding))
+                restored.append(((number, row), memory))
+            for holder in self._holders:
+                holder.cold_restored(restored)
+            for number in {number for number, _ in refs}:
+                if not self.segments[number].alive.any():
+                    self._drop_segment(number)
+        return taken
+
+    def set_tier(self, ref: Tuple[int, int], tier: str) -> str:
+        """修改冷记忆所在的层级 (中期/短期), 返回原层级"""
+        with self._lock:
+            segment = self.segments[ref[0]]
+            previous = COLD_TIERS[segment.tiers[ref[1]]]
+            segment.tiers[ref[1]] = COLD_TIERS.index(tier)
+        return previous
+
+    def remove(self, memories: Iterable[MemoryItem]) -> int:
+        """按对象身份删除冷存储中的记忆 (打墓碑), 返回删除的条数; 整段都被删除后删除段文件"""
+        targets = {id(m) for m in memories}
+        with self._lock:
+            refs = [ref for ref, memory in list(self._live.items()) if id(memory) in targets]
+            return self._tombstone(refs)
+
+    def expire(self, now: datetime) -> int:
+        """删除有效期早于 now 的冷记忆, 返回删除的条数"""
+        now = now.timestamp()
+        with self._lock:
+            refs = [
+                (segment.number, int(row))
+                for segment in self.segments
+                for row in np.nonzero(segment.alive & (segment.validity < now))[0]
+            ]
+            return self._tombstone(refs)
+
+    def _tombstone(self, refs: List[Tuple[int, int]]) -> int:
+        refs = [ref for ref in refs if self.segments[ref[0]].alive[ref[1]]]
+        for holder in self._holders:
+            holder.cold_removed(refs)
+        removed = 0
+        for number, row in refs:
+            segment = self.segments[number]
+            if segment.alive[row]:
+                segment.alive[row] = False
+                removed += 1
+        for number in {number for number, _ in refs}:
+            if not self.segments[number].alive.any():
+                self._drop_segment(number)
+        return removed
+
+    def _drop_segment(self, number: int):
+        segment = self.segments[number]
+        segment.matrix = None
+        self._pages.pop(number, None)
+        if self._pins:
+            self._doomed.append(segment.file_id)
+        else:
+            self._remove_files(segment.file_id)
+
+    def _remove_files(self, file_id: int):
+        for suffix in ('f32', 'jsonl'):
+            if os.path.exists(self._file(file_id, suffix)):
+                os.remove(self._file(file_id, suffix))
+
+    def refs(self) -> Iterator[Tuple[int, int]]:
+        """所有仍在冷存储中的位置"""
+        for segment in self.segments:
+            for row in np.nonzero(segment.alive)[0]:
+                yield segment.number, int(row)
+
+    def iter_ref_entries(self) -> Iterator[Tuple[Tuple[int, int], MemoryItem, str, np.ndarray]]:
+        """按段顺序产出 (位置, 记忆, 层级, 向量), 不改变冷存储内容; 遍历期间被取回/删除的记忆跳过"""
+        for number, row in self.refs():
+            segment = self.segments[number]
+            with self._lock:
+                if not segment.alive[row]:
+                    continue
+                memory = self.get((number, row))
+                embedding = np.array(self._matrix(segment)[row])
+            yield (number, row), memory, COLD_TIERS[segment.tiers[row]], embedding
+
+    def iter_entries(self) -> Iterator[Tuple[MemoryItem, str, np.ndarray]]:
+        """按段顺序产出 (记忆, 层级, 向量), 同 iter_ref_entries"""
+        for _, memory, tier, embedding in self.iter_ref_entries():
+            yield memory, tier, embedding
+
+    def snapshot(self) -> 'ColdSnapshot':
+        """当前内容的只读视图 (导出用), 关闭前段文件不会被删除; 用完必须 close"""
+        with self._lock:
+            self._pins += 1
+            return ColdSnapshot(self, [
+                (segment, segment.alive.copy(), segment.tiers.copy())
+                for segment in self.segments if segment.alive.any()
+            ])
+
+    def _unpin(self):
+        with self._lock:
+            self._pins -= 1
+            if self._pins:
+                return
+            for file_id in self._doomed:
+                self._remove_files(file_id)
+            self._doomed = []
+            if self._close_pending:
+                shutil.rmtree(self.path, ignore_errors=True)
+
+    def _snapshot_page(self, segment: _Segment) -> List[MemoryItem]:
+        with self._lock:
+            if segment.number < len(self.segments) and self.segments[segment.number] is segment:
+                return self._page(segment.number)
+            return self._read_page(segment, register=False) # 段已不属于本存储 (清空后), 直接读文件
+
+    def clear(self):
+        """删除全部段文件, 清空索引与缓存; 持有者先收到全部位置的 cold_removed"""
+        with self._lock:
+            refs = list(self.refs())
+            for holder in self._holders:
+                holder.cold_removed(refs)
+            for segment in self.segments:
+                self._drop_segment(segment.number)
+            self.segments = []
+            self._pages.clear()
+            self._live = weakref.WeakValueDictionary()
+
+    def close(self):
+        """清空冷存储, 自动创建的临时目录一并删除 (有未关闭的 ColdSnapshot 时等其关闭)"""
+        with self._lock:
+            self.clear()
+            if self._owns_path:
+                if self._pins:
+                    self._close_pending = True
+                else:
+                    shutil.rmtree(self.path, ignore_errors=True)
+
+    def get_statistics(self) -> Dict:
+        disk_bytes = sum(
+            os.path.getsize(self._file(s.file_id, suffix))
+            for s in self.segments for suffix in ('f32', 'jsonl')
+            if s.alive.any()
+        )
+        return {
+            'segments': sum(1 for s in self.segments if s.alive.any()),
+            'mid_term': self.count('mid_term'),
+            'short_term': self.count('short_term'),
+            'cached_pages': len(self._pages),
+            'page_hits': self.page_hits,
+            'page_misses': self.page_misses,
+            'disk_bytes': disk_bytes
+        }
+
+
+class ColdSnapshot:
+    """
+        冷存储某一时刻的只读视图: 存活标记与层级在截取时复制, 之后的换出/取回/删除/清空都不影响它,
+        涉及的段文件在 close 之前不会被删除
+    """
+
+    def __init__(self, store: ColdSegmentStore, segments: List[Tuple[_Segment, np.ndarray, np.ndarray]]):
+        self._store = store
+        self._segments = segments
+        self._by_number = {segment.number: (segment, alive, tiers) for segment, alive, tiers in segments}
+        self._closed = False
+
+    def __len__(self) -> int:
+        return sum(int(alive.sum()) for _, alive, _ in self._segments)
+
+    def iter_ref_entries(self) -> Iterator[Tuple[Tuple[int, int], MemoryItem, str, np.ndarray]]:
+        """按段顺序产出截取时存活的 (位置, 记忆, 层级, 向量)"""
+        for segment, alive, tiers in self._segments:
+            page = self._store._snapshot_page(segment)
+            matrix = self._store._map(segment)
+            for row in np.nonzero(alive)[0]:
+                yield (segment.number, int(row)), page[row], COLD_TIERS[tiers[row]], np.array(matrix[row])
+
+    def get(self, ref: Tuple[int, int]) -> MemoryItem:
+        segment, _, _ = self._by_number[ref[0]]
+        return self._store._snapshot_page(segment)[ref[1]]
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._store._unpin()
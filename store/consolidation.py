@@ -0,0 +1,326 @@
+from memory import MemoryItem, MemoryType
+from store.vector_store import VectorMemoryStore
+from store.version import MemoryUpdateManager
+from store.priority import PriorityMemoryManager
+from prompts.SYSTEM_PROPT import CONSOLIDATION_PROMPT
+from metrics import metrics
+from events import events
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import json
+import threading
+import weakref
+import numpy as np
+
+
+@dataclass
+class _MergePlan:
+    """一个需要合并的簇"""
+    memory_type: MemoryType
+    cluster: int
+    members: List[MemoryItem]   # 本次要被替换的记忆 (含上一轮的代表记忆)
+    content: str                # 默认取离簇中心最近的成员内容
+    vector: np.ndarray          # 代表记忆的向量
+
+
+class MemoryConsolidator:
+    """
+        记忆整合: 对同类型的重复记忆做聚类, 每个簇用一条代表记忆替换
+        - 聚类: 在已存向量上按类型做 mini-batch k-means, 簇数随数据增长 (与所有中心相似度都低于阈值的点新开一簇)
+        - 合并: 频率求和, 重要性/置信度取最大, 内容取离中心最近的成员或由 LLM 一次性批量总结
+        - 增量: 簇中心跨轮保留, 每轮只处理上次之后新增的记忆, 新记忆命中旧簇时与旧代表记忆再合并;
+          只有一条成员的簇以该成员为代表, 之后的重复记忆同样能并入
+        - 版本: 被替换记忆对应的 key 通过 MemoryUpdateManager 记录新版本
+    """
+
+    def __init__(self, vector_store: VectorMemoryStore, update_manager: MemoryUpdateManager,
+                 priority_manager: Optional[PriorityMemoryManager] = None, llm=None,
+                 memory_types: Iterable[MemoryType] = (MemoryType.FACTS, MemoryType.BEHAVIORAL_PATTERNS),
+                 similarity_threshold: float = 0.9, batch_size: int = 256, lock=None):
+        self.vector_store = vector_store
+        self.update_manager = update_manager
+        self.priority_manager = priority_manager
+        self.llm = llm
+        self.memory_types = tuple(memory_types)
+        self.similarity_threshold = similarity_threshold
+        self.batch_size = batch_size
+        self.lock = lock or nullcontext()
+
+        # 每种类型的簇: 归一化中心, 累计样本数, 当前代表记忆 (弱引用, 换出到冷存储的代表记忆不被留在内存) 及其向量
+        self._centroids: Dict[MemoryType, np.ndarray] = {}
+        self._counts: Dict[MemoryType, np.ndarray] = {}
+        self._representatives: Dict[MemoryType, List[Optional[weakref.ref]]] = {}
+        self._rep_vectors: Dict[MemoryType, List[Optional[np.ndarray]]] = {}
+        self.watermark = -1 # 已处理的最大记忆 id
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._background_args = None
+
+    @metrics.timed("consolidate")
+    def consolidate(self, summarize: bool = False) -> Dict[str, int]:
+        """执行一轮增量整合, summarize=True 时用 LLM 为每个簇生成合并后的内容"""
+        with self.lock:
+            plans, scanned = self._plan()
+        if not plans:
+            return {'scanned': scanned, 'clusters': 0, 'merged': 0}
+
+        # LLM 与 embedding 请求都在锁外完成, 不阻塞写入
+        # 水位线与簇状态在规划时已推进, 总结失败也必须照常合并 (沿用默认内容), 否则这批记忆再也不会被处理
+        if summarize and self.llm is not None:
+            summaries = self._summarize(plans)
+            changed = [p for p in plans if summaries.get(id(p)) and summaries[id(p)] != p.content]
+            if changed:
+                try:
+                    vectors = self.vector_store.get_embeddings([summaries[id(p)] for p in changed])
+                except Exception as e:
+                    events.emit("consolidation.llm_error", error=e)
+                else:
+                    for plan, vector in zip(changed, vectors):
+                        plan.content, plan.vector = summaries[id(plan)], vector
+
+        with self.lock:
+            merged = self._apply(plans)
+        stats = {'scanned': scanned, 'clusters': len(plans), 'merged': merged}
+        events.emit("consolidation.done", **stats)
+        return stats
+
+    def _plan(self):
+        """聚类新增记忆, 返回需要合并的簇"""
+        vector_store = self.vector_store
+        ids = vector_store.ids
+        rows = np.nonzero(ids > self.watermark)[0]
+        if len(rows) == 0:
+            return [], 0
+        self.watermark = int(ids[rows].max())
+
+        current_reps = {
+            id(rep) for reps in self._representatives.values()
+            for rep in (ref() for ref in reps if ref is not None) if rep is not None
+        }
+        memories = vector_store.memories
+        present = {id(m) for m in memories}
+        embeddings = vector_store.embeddings
+        norms = np.maximum(vector_store.norms, 1e-12)
+
+        plans: List[_MergePlan] = []
+        scanned = 0
+        for memory_type in self.memory_types:
+            selected = [
+                r for r in rows
+                if memories[r].memory_type == memory_type and id(memories[r]) not in current_reps
+            ]
+            if not selected:
+                continue
+            scanned += len(selected)
+            raw = np.asarray(embeddings[selected], dtype=np.float32)
+            normalized = raw / norms[selected][:, None]
+            members = [memories[r] for r in selected]
+            assignments = self._assign(memory_type, normalized)
+
+            centroids = self._centroids[memory_type]
+            reps = self._representatives[memory_type]
+            for cluster in np.unique(assignments):
+                idx = np.nonzero(assignments == cluster)[0]
+                rep = reps[cluster]() if reps[cluster] is not None else None
+                if rep is None or id(rep) not in present:
+                    rep = reps[cluster] = None # 代表记忆已被删除 (过期/更新/换出等)
+                if rep is None and len(idx) == 1:
+                    # 簇里只有一条: 暂作代表记忆, 之后命中该簇的新记忆与它合并
+                    reps[cluster] = weakref.ref(members[idx[0]])
+                    self._rep_vectors[memory_type][cluster] = raw[idx[0]]
+                    continue
+                # 代表内容: 离簇中心最近的成员 (旧代表也参与比较)
+                candidates = [(members[i], raw[i], float(normalized[i] @ centroids[cluster])) for i in idx]
+                if rep is not None:
+                    rep_vector = self._rep_vectors[memory_type][cluster]
+                    rep_sim = float(rep_vector @ centroids[cluster] / max(np.linalg.norm(rep_vector), 1e-12))
+                    candidates.append((rep, rep_vector, rep_sim))
+                best = max(candidates, key=lambda c: c[2])
+                plans.append(_MergePlan(
+                    memory_type=memory_type,
+                    cluster=int(cluster),
+                    members=[c[0] for c in candidates],
+                    content=best[0].content,
+                    vector=best[1]
+                ))
+        return plans, scanned
+
+    def _assign(self, memory_type: MemoryType, X: np.ndarray) -> np.ndarray:
+        """mini-batch k-means: 把新点分到最近的中心并按批更新中心, 返回每个点的簇号"""
+        dim = X.shape[1]
+        centroids = self._centroids.get(memory_type, np.empty((0, dim), dtype=np.float32))
+        counts = self._counts.get(memory_type, np.empty(0, dtype=np.int64))
+        reps = self._representatives.setdefault(memory_type, [])
+        rep_vectors = self._rep_vectors.setdefault(memory_type, [])
+        assignments = np.empty(len(X), dtype=np.int64)
+
+        for start in range(0, len(X), self.batch_size):
+            batch = X[start:start + self.batch_size]
+            if len(centroids):
+                sims = batch @ centroids.T
+                best = sims.argmax(axis=1)
+                matched = sims[np.arange(len(batch)), best] >= self.similarity_threshold
+            else:
+                best = np.zeros(len(batch), dtype=np.int64)
+                matched = np.zeros(len(batch), dtype=bool)
+
+            # 离所有中心都远的点: 依次与 (含本批新开的) 中心比较, 仍不够近则新开一簇
+            new_centroids = []
+            for i in np.nonzero(~matched)[0]:
+                if new_centroids:
+                    sims_new = np.asarray(new_centroids) @ batch[i]
+                    j = int(sims_new.argmax())
+                    if sims_new[j] >= self.similarity_threshold:
+                        best[i] = len(centroids) + j
+                        continue
+                new_centroids.append(batch[i])
+                best[i] = len(centroids) + len(new_centroids) - 1
+            if new_centroids:
+                centroids = np.vstack([centroids, np.asarray(new_centroids, dtype=np.float32)])
+                counts = np.concatenate([counts, np.zeros(len(new_centroids), dtype=np.int64)])
+                reps.extend([None] * len(new_centroids))
+                rep_vectors.extend([None] * len(new_centroids))
+
+            # 中心向本批成员均值移动, 学习率 = 本批样本数 / 累计样本数
+            batch_counts = np.bincount(best, minlength=len(centroids))
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, best, batch)
+            touched = batch_counts > 0
+            counts[touched] += batch_counts[touched]
+            lr = (batch_counts[touched] / counts[touched])[:, None]
+            updated = (1 - lr) * centroids[touched] + lr * (sums[touched] / batch_counts[touched][:, None])
+            centroids[touched] = updated / np.maximum(np.linalg.norm(updated, axis=1, keepdims=True), 1e-12)
+            assignments[start:start + len(batch)] = best
+
+        self._centroids[memory_type] = centroids
+        self._counts[memory_type] = counts
+        return assignments
+
+    def _summarize(self, plans: List[_MergePlan], max_members: int = 10) -> Dict[int, str]:
+        """一次 LLM 调用为所有簇生成合并内容, 调用或解析失败时返回空 (沿用默认内容)"""
+        blocks = []
+        for i, plan in enumerate(plans):
+            lines = "\n".join(f"  - {m.content}" for m in plan.members[:max_members])
+            blocks.append(f"组 {i} [{plan.memory_type.value}]:\n{lines}")
+        prompt = CONSOLIDATION_PROMPT.format(clusters="\n\n".join(blocks))
+        try:
+            response = self.llm.invoke(prompt)
+            data = json.loads(response.content)
+            return {
+                id(plans[item["cluster"]]): item["content"]
+                for item in data
+                if isinstance(item.get("cluster"), int) and 0 <= item["cluster"] < len(plans) and item.get("content")
+            }
+        except Exception as e:
+            events.emit("consolidation.llm_error", error=e)
+            return {}
+
+    def _apply(self, plans: List[_MergePlan]) -> int:
+        """用代表记忆替换各簇成员, 返回被替换的记忆条数"""
+        present = {id(m) for m in self.vector_store.memories}
+        # 成员都来自向量库 (热层), 换出到冷存储的当前版本不必取回
+        keys_by_memory = {id(m): key for key, m in self.update_manager.current_version.resident()}
+
+        replaced: List[MemoryItem] = []
+        additions = []
+        for plan in plans:
+            members = [m for m in plan.members if id(m) in present]
+            if len(members) < 2:
+                continue # 成员在规划之后已被删除, 本轮跳过
+            representative = self._merge(plan.memory_type, members, plan.content)
+            replaced.extend(members)
+            additions.append((plan, members, representative))
+
+        self.vector_store.remove(replaced)
+        if self.priority_manager is not None:
+            self.priority_manager.remove(replaced)
+
+        for plan, members, representative in additions:
+            self.vector_store.add(representative, plan.vector)
+            if self.priority_manager is not None:
+                self.priority_manager.store(representative)
+            cluster_key = f"consolidated_{plan.memory_type.name}_{plan.cluster}"
+            self.update_manager.add_or_update(cluster_key, representative, source='system')
+            for member in members:
+                key = keys_by_memory.get(id(member))
+                if key is not None and key != cluster_key:
+                    self.update_manager.add_or_update(key, representative, source='system')
+            self._representatives[plan.memory_type][plan.cluster] = weakref.ref(representative)
+            self._rep_vectors[plan.memory_type][plan.cluster] = np.asarray(plan.vector, dtype=np.float32)
+        return len(replaced)
+
+    @staticmethod
+    def _merge(memory_type: MemoryType, members: List[MemoryItem], content: str) -> MemoryItem:
+        """合并成员属性: 频率求和, 重要性/置信度取最大, 有效期取最晚 (任一永久则永久)"""
+        validity = None
+        if all(m.temporal_validity is not None for m in members):
+            validity = max(m.temporal_validity for m in members)
+        metadata = {}
+        for m in members:
+            metadata.update(m.metadata or {})
+        metadata['consolidated_from'] = sum((m.metadata or {}).get('consolidated_from', 1) for m in members)
+        return MemoryItem(
+            content=content,
+            memory_type=memory_type,
+            timestamp=datetime.now(),
+            importance=max(m.importance for m in members),
+            frequency=sum(m.frequency for m in members),
+            confidence=max(m.confidence for m in members),
+            temporal_validity=validity,
+            metadata=metadata
+        )
+
+    def start_background(self, interval: float = 3600.0, summarize: bool = False):
+        """后台线程定期执行整合"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._background_args = (interval, summarize)
+        stop = self._stop
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.consolidate(summarize)
+                except Exception as e:
+                    events.emit("consolidation.error", error=e) # 单轮失败不结束后台线程
+
+        self._thread = threading.Thread(target=loop, name="memory-consolidation", daemon=True)
+        self._thread.start()
+
+    @property
+    def background_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def stop_background(self, wait: bool = True):
+        """停止后台线程; 持有 agent 锁时调用需 wait=False, 否则可能与正在执行的整合互等"""
+        self._stop.set()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._thread = None
+        self._stop = threading.Event()
+
+############################### 测试部分 ###############################
+def main():
+    from config import get_embeddings
+    vector_store = VectorMemoryStore(get_embeddings())
+    update_manager = MemoryUpdateManager()
+    consolidator = MemoryConsolidator(vector_store, update_manager, similarity_threshold=0.85)
+
+    contents = ["用户喜欢喝咖啡", "用户爱喝咖啡", "用户每天都喝咖啡", "用户在北京工作", "用户的工作地点是北京"]
+    for i, content in enumerate(contents):
+        memory = MemoryItem(content, MemoryType.FACTS, datetime.now(), importance=0.6)
+        vector_store.add(memory)
+        update_manager.add_or_update(f"fact_{i}", memory)
+
+    print("\n🧩 执行记忆整合：")
+    print(consolidator.consolidate())
+    for memory in vector_store.memories:
+        print(f"  {memory.content} (频率 {memory.frequency}, 合并自 {memory.metadata.get('consolidated_from', 1)} 条)")
+
+
+if __name__ == "__main__":
+    main()
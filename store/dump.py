@@ -0,0 +1,407 @@
+# 记忆批量导入导出: 流式生成/消费记录, 内存占用与导出文件大小无关
+from memory import MemoryItem, MemoryType
+from store.version import MemoryVersion
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+import itertools
+import json
+import struct
+import numpy as np
+
+if TYPE_CHECKING:
+    from agent import SmartMemoryAgent
+
+FORMAT_VERSION = 1
+TIERS = ('long_term', 'mid_term', 'short_term')
+
+BINARY_MAGIC = b"MLITEBIN"
+_FILE_HEADER = struct.Struct('<8sH')   # magic, 版本号
+_BLOCK_HEADER = struct.Struct('<cQ')   # 块类型, 负载长度
+_MEMORY_BLOCK_HEADER = struct.Struct('<II') # 行数, 向量维度
+_MEMORY_TYPES = list(MemoryType)
+_TYPE_INDEX = {t: i for i, t in enumerate(_MEMORY_TYPES)}
+
+# 记录格式 (两种文件格式共享):
+# - header:  {'type': 'header', 'format': 'memolite', 'version', 'embedding_dim'}
+# - memory:  {'type': 'memory', 'id', 'indexed', 'memory': MemoryItem, 'embedding': ndarray | None}
+# - vector:  {'type': 'vector', 'id', 'embedding'}  同一记忆在向量库中重复出现时使用
+# - tier:    {'type': 'tier', 'tier', 'id'}
+# - kv:      {'type': 'kv', 'key', 'id'}
+# - version: {'type': 'version', 'key', 'current', 'history': [MemoryVersion 字典]}
+# id 只在单个导出文件内有效, 引用前一定已经出现过对应的 memory 记录
+
+def iter_agent_records(agent: 'SmartMemoryAgent', include_embeddings: bool = True) -> Iterator[Dict]:
+    """按顺序产出 agent 的全部状态记录"""
+    vector_store = agent.vector_store
+    dim = None
+    if include_embeddings and len(vector_store.memories):
+        dim = vector_store.embeddings.shape[1]
+    yield {'type': 'header', 'format': 'memolite', 'version': FORMAT_VERSION, 'embedding_dim': dim}
+
+    refs: Dict[int, int] = {}
+    next_id = itertools.count()
+
+    def memory_record(memory: MemoryItem, indexed: bool = False, embedding=None) -> Dict:
+        refs[id(memory)] = next(next_id)
+        return {'type': 'memory', 'id': refs[id(memory)], 'indexed': indexed,
+                'memory': memory, 'embedding': embedding}
+
+    # 1. 向量库, 保持原有顺序
+    for memory, embedding in zip(vector_store.memories, vector_store.embeddings):
+        embedding = embedding if include_embeddings else None
+        if id(memory) in refs:
+            yield {'type': 'vector', 'id': refs[id(memory)], 'embedding': embedding}
+        else:
+            yield memory_record(memory, True, embedding)
+
+    # 1b. 冷存储 (分级存储模式下换出到磁盘的记忆), 作为普通向量库记忆导出, 导入后回到内存
+    # 冷记忆按位置编号, 不按对象身份 (逐段解析的对象可能随时被回收), 内存里不必同时留住它们
+    cold_store = getattr(agent, 'cold_store', None)
+    cold_ids: Dict[Tuple[int, int], int] = {}
+    if cold_store is not None:
+        for ref, memory, tier, embedding in cold_store.iter_ref_entries():
+            cold_ids[ref] = next(next_id)
+            yield {'type': 'memory', 'id': cold_ids[ref], 'indexed': True, 'memory': memory,
+                   'embedding': embedding if include_embeddings else None}
+            yield {'type': 'tier', 'tier': tier, 'id': cold_ids[ref]}
+
+    # 2. 分级存储
+    for tier in TIERS:
+        for memory in getattr(agent.priority_manager, tier):
+            if id(memory) not in refs:
+                yield memory_record(memory)
+            yield {'type': 'tier', 'tier': tier, 'id': refs[id(memory)]}
+
+    # 3. Key-Value
+    for key, memory in agent.kv_store.store.items():
+        if id(memory) not in refs:
+            yield memory_record(memory)
+        yield {'type': 'kv', 'key': key, 'id': refs[id(memory)]}
+
+    # 4. 版本历史
+    update_manager = agent.update_manager
+    resolved: List[MemoryItem] = []
+    for key, history in update_manager.version_history.items():
+        current = update_manager.current_version.get(key)
+        if isinstance(current, tuple) and current in cold_ids: # 换出的记忆只保存了冷存储位置
+            current_id = cold_ids[current]
+        else:
+            if isinstance(current, tuple):
+                current = cold_store.get(current)
+                resolved.append(current) # 导出期间保持引用, 避免对象回收后 id 被复用
+            if current is not None and id(current) not in refs:
+                yield memory_record(current)
+            current_id = refs[id(current)] if current is not None else None
+        yield {
+            'type': 'version',
+            'key': key,
+            'current': current_id,
+            'history': [_version_to_dict(v) for v in history]
+        }
+
+
+def load_agent_records(agent: 'SmartMemoryAgent', records: Iterable[Dict],
+                       embed_batch_size: int = 64, vectors: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict[str, int]:
+    """
+        把记录流写回 agent; 没有向量的记忆按批重新向量化
+        vectors: (矩阵, 模长) 时直接挂到向量库上 (快照恢复), 不再逐条添加
+    """
+    memories: Dict[int, MemoryItem] = {}
+    pending: List[MemoryItem] = [] # 等待批量向量化的记忆, 保证向量库顺序不变
+    indexed: List[MemoryItem] = [] # vectors 模式下按顺序收集的向量库记忆
+    counts = defaultdict(int)
+
+    def flush_pending():
+        agent.vector_store.add_many(pending)
+        counts['embedded'] += len(pending)
+        pending.clear()
+
+    for record in records:
+        kind = record['type']
+        if kind == 'header':
+            if record.get('version', FORMAT_VERSION) > FORMAT_VERSION:
+                raise ValueError(f"不支持的导出格式版本: {record['version']}")
+            continue
+
+        if kind in ('memory', 'vector'):
+            if kind == 'memory':
+                memory = memories[record['id']] = record['memory']
+                counts['memory'] += 1
+                if not record['indexed']:
+                    continue
+            else:
+                memory = memories[record['id']]
+            if vectors is not None:
+                indexed.append(memory)
+            elif record['embedding'] is None:
+                pending.append(memory)
+                if len(pending) >= embed_batch_size:
+                    flush_pending()
+            else:
+                if pending:
+                    flush_pending()
+                agent.vector_store.add(memory, np.asarray(record['embedding']))
+            counts['vector'] += 1
+        elif kind == 'tier':
+            getattr(agent.priority_manager, record['tier']).append(memories[record['id']])
+            counts['tier'] += 1
+        elif kind == 'kv':
+            agent.kv_store.set(record['key'], memories[record['id']])
+            counts['kv'] += 1
+        elif kind == 'version':
+            key = record['key']
+            agent.update_manager.version_history[key] = [_version_from_dict(v) for v in record['history']]
+            if record['current'] is not None:
+                agent.update_manager.current_version[key] = memories[record['current']]
+            counts['version'] += 1
+        else:
+            raise ValueError(f"未知记录类型: {kind}")
+
+    if pending:
+        flush_pending()
+    if vectors is not None:
+        agent.vector_store.attach_matrix(indexed, *vectors)
+    return dict(counts)
+
+
+def _version_to_dict(version: MemoryVersion) -> Dict:
+    return {
+        'version': version.version,
+        'content': version.content,
+        'timestamp': version.timestamp.isoformat(),
+        'confidence': version.confidence,
+        'source': version.source
+    }
+
+def _version_from_dict(data: Dict) -> MemoryVersion:
+    return MemoryVersion(
+        version=data['version'],
+        content=data['content'],
+        timestamp=datetime.fromisoformat(data['timestamp']),
+        confidence=data['confidence'],
+        source=data['source']
+    )
+
+############################### JSONL ###############################
+def _record_to_json(record: Dict) -> Dict:
+    kind = record['type']
+    if kind == 'memory':
+        embedding = record['embedding']
+        return {
+            'type': 'memory',
+            'id': record['id'],
+            'indexed': record['indexed'],
+            'item': record['memory'].to_dict(),
+            'embedding': np.asarray(embedding).tolist() if embedding is not None else None
+        }
+    if kind == 'vector' and record['embedding'] is not None:
+        return {**record, 'embedding': np.asarray(record['embedding']).tolist()}
+    return record
+
+def _record_from_json(data: Dict) -> Dict:
+    if data['type'] == 'memory':
+        return {
+            'type': 'memory',
+            'id': data['id'],
+            'indexed': data['indexed'],
+            'memory': MemoryItem.from_dict(data['item']),
+            'embedding': data.get('embedding')
+        }
+    return data
+
+def write_jsonl(records: Iterable[Dict], path: str) -> int:
+    """逐条写入 JSONL, 返回记录数"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(_record_to_json(record), ensure_ascii=False, default=str))
+            f.write('\n')
+            count += 1
+    return count
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    """逐行读取 JSONL"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield _record_from_json(json.loads(line))
+
+############################### 二进制列式 ###############################
+# 文件: magic + 版本号, 之后是连续的块, 每块 = 类型(1B) + 负载长度(8B) + 负载
+# - 'M' 记忆块 (最多 chunk_size 行, 按列存储):
+#     行数, 维度 | id int64 | indexed u8 | has_embedding u8 | 类型 u8 | 时间戳 f64 | 有效期 f64 (NaN 表示无)
+#     | 重要性 f64 | 置信度 f64 | 频率 i64 | 内容偏移 u64[n+1] + UTF-8 | 元数据偏移 u64[n+1] + JSON | 向量 f32[n, dim]
+# - 'J' 其它记录块: JSONL 文本
+
+def _pack_strings(values: List[bytes]) -> List[bytes]:
+    offsets = np.zeros(len(values) + 1, dtype=np.uint64)
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    return [offsets.tobytes(), b''.join(values)]
+
+def _write_block(f, kind: bytes, parts: List[bytes]):
+    f.write(_BLOCK_HEADER.pack(kind, sum(len(p) for p in parts)))
+    for part in parts:
+        f.write(part)
+
+def _write_memory_block(f, chunk: List[Dict]):
+    n = len(chunk)
+    dims = {len(r['embedding']) for r in chunk if r['embedding'] is not None}
+    if len(dims) > 1:
+        raise ValueError(f"同一导出中向量维度不一致: {sorted(dims)}")
+    dim = dims.pop() if dims else 0
+
+    items = [r['memory'] for r in chunk]
+    embeddings = np.zeros((n, dim), dtype=np.float32)
+    for i, record in enumerate(chunk):
+        if record['embedding'] is not None:
+            embeddings[i] = record['embedding']
+
+    parts = [
+        _MEMORY_BLOCK_HEADER.pack(n, dim),
+        np.array([r['id'] for r in chunk], dtype=np.int64).tobytes(),
+        np.array([r['indexed'] for r in chunk], dtype=np.uint8).tobytes(),
+        np.array([r['embedding'] is not None for r in chunk], dtype=np.uint8).tobytes(),
+        np.array([_TYPE_INDEX[m.memory_type] for m in items], dtype=np.uint8).tobytes(),
+        np.array([m.timestamp.timestamp() for m in items], dtype=np.float64).tobytes(),
+        np.array([m.temporal_validity.timestamp() if m.temporal_validity else np.nan for m in items],
+                 dtype=np.float64).tobytes(),
+        np.array([m.importance for m in items], dtype=np.float64).tobytes(),
+        np.array([m.confidence for m in items], dtype=np.float64).tobytes(),
+        np.array([m.frequency for m in items], dtype=np.int64).tobytes(),
+        *_pack_strings([m.content.encode('utf-8') for m in items]),
+        *_pack_strings([json.dumps(m.metadata, ensure_ascii=False, default=str).encode('utf-8') for m in items]),
+        embeddings.tobytes()
+    ]
+    _write_block(f, b'M', parts)
+
+def _write_json_block(f, chunk: List[Dict]):
+    lines = [json.dumps(_record_to_json(r), ensure_ascii=False, default=str) for r in chunk]
+    _write_block(f, b'J', [('\n'.join(lines)).encode('utf-8')])
+
+def write_binary(records: Iterable[Dict], path: str, chunk_size: int = 1024) -> int:
+    """按块写入二进制列式格式, 返回记录数"""
+    count = 0
+    memory_chunk: List[Dict] = []
+    json_chunk: List[Dict] = []
+    with open(path, 'wb') as f:
+        f.write(_FILE_HEADER.pack(BINARY_MAGIC, FORMAT_VERSION))
+        for record in records:
+            count += 1
+            # 切换块类型时先落盘另一类缓冲, 保证记录顺序不变
+            if record['type'] == 'memory':
+                if json_chunk:
+                    _write_json_block(f, json_chunk)
+                    json_chunk.clear()
+                memory_chunk.append(record)
+                if len(memory_chunk) >= chunk_size:
+                    _write_memory_block(f, memory_chunk)
+                    memory_chunk.clear()
+            else:
+                if memory_chunk:
+                    _write_memory_block(f, memory_chunk)
+                    memory_chunk.clear()
+                json_chunk.append(record)
+                if len(json_chunk) >= chunk_size:
+                    _write_json_block(f, json_chunk)
+                    json_chunk.clear()
+        if memory_chunk:
+            _write_memory_block(f, memory_chunk)
+        if json_chunk:
+            _write_json_block(f, json_chunk)
+    return count
+
+class _Cursor:
+    """顺序读取块负载"""
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.pos = 0
+
+    def array(self, dtype, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        arr = np.frombuffer(self.payload, dtype=dtype, count=count, offset=self.pos)
+        self.pos += dtype.itemsize * count
+        return arr
+
+    def strings(self, n: int) -> List[str]:
+        offsets = self.array(np.uint64, n + 1)
+        blob = self.payload[self.pos:self.pos + int(offsets[-1])]
+        self.pos += int(offsets[-1])
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(n)]
+
+def _read_memory_block(payload: bytes) -> Iterator[Dict]:
+    n, dim = _MEMORY_BLOCK_HEADER.unpack_from(payload)
+    cursor = _Cursor(payload)
+    cursor.pos = _MEMORY_BLOCK_HEADER.size
+    ids = cursor.array(np.int64, n)
+    indexed = cursor.array(np.uint8, n)
+    has_embedding = cursor.array(np.uint8, n)
+    types = cursor.array(np.uint8, n)
+    timestamps = cursor.array(np.float64, n)
+    validity = cursor.array(np.float64, n)
+    importance = cursor.array(np.float64, n)
+    confidence = cursor.array(np.float64, n)
+    frequency = cursor.array(np.int64, n)
+    contents = cursor.strings(n)
+    metadata = cursor.strings(n)
+    embeddings = cursor.array(np.float32, n * dim).reshape(n, dim)
+
+    for i in range(n):
+        memory = MemoryItem(
+            content=contents[i],
+            memory_type=_MEMORY_TYPES[types[i]],
+            timestamp=datetime.fromtimestamp(timestamps[i]),
+            importance=float(importance[i]),
+            frequency=int(frequency[i]),
+            confidence=float(confidence[i]),
+            temporal_validity=None if np.isnan(validity[i]) else datetime.fromtimestamp(validity[i]),
+            metadata=json.loads(metadata[i])
+        )
+        yield {
+            'type': 'memory',
+            'id': int(ids[i]),
+            'indexed': bool(indexed[i]),
+            'memory': memory,
+            'embedding': embeddings[i].copy() if has_embedding[i] else None
+        }
+
+def read_binary(path: str) -> Iterator[Dict]:
+    """逐块读取二进制列式格式"""
+    with open(path, 'rb') as f:
+        magic, version = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"不是 MemoLite 二进制导出文件: {path}")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"不支持的导出格式版本: {version}")
+        while True:
+            header = f.read(_BLOCK_HEADER.size)
+            if not header:
+                break
+            kind, length = _BLOCK_HEADER.unpack(header)
+            payload = f.read(length)
+            if kind == b'M':
+                yield from _read_memory_block(payload)
+            elif kind == b'J':
+                for line in payload.decode('utf-8').split('\n'):
+                    yield _record_from_json(json.loads(line))
+            else:
+                raise ValueError(f"未知块类型: {kind!r}")
+
+############################### 入口 ###############################
+def detect_format(path: str) -> str:
+    """按扩展名判断格式: .jsonl/.json 为 JSONL, 其余为二进制"""
+    return 'jsonl' if str(path).endswith(('.jsonl', '.json')) else 'binary'
+
+def export_agent(agent: 'SmartMemoryAgent', path: str, fmt: Optional[str] = None,
+                 include_embeddings: bool = True) -> int:
+    """导出 agent 全部状态, 返回记录数"""
+    records = iter_agent_records(agent, include_embeddings)
+    if (fmt or detect_format(path)) == 'jsonl':
+        return write_jsonl(records, path)
+    return write_binary(records, path)
+
+def import_agent(agent: 'SmartMemoryAgent', path: str, fmt: Optional[str] = None) -> Dict[str, int]:
+    """导入到 agent, 返回各类记录数"""
+    records = read_jsonl(path) if (fmt or detect_format(path)) == 'jsonl' else read_binary(path)
+    return load_agent_records(agent, records)
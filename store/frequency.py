@@ -0,0 +1,238 @@
+# 频率追踪: 用 count-min sketch 在固定内存里近似统计反复出现的信号 (记忆内容/元数据), 高频信号另存一份 top-k
+from memory import MemoryItem, MemoryType
+from metrics import metrics
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+import hashlib
+import threading
+import weakref
+import numpy as np
+
+if TYPE_CHECKING:
+    from store.cold_tier import ColdSegmentStore
+
+
+class CountMinSketch:
+    """
+        count-min sketch: depth 行 x width 列的计数表, 每个键在每行落到一个格子
+        估计值取各行最小值, 只会高估不会低估; 高估量约为 总计数 * e / width (概率 1 - e^-depth)
+        采用保守更新: 只增加当前最小的格子, 明显降低高估
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.total = 0
+        self._rows = np.arange(depth)
+
+    def _columns(self, key: str) -> np.ndarray:
+        # 一次 blake2b 得到两个 64 位哈希, 双重哈希派生每行的列号
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return np.array([(h1 + i * h2) % self.width for i in range(self.depth)], dtype=np.int64)
+
+    def add(self, key: str, count: int = 1) -> int:
+        """计数加 count, 返回加后的估计值"""
+        columns = self._columns(key)
+        cells = self.table[self._rows, columns]
+        estimate = int(cells.min()) + count
+        self.table[self._rows, columns] = np.maximum(cells, estimate)
+        self.total += count
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        return int(self.table[self._rows, self._columns(key)].min())
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+
+class HeavyHitters:
+    """固定容量的高频键表: 新键的估计值超过表中最小值时替换之"""
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self._min_key: Optional[str] = None
+
+    def offer(self, key: str, count: int):
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] = count
+            if self._min_key == key or self._min_key is None:
+                self._min_key = None # 最小值可能变化, 下次淘汰时重新找
+            return
+        if self._min_key is None:
+            self._min_key = min(self.counts, key=self.counts.get)
+        if count > self.counts[self._min_key]:
+            del self.counts[self._min_key]
+            self.counts[key] = count
+            self._min_key = None
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+class FrequencyTracker:
+    """
+        记忆信号频率追踪
+        - 每条提取出的记忆贡献一个内容信号 (类型 + 归一化内容) 和若干元数据信号 (key=value)
+        - 计数在 count-min sketch 中近似累加, 内存只取决于 width * depth, 与信号种类数无关
+        - 内容信号的估计值作为记忆的 frequency 交给评估器
+        - 低优先级的信号出现次数达到 promote_threshold 才晋升为真正的记忆;
+          已晋升的信号再次出现时只提高原记忆的 frequency, 不再新建记忆
+        - 分级存储模式下是冷存储的持有者: 换出的记忆只保存位置, 再次出现时经 cold_store 取回
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4, top_k: int = 256, promote_threshold: int = 3):
+        self.sketch = CountMinSketch(width, depth)
+        self.heavy_hitters = HeavyHitters(top_k)
+        self.promote_threshold = promote_threshold
+        # 信号键 -> 已存储的记忆 (弱引用, 记忆被各存储释放后自动消失)
+        self._memories = weakref.WeakValueDictionary()
+        # 信号键 <-> 已换出记忆的冷存储位置
+        self._cold: Dict[str, Tuple[int, int]] = {}
+        self._cold_keys: Dict[Tuple[int, int], str] = {}
+        self.cold_store: Optional['ColdSegmentStore'] = None
+        self._lock = threading.Lock()
+        self.pending = 0 # 未达阈值被暂缓的次数
+
+    @staticmethod
+    def content_key(memory: MemoryItem) -> str:
+        """内容信号: 合并空白 + casefold, 与召回缓存的查询归一化一致"""
+        return f"{memory.memory_type.name}:{' '.join(memory.content.split()).casefold()}"
+
+    @staticmethod
+    def metadata_keys(memory: MemoryItem) -> List[str]:
+        return [f"meta:{key}={value}" for key, value in sorted((memory.metadata or {}).items(), key=lambda kv: str(kv[0]))]
+
+    def observe(self, memory: MemoryItem) -> int:
+        """记录一次出现 (内容与元数据), 返回内容信号的近似频率"""
+        key = self.content_key(memory)
+        with self._lock:
+            count = self.sketch.add(key)
+            self.heavy_hitters.offer(key, count)
+            for meta_key in self.metadata_keys(memory):
+                self.heavy_hitters.offer(meta_key, self.sketch.add(meta_key))
+        if metrics.enabled:
+            metrics.incr("frequency", "observed")
+        return count
+
+    def frequency(self, memory: MemoryItem) -> int:
+        """内容信号的近似频率, 至少为 1"""
+        with self._lock:
+            return max(1, self.sketch.estimate(self.content_key(memory)))
+
+    def stored(self, memory: MemoryItem) -> Optional[MemoryItem]:
+        """该信号已晋升为的记忆, 没有 (或已被释放) 时返回 None"""
+        key = self.content_key(memory)
+        existing = self._memories.get(key)
+        if existing is None and key in self._cold:
+            existing = self.cold_store.get(self._cold[key])
+        return existing
+
+    def write_back(self, memory: MemoryItem):
+        """stored 返回的记忆在冷存储中时, 把它的 frequency 变化写回冷存储"""
+        ref = self._cold.get(self.content_key(memory))
+        if ref is not None and self.cold_store.resident(ref) is memory:
+            self.cold_store.write_back(ref, memory)
+
+    def register(self, memory: MemoryItem):
+        """记录信号已晋升为该记忆"""
+        key = self.content_key(memory)
+        self._forget_cold(key)
+        self._memories[key] = memory
+
+    def rebuild(self, memories: Iterable[MemoryItem], cold: Iterable[Tuple[Tuple[int, int], MemoryItem]] = ()):
+        """按现有记忆 (与冷存储中的 (位置, 记忆)) 重建信号到记忆的对应 (如加载快照/导入之后), 计数不变"""
+        index = weakref.WeakValueDictionary()
+        for memory in memories:
+            index[self.content_key(memory)] = memory
+        self._memories = index
+        self._cold, self._cold_keys = {}, {}
+        for ref, memory in cold:
+            key = self.content_key(memory)
+            if key not in index:
+                self._cold[key] = ref
+                self._cold_keys[ref] = key
+
+    def _forget_cold(self, key: str):
+        ref = self._cold.pop(key, None)
+        if ref is not None:
+            del self._cold_keys[ref]
+
+    # ColdSegmentStore 持有者回调
+    def cold_spilled(self, pairs: List[Tuple[MemoryItem, Tuple[int, int]]]):
+        for memory, ref in pairs:
+            key = self.content_key(memory)
+            if self._memories.get(key) is memory:
+                del self._memories[key]
+                self._cold[key] = ref
+                self._cold_keys[ref] = key
+
+    def cold_restored(self, pairs: List[Tuple[Tuple[int, int], MemoryItem]]):
+        for ref, memory in pairs:
+            key = self._cold_keys.pop(ref, None)
+            if key is not None:
+                del self._cold[key]
+                self._memories[key] = memory
+
+    def cold_removed(self, refs: List[Tuple[int, int]]):
+        for ref in refs:
+            key = self._cold_keys.pop(ref, None)
+            if key is not None:
+                del self._cold[key]
+
+    def mark_pending(self):
+        """记录一次因未达晋升阈值而暂缓的存储"""
+        with self._lock:
+            self.pending += 1
+
+    def forget_memories(self):
+        """存储被整体替换 (如加载快照) 时丢弃信号到记忆的对应, 计数保留"""
+        self._memories = weakref.WeakValueDictionary()
+        self._cold, self._cold_keys = {}, {}
+
+    def top(self, n: Optional[int] = 10) -> List[Tuple[str, int]]:
+        """出现最多的信号 (内容与元数据), 按近似频率降序"""
+        with self._lock:
+            return self.heavy_hitters.top(n)
+
+    def get_statistics(self) -> Dict:
+        return {
+            'observed': self.sketch.total,
+            'sketch_bytes': self.sketch.nbytes,
+            'heavy_hitters': len(self.heavy_hitters.counts),
+            'tracked_memories': len(self._memories) + len(self._cold),
+            'pending': self.pending,
+            # 单次估计的高估上界 (以 1 - e^-depth 的概率成立)
+            'error_bound': self.sketch.total * np.e / self.sketch.width
+        }
+
+
+############################### 测试部分 ###############################
+def main():
+    from datetime import datetime
+    import random
+
+    tracker = FrequencyTracker(width=2048, depth=4, top_k=16)
+    rng = random.Random(0)
+    # 长尾分布: 少数信号反复出现, 大量信号只出现一两次
+    exact: Dict[str, int] = {}
+    for _ in range(200000):
+        i = int(rng.paretovariate(1.1)) if rng.random() < 0.5 else rng.randrange(10**6)
+        memory = MemoryItem(content=f"信号{i}", memory_type=MemoryType.FACTS, timestamp=datetime.now())
+        tracker.observe(memory)
+        key = tracker.content_key(memory)
+        exact[key] = exact.get(key, 0) + 1
+
+    print(f"不同信号 {len(exact)} 个, sketch 占用 {tracker.sketch.nbytes / 1024:.0f}KB")
+    print("高频信号 (近似 / 精确):")
+    for key, count in tracker.top(8):
+        print(f"  {key}: {count} / {exact[key]}")
+    errors = [tracker.sketch.estimate(k) - v for k, v in exact.items()]
+    print(f"平均高估 {np.mean(errors):.2f}, 最大高估 {max(errors)}, 理论上界 {tracker.get_statistics()['error_bound']:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from typing import Dict
 
 from memory import MemoryItem, MemoryType, sample_memories
+from events import events
 class KeyValueMemoryStore:
     """Key-Value 记忆存储"""
 
@@ -9,7 +10,7 @@ class KeyValueMemoryStore:
 
     def set(self, key: str, memory: MemoryItem):
         self.store[key] = memory
-        print(f"✅ 已存储: {key} -> {memory.content}")
+        events.emit("kv.set", key=key, memory=memory)
 
     def get(self, key: str):
         return self.store.get(key)
@@ -24,10 +25,10 @@ class KeyValueMemoryStore:
         return list(self.store.items())
 
 ############################### 测试部分 ###############################
-# 1. 创建KV存储并添加示例
-kv_store = KeyValueMemoryStore()
-
 def main():
+    # 1. 创建KV存储并添加示例
+    kv_store = KeyValueMemoryStore()
+
     print("🗂️ Key-Value 记忆存储示例：\n")
     kv_store.set("user_profession", sample_memories[0])
     kv_store.set("last_meeting_date", sample_memories[1])
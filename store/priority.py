@@ -1,7 +1,14 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, TYPE_CHECKING
 from memory import MemoryItem, sample_memories, MemoryType
-from evaluator import MemoryValueEvaluator, evaluator
+from evaluator import MemoryValueEvaluator
+from metrics import metrics
+from events import events
 from enum import Enum
+import numpy as np
+
+if TYPE_CHECKING:
+    from store.cold_tier import ColdSegmentStore
+    from store.vector_store import VectorMemoryStore
 
 class MemoryPriority(Enum):
     """记忆优先级"""
@@ -24,9 +31,14 @@ class PriorityMemoryManager:
         self.high_threshold = 0.7
         self.medium_threshold = 0.4
 
-    def classify_priority(self, memory: MemoryItem) -> MemoryPriority:
-        """根据综合评分来分类优先级"""
-        scores = self.evaluator.evaluate(memory)
+        # 分级存储模式 (enable_tiered_storage 开启): 中/短期记忆超过 hot_limit 条时换出到冷存储
+        self.cold_store: Optional['ColdSegmentStore'] = None
+        self.hot_limit = 0
+
+    def classify_priority(self, memory: MemoryItem, scores: Optional[Dict[str, float]] = None) -> MemoryPriority:
+        """根据综合评分来分类优先级, 调用方已评估过时传入 scores 复用"""
+        if scores is None:
+            scores = self.evaluator.evaluate(memory)
         total_score = scores['total_score']
 
         if total_score >= self.high_threshold:
@@ -36,10 +48,12 @@ class PriorityMemoryManager:
         else:
             return MemoryPriority.LOW
 
-    def store(self, memory: MemoryItem):
-        """存储记忆, 自动根据优先级计算位置"""
-        priority = self.classify_priority(memory)
-        scores = self.evaluator.evaluate(memory)
+    @metrics.timed("priority_store")
+    def store(self, memory: MemoryItem, scores: Optional[Dict[str, float]] = None):
+        """存储记忆, 自动根据优先级计算位置; scores 为调用方已算好的评估结果"""
+        if scores is None:
+            scores = self.evaluator.evaluate(memory)
+        priority = self.classify_priority(memory, scores)
 
         if priority == MemoryPriority.HIGH:
             self.long_term.append(memory)
@@ -51,23 +65,168 @@ class PriorityMemoryManager:
             self.short_term.append(memory)
             storage = "短期缓存"
 
-        print(f"[{priority.value}] -> {storage}")
-        print(f"    内容: {memory.content}")
-        print(f"    综合得分: {scores['total_score']:.3f}")
+        events.emit("priority.store", priority=priority, storage=storage,
+                    memory=memory, score=scores['total_score'])
+
+    def remove(self, memories: List[MemoryItem]) -> int:
+        """按对象身份从各层移除记忆, 返回移除的条数"""
+        targets = {id(m) for m in memories}
+        removed = 0
+        for tier in ('long_term', 'mid_term', 'short_term'):
+            items = getattr(self, tier)
+            kept = [m for m in items if id(m) not in targets]
+            removed += len(items) - len(kept)
+            setattr(self, tier, kept)
+        return removed
+
+    @metrics.timed("retier")
+    def retier(self, vector_store: Optional['VectorMemoryStore'] = None) -> Dict[str, int]:
+        """
+            批量重新分级 (如时间衰减之后): 所有层一次性向量化打分, 只重建有记忆进出的层
+            分级存储模式下传入 vector_store 时冷记忆一并重新分级, 升为高优先级的取回长期记忆库
+            返回各方向的移动条数, 如 {'long_term->mid_term': 3, 'moved': 3}
+        """
+        moves = {'moved': 0}
+        total = self._retier_hot(moves)
+        if vector_store is not None and self.cold_store is not None:
+            total += self._retier_cold(vector_store, moves)
+        moves['moved'] = sum(count for key, count in moves.items() if key != 'moved')
+        if moves['moved']:
+            events.emit("priority.retier", moved=moves['moved'], total=total)
+        return moves
+
+    def _target_tiers(self, memories: List[MemoryItem]) -> np.ndarray:
+        """目标层下标: 0 长期, 1 中期, 2 短期 (与 classify_priority 的阈值一致)"""
+        scores = self.evaluator.evaluate_many(memories)
+        return np.where(scores >= self.high_threshold, 0, np.where(scores >= self.medium_threshold, 1, 2))
+
+    def _retier_hot(self, moves: Dict[str, int]) -> int:
+        tiers = ('long_term', 'mid_term', 'short_term')
+        items = [getattr(self, tier) for tier in tiers]
+        memories = [m for tier_items in items for m in tier_items]
+        if not memories:
+            return 0
+
+        target = self._target_tiers(memories)
+        source = np.repeat(np.arange(3), [len(tier_items) for tier_items in items])
+        moved = target != source
+        if not moved.any():
+            return len(memories)
+
+        # 留在原层的保持原顺序, 移入的按原层顺序追加在后面
+        new_tiers = {}
+        for code, tier in enumerate(tiers):
+            stays = (source == code) & ~moved
+            incoming = (target == code) & moved
+            if stays.sum() == len(items[code]) and not incoming.any():
+                continue # 没有进出, 沿用原列表
+            new_tiers[tier] = [memories[i] for i in np.nonzero(stays)[0]] + \
+                              [memories[i] for i in np.nonzero(incoming)[0]]
+        for tier, tier_items in new_tiers.items():
+            setattr(self, tier, tier_items)
+
+        for src, dst in zip(source[moved], target[moved]):
+            key = f"{tiers[src]}->{tiers[dst]}"
+            moves[key] = moves.get(key, 0) + 1
+        return len(memories)
+
+    def _retier_cold(self, vector_store: 'VectorMemoryStore', moves: Dict[str, int]) -> int:
+        """冷记忆重新分级: 中/短期之间只改冷存储中的层级标记, 升为长期的取回内存并重新加入向量库"""
+        refs = list(self.cold_store.refs())
+        if not refs:
+            return 0
+        tiers = ('long_term', 'mid_term', 'short_term')
+        promoted = []
+        # 按段大小分批评估, 同一时刻只解析少量段, 不把冷记忆全部留在内存
+        step = self.cold_store.segment_size
+        for start in range(0, len(refs), step):
+            chunk = refs[start:start + step]
+            for ref, code in zip(chunk, self._target_tiers(self.cold_store.get_many(chunk))):
+                if code == 0:
+                    promoted.append(ref)
+                    continue
+                previous = self.cold_store.set_tier(ref, tiers[code])
+                if previous != tiers[code]:
+                    key = f"{previous}->{tiers[code]}"
+                    moves[key] = moves.get(key, 0) + 1
+        for memory, tier, embedding in self.cold_store.take(promoted):
+            self.long_term.append(memory)
+            vector_store.add(memory, embedding)
+            key = f"{tier}->long_term"
+            moves[key] = moves.get(key, 0) + 1
+        if promoted:
+            events.emit("priority.promote", count=len(promoted))
+        return len(refs)
+
+    def enable_tiered_storage(self, cold_store: 'ColdSegmentStore', hot_limit: int = 1000):
+        """开启分级存储: 长期记忆常驻内存, 中/短期记忆超过 hot_limit 条时连同向量换出到 cold_store"""
+        self.cold_store = cold_store
+        self.hot_limit = hot_limit
+
+    def maybe_spill(self, vector_store: 'VectorMemoryStore') -> int:
+        """内存中的中/短期记忆超过 hot_limit 时整体换出, 返回换出条数"""
+        if self.cold_store is None or len(self.mid_term) + len(self.short_term) <= self.hot_limit:
+            return 0
+        return self.spill(vector_store)
+
+    def spill(self, vector_store: 'VectorMemoryStore') -> int:
+        """把中/短期记忆及其向量移到冷存储, 同时从向量库与各层列表中删除"""
+        if self.cold_store is None:
+            raise RuntimeError("未开启分级存储, 请先调用 enable_tiered_storage")
+        rows = {id(m): i for i, m in enumerate(vector_store.memories)}
+        embeddings = vector_store.embeddings
+        entries = [
+            (memory, tier, embeddings[rows[id(memory)]])
+            for tier in ('mid_term', 'short_term')
+            for memory in getattr(self, tier)
+            if id(memory) in rows
+        ]
+        if not entries:
+            return 0
+        self.cold_store.spill(entries)
+        spilled = [memory for memory, _, _ in entries]
+        vector_store.remove(spilled)
+        self.remove(spilled)
+        events.emit("priority.spill", count=len(entries), cold=len(self.cold_store))
+        return len(entries)
+
+    def promote_cold(self, vector_store: 'VectorMemoryStore') -> int:
+        """重新评估冷存储中的记忆, 达到高优先级的取回长期记忆库并重新加入向量库, 返回晋升条数"""
+        if self.cold_store is None:
+            return 0
+        promoted = [
+            ref for ref in self.cold_store.refs()
+            if self.classify_priority(self.cold_store.get(ref)) == MemoryPriority.HIGH
+        ]
+        for memory, _, embedding in self.cold_store.take(promoted):
+            self.long_term.append(memory)
+            vector_store.add(memory, embedding)
+        if promoted:
+            events.emit("priority.promote", count=len(promoted))
+        return len(promoted)
 
     def get_statistics(self) -> Dict:
-        """获取存储统计"""
+        """获取存储统计 (分级存储模式下含冷存储中的记忆)"""
+        mid_term = len(self.mid_term)
+        short_term = len(self.short_term)
+        stats = {}
+        if self.cold_store is not None:
+            stats['冷存储'] = len(self.cold_store)
+            mid_term += self.cold_store.count('mid_term')
+            short_term += self.cold_store.count('short_term')
         return {
             '长期记忆': len(self.long_term),
-            '中期记忆': len(self.mid_term),
-            '短期记忆': len(self.short_term),
-            '总计': len(self.long_term) + len(self.mid_term) + len(self.short_term)
+            '中期记忆': mid_term,
+            '短期记忆': short_term,
+            '总计': len(self.long_term) + mid_term + short_term,
+            **stats
         }
     
 
 ############################### 测试部分 ###############################
-priority_manager = PriorityMemoryManager(evaluator)
 def main():
+    priority_manager = PriorityMemoryManager(MemoryValueEvaluator())
+
     # 创建优先级管理器
     print("✅ 优先级记忆管理器创建成功")
     print(f"\n优先级分类阈值：")
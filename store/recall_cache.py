@@ -0,0 +1,64 @@
+from memory import MemoryItem, MemoryType
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import threading
+
+RecallKey = Tuple[str, int, Optional[Tuple[str, ...]]]
+
+class RecallCache:
+    """
+        召回结果缓存: 按 (归一化查询, top_k, 过滤条件) 缓存 semantic_search 的结果
+        每条结果记录写入时向量库的 generation, 向量库一有变化旧结果即失效
+        LRU 淘汰, 容量固定
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[RecallKey, Tuple[int, List[Tuple[MemoryItem, float]]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0 # 因 generation 变化失效的次数 (计入 misses)
+
+    @staticmethod
+    def make_key(query: str, top_k: int, memory_types: Optional[Iterable[MemoryType]] = None) -> RecallKey:
+        """查询归一化: 合并空白 + casefold; 过滤类型排序后作为键的一部分"""
+        normalized = " ".join(query.split()).casefold()
+        types = tuple(sorted(t.name for t in memory_types)) if memory_types is not None else None
+        return (normalized, top_k, types)
+
+    def get(self, key: RecallKey, generation: int) -> Optional[List[Tuple[MemoryItem, float]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            if entry is not None:
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: RecallKey, generation: int, results: List[Tuple[MemoryItem, float]]):
+        with self._lock:
+            self._entries[key] = (generation, list(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_statistics(self) -> Dict:
+        """命中率等统计"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,222 @@
+# 多进程分片向量检索: 向量矩阵切片放进共享内存, 进程池并行打分后合并 top-k
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import weakref
+import numpy as np
+
+from store.vector_store import top_k_indices_2d
+
+_DTYPE = np.float32
+
+# 工作进程内已挂载的分片: name -> (SharedMemory, ndarray), 只保留当前代的分片
+_WORKER_SEGMENTS: Dict[str, Tuple[SharedMemory, np.ndarray]] = {}
+_WORKER_GENERATION: Optional[int] = None
+
+
+def _open_segment(name: str, rows: int, dim: int, track: bool = True) -> Tuple[SharedMemory, np.ndarray]:
+    """按名字挂载共享内存分片, 返回只读矩阵视图"""
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(name=name, track=track)
+    else:
+        shm = SharedMemory(name=name)
+        if not track:
+            # 3.12 没有 track 参数: 独立进程挂载后不能让自己的 resource_tracker 在退出时删除别人的分片
+            resource_tracker.unregister(shm._name, "shared_memory")
+    array = np.ndarray((rows, dim), dtype=_DTYPE, buffer=shm.buf)
+    array.flags.writeable = False
+    return shm, array
+
+
+def _drop_worker_segments():
+    while _WORKER_SEGMENTS:
+        _, (shm, array) = _WORKER_SEGMENTS.popitem()
+        del array # 先去掉视图, 映射才能关闭
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+
+def _score_shard(name: str, start: int, rows: int, dim: int, generation: int, track: bool,
+                 queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """工作进程: 对单个分片给一批查询打分, 返回每个查询的全局行号与分数, shape (m, k)"""
+    global _WORKER_GENERATION
+    if generation != _WORKER_GENERATION:
+        # 索引已重建, 旧分片的名字已被删除, 不再保留它们的映射
+        _drop_worker_segments()
+        _WORKER_GENERATION = generation
+    entry = _WORKER_SEGMENTS.get(name)
+    if entry is None:
+        # 挂载他人索引的进程 (track=False) 不能登记分片, 否则退出时会删除创建者的共享内存
+        entry = _WORKER_SEGMENTS[name] = _open_segment(name, rows, dim, track)
+
+    scores = queries @ entry[1].T
+    local = top_k_indices_2d(scores, top_k)
+    return local + start, np.take_along_axis(scores, local, axis=1)
+
+
+def _release(segments: List[SharedMemory], owner: bool):
+    for shm in segments:
+        try:
+            shm.close()
+        except BufferError:
+            pass # 仍有视图引用时无法关闭映射, 但名字照样要删除, 否则分片一直留在 /dev/shm
+        finally:
+            if owner:
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+class ShardSet:
+    """
+        一代分片: 同一次 build 的全部共享内存段
+        正在进行的检索持有引用, 最后一个引用释放时才关闭 (创建者同时删除) 共享内存,
+        重建不会删掉检索中工作进程还要读取的分片
+    """
+
+    def __init__(self, segments: List[SharedMemory], shards: List[Dict], size: int, dim: int,
+                 generation: int, owner: bool, tag=None):
+        self.shards = shards
+        self.size = size
+        self.dim = dim
+        self.generation = generation
+        self.owner = owner
+        self.tag = tag # 调用方的标记 (如 store 的行布局版本), 用于判断这一代是否过期
+        self._finalizer = weakref.finalize(self, _release, segments, owner)
+
+    def release(self):
+        self._finalizer()
+
+
+class ShardedVectorIndex:
+    """
+        分片向量索引:
+        - build: 把 L2 归一化后的矩阵按行切成 num_shards 片, 各自放进一块共享内存
+        - search: 进程池里每个工作进程直接读共享内存给一批查询打分 (不拷贝矩阵), 合并各片 top-k
+        - manifest/attach: 其它服务进程按清单只读挂载同一份索引
+    """
+
+    def __init__(self, num_shards: Optional[int] = None, max_workers: Optional[int] = None):
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.max_workers = max_workers or self.num_shards
+        self.current: Optional[ShardSet] = None
+        self._owner = True
+        self._generations = itertools.count()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        current = self.current
+        return current.size if current is not None else 0
+
+    @property
+    def dim(self) -> int:
+        current = self.current
+        return current.dim if current is not None else 0
+
+    @property
+    def shards(self) -> List[Dict]:
+        current = self.current
+        return current.shards if current is not None else []
+
+    def build(self, normalized: np.ndarray, tag=None) -> ShardSet:
+        """用新的矩阵建一代分片并设为当前, 旧一代在没有检索引用后释放"""
+        normalized = np.asarray(normalized, dtype=_DTYPE)
+        size, dim = normalized.shape
+        segments, shards = [], []
+        try:
+            for rows in np.array_split(np.arange(size), min(self.num_shards, max(size, 1))):
+                if len(rows) == 0:
+                    continue
+                start, count = int(rows[0]), len(rows)
+                shm = SharedMemory(create=True, size=max(count * dim * np.dtype(_DTYPE).itemsize, 1))
+                segments.append(shm)
+                np.ndarray((count, dim), dtype=_DTYPE, buffer=shm.buf)[:] = normalized[start:start + count]
+                shards.append({'name': shm.name, 'start': start, 'rows': count})
+        except BaseException:
+            _release(segments, True)
+            raise
+        shard_set = ShardSet(segments, shards, size, dim, next(self._generations), True, tag)
+        self._owner = True
+        self.current = shard_set
+        return shard_set
+
+    def manifest(self) -> Dict:
+        """供其它进程 attach 的索引清单"""
+        return {'dim': self.dim, 'size': self.size, 'dtype': np.dtype(_DTYPE).name, 'shards': list(self.shards)}
+
+    @classmethod
+    def attach(cls, manifest: Dict, max_workers: Optional[int] = None) -> 'ShardedVectorIndex':
+        """只读挂载其它进程创建的索引, 不复制矩阵, 本进程及其工作进程都不会在退出时删除分片"""
+        index = cls(num_shards=len(manifest['shards']), max_workers=max_workers)
+        shards = list(manifest['shards'])
+        segments = [_open_segment(s['name'], s['rows'], manifest['dim'], track=False)[0] for s in shards]
+        index.current = ShardSet(segments, shards, manifest['size'], manifest['dim'],
+                                 next(index._generations), False)
+        index._owner = False
+        return index
+
+    def search(self, normalized_queries: np.ndarray, top_k: int,
+               shard_set: Optional[ShardSet] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            并行检索, 返回 (全局行号, 分数), 按分数降序; 一批查询 (m, dim) 一次下发,
+            返回 shape (m, k), 单个查询向量返回一维结果
+            shard_set 为调用方事先取到的一代分片, 默认用当前一代
+        """
+        if shard_set is None:
+            shard_set = self.current
+        queries = np.asarray(normalized_queries, dtype=_DTYPE)
+        single = queries.ndim == 1
+        queries = np.atleast_2d(queries)
+        if shard_set is None or not shard_set.shards or top_k <= 0:
+            rows = np.empty((len(queries), 0), dtype=np.int64)
+            scores = np.empty((len(queries), 0), dtype=_DTYPE)
+        else:
+            executor = self._get_executor()
+            futures = [
+                executor.submit(_score_shard, s['name'], s['start'], s['rows'], shard_set.dim,
+                                shard_set.generation, shard_set.owner, queries, top_k)
+                for s in shard_set.shards
+            ]
+            results = [f.result() for f in futures]
+            rows = np.concatenate([r for r, _ in results], axis=1)
+            scores = np.concatenate([s for _, s in results], axis=1)
+            order = top_k_indices_2d(scores, top_k)
+            rows = np.take_along_axis(rows, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+        if single:
+            return rows[0], scores[0]
+        return rows, scores
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # fork 出来的工作进程会继承父进程当时的分片映射, 重建后这份旧拷贝一直释放不掉; 优先用 forkserver
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def reset(self):
+        """丢弃当前一代分片但保留进程池, 下次检索时按新矩阵重建"""
+        self.current = None
+
+    def close(self):
+        """关闭进程池并释放分片 (创建者会删除共享内存)"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        current, self.current = self.current, None
+        if current is not None:
+            current.release()
@@ -0,0 +1,139 @@
+# 整体快照: 一次性保存/恢复 agent 的全部存储, 向量用原始数组文件 + np.memmap 按需分页加载
+from store import dump
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, TYPE_CHECKING
+import json
+import os
+import shutil
+import numpy as np
+
+if TYPE_CHECKING:
+    from agent import SmartMemoryAgent
+
+SNAPSHOT_FORMAT = "memolite-snapshot"
+SNAPSHOT_VERSION = 1
+
+# 快照目录布局 (版本 1):
+#   manifest.json   格式/版本号, 记忆数, 向量维度与类型
+#   embeddings.f32  向量矩阵, float32 行优先, shape (count, dim)
+#   norms.f32       每行模长, 恢复时不必扫描整个矩阵
+#   state.jsonl     其余状态, 与 dump 的 JSONL 记录一致 (不含向量)
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.f32"
+NORMS_FILE = "norms.f32"
+STATE_FILE = "state.jsonl"
+
+
+def capture_state(agent: 'SmartMemoryAgent', fold_cold: bool = True) -> SimpleNamespace:
+    """
+        在 agent 锁内截取一致的状态视图 (快照与导出共用): 只复制列表/字典的引用, 不复制记忆和向量
+        向量矩阵 [0, n) 行在追加时不会被改写, 扩容/压缩会换新数组, 所以持有行视图即可
+        fold_cold: 冷存储中的记忆并入向量库与对应层级 (需复制向量), 恢复后全部回到内存;
+        为 False 时截取冷存储的只读视图 (ColdSnapshot, 用完由调用方 close), 由 dump 逐段流式读出,
+        current_version 中换出的记忆保持为冷存储位置
+    """
+    with agent._lock:
+        memories, embeddings, norms = agent.vector_store.capture()
+        tiers = {tier: list(getattr(agent.priority_manager, tier)) for tier in dump.TIERS}
+        cold_store = agent.cold_store if agent.cold_store is not None and len(agent.cold_store) else None
+        if fold_cold and cold_store is not None:
+            cold = list(cold_store.iter_entries())
+            cold_matrix = np.asarray([embedding for _, _, embedding in cold], dtype=np.float32)
+            memories += [memory for memory, _, _ in cold]
+            embeddings = np.concatenate([np.asarray(embeddings).reshape(-1, cold_matrix.shape[1]), cold_matrix])
+            norms = np.concatenate([norms, np.linalg.norm(cold_matrix, axis=1).astype(np.float32)])
+            for memory, tier, _ in cold:
+                tiers[tier].append(memory)
+            cold_store = None
+            current_version = dict(agent.update_manager.current_version.items())
+        else:
+            if cold_store is not None:
+                cold_store = cold_store.snapshot()
+            current_version = dict(agent.update_manager.current_version.raw())
+        return SimpleNamespace(
+            vector_store=SimpleNamespace(memories=memories, embeddings=embeddings, norms=norms),
+            priority_manager=SimpleNamespace(**tiers),
+            cold_store=cold_store,
+            kv_store=SimpleNamespace(store=dict(agent.kv_store.store)),
+            update_manager=SimpleNamespace(
+                version_history={k: list(v) for k, v in agent.update_manager.version_history.items()},
+                current_version=current_version
+            )
+        )
+
+
+def save_snapshot(agent: 'SmartMemoryAgent', path: str) -> Dict:
+    """写入快照目录 (先写临时目录再原子替换), 返回 manifest"""
+    state = capture_state(agent)
+    embeddings = np.ascontiguousarray(state.vector_store.embeddings, dtype=np.float32)
+    norms = np.ascontiguousarray(state.vector_store.norms, dtype=np.float32)
+
+    path = os.path.abspath(path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    embeddings.tofile(os.path.join(tmp_path, EMBEDDINGS_FILE))
+    norms.tofile(os.path.join(tmp_path, NORMS_FILE))
+    record_count = dump.write_jsonl(dump.iter_agent_records(state, include_embeddings=False),
+                                    os.path.join(tmp_path, STATE_FILE))
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.now().isoformat(),
+        'count': int(embeddings.shape[0]),
+        'dim': int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        'dtype': 'float32',
+        'records': record_count
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 替换旧快照: 旧目录先挪到备份位置, 新目录就位后再删除备份
+    # 两次 rename 之间崩溃时 path 不存在, load_snapshot 会退回到备份目录
+    backup_path = _backup_path(path)
+    if os.path.exists(path):
+        shutil.rmtree(backup_path, ignore_errors=True) # 上次崩溃遗留的备份, path 仍完好
+        os.replace(path, backup_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(backup_path, ignore_errors=True)
+    return manifest
+
+
+def _backup_path(path: str) -> str:
+    return f"{os.path.abspath(path)}.old"
+
+
+def resolve_snapshot_path(path: str) -> str:
+    """快照目录不完整 (保存时在替换中途崩溃) 时返回备份目录"""
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        backup_path = _backup_path(path)
+        if os.path.exists(os.path.join(backup_path, MANIFEST_FILE)):
+            return backup_path
+    return path
+
+
+def load_snapshot(agent: 'SmartMemoryAgent', path: str) -> Dict:
+    """用快照替换 agent 的全部存储, 向量以写时复制的 memmap 挂载, 返回 manifest"""
+    path = resolve_snapshot_path(path)
+    with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"不是 MemoLite 快照目录: {path}")
+    if manifest['version'] > SNAPSHOT_VERSION:
+        raise ValueError(f"不支持的快照版本: {manifest['version']}")
+
+    count, dim = manifest['count'], manifest['dim']
+    if count:
+        # mode='c': 只读映射文件, 写入只发生在进程私有页, 不会改动快照
+        matrix = np.memmap(os.path.join(path, EMBEDDINGS_FILE), dtype=np.float32, mode='c', shape=(count, dim))
+        norms = np.memmap(os.path.join(path, NORMS_FILE), dtype=np.float32, mode='c', shape=(count,))
+    else:
+        matrix = np.empty((0, dim), dtype=np.float32)
+        norms = np.empty(0, dtype=np.float32)
+
+    with agent._lock:
+        agent._reset_stores()
+        dump.load_agent_records(agent, dump.read_jsonl(os.path.join(path, STATE_FILE)), vectors=(matrix, norms))
+    return manifest
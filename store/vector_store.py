@@ -1,50 +1,612 @@
-from langchain_siliconflow import SiliconFlowEmbeddings
-from config import embeddings
-from memory import MemoryItem, sample_memories
-from typing import List, Dict, Tuple
+from memory import MemoryItem, MemoryType, sample_memories
+from metrics import metrics
+from events import events
+from store.coarse import CoarseIndex, rerank
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple, TYPE_CHECKING
+import threading
 import numpy as np
 
+if TYPE_CHECKING:
+    from langchain_siliconflow import SiliconFlowEmbeddings
+    from store.sharded import ShardedVectorIndex
+
+_MEMORY_TYPES = list(MemoryType)
+_TYPE_CODES = {t: i for i, t in enumerate(_MEMORY_TYPES)}
+
 class VectorMemoryStore:
-    """向量化记忆存储： embedding, 添加, 检索"""
+    """向量化记忆存储： embedding, 添加, 检索, 删除/更新 (墓碑标记 + 后台压缩)"""
 
-    def __init__(self, embeddings: SiliconFlowEmbeddings):
+    def __init__(self, embeddings: 'SiliconFlowEmbeddings', compaction_ratio: float = 0.25,
+                 compaction_min_size: int = 1024):
         """embedding模型, 原记忆, 向量池"""
         self.embedding_model = embeddings
-        self.memories: List[MemoryItem] = []
-        self.embeddings: List[np.ndarray] = []
+        # 行对齐的原始数据, 含已删除 (墓碑) 的行; 对外的 memories/embeddings/ids/norms 只含存活行
+        self._memories: List[MemoryItem] = []
+        # 向量池: 连续的 float32 矩阵, 按倍增扩容; 同时缓存每行的模长, 检索只需一次矩阵乘
+        self._matrix: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+        self._types: Optional[np.ndarray] = None # 每行的记忆类型编码, 按类型过滤时使用
+        self._ids: Optional[np.ndarray] = None   # 每行的记忆 id, 单调递增, add 时分配
+        self._alive: Optional[np.ndarray] = None # 墓碑标记: 删除只把对应行置 False, 检索时跳过
+        self._next_id = 0
+        self._tombstones = 0
+
+        # 墓碑占比超过 compaction_ratio (且行数不少于 compaction_min_size) 时在后台线程重写矩阵
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_size = compaction_min_size
+        self._compaction_thread: Optional[threading.Thread] = None
+        # 同一时刻只允许一次压缩; 加锁顺序固定为先 _compaction_lock 后 _lock
+        self._compaction_lock = threading.RLock()
+        # 保护行数组的替换与写入; 检索只在锁内取引用, 打分在锁外进行
+        self._lock = threading.RLock()
+
+        # 代数: 每次内容变化 (添加/删除/衰减) 加一, 上层缓存据此判断是否失效
+        self.generation = 0
+
+        # 行布局版本: 压缩/挂载改变行号时加一, 粗排矩阵据此判断是否需要重投影
+        self._layout = 0
+        # 两阶段检索的低维粗排矩阵 (enable_coarse_search 开启)
+        self._coarse: Optional[CoarseIndex] = None
+        self.coarse_min_size = 0
+
+        # 分片并行检索 (enable_sharding 开启)
+        self._sharded: Optional['ShardedVectorIndex'] = None
+        self.shard_min_size = 0
+        self.shard_rebuild_ratio = 0.1
+        # 串行化分片重建 (在 _lock 之外进行), 避免并发检索重复拷贝整个矩阵
+        self._shard_build_lock = threading.Lock()
+
+    def _live_rows(self, array: Optional[np.ndarray], empty: np.ndarray) -> np.ndarray:
+        if array is None:
+            return empty
+        n = len(self._memories)
+        if self._tombstones == 0:
+            return array[:n]
+        return array[:n][self._alive[:n]]
+
+    @property
+    def memories(self) -> List[MemoryItem]:
+        """当前存活的记忆, 与 embeddings/ids/norms 按行对应"""
+        if self._tombstones == 0:
+            return self._memories
+        return [m for m, alive in zip(self._memories, self._alive) if alive]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """当前所有向量, shape (n, dim)"""
+        return self._live_rows(self._matrix, np.empty((0, 0), dtype=np.float32))
+
+    @property
+    def ids(self) -> np.ndarray:
+        """每行记忆的 id, shape (n,), 按添加顺序递增"""
+        return self._live_rows(self._ids, np.empty(0, dtype=np.int64))
+
+    @property
+    def norms(self) -> np.ndarray:
+        """每行向量的模长, shape (n,)"""
+        return self._live_rows(self._norms, np.empty(0, dtype=np.float32))
+
+    @property
+    def tombstones(self) -> int:
+        """已删除但尚未压缩掉的行数"""
+        return self._tombstones
+
+    def __len__(self) -> int:
+        return len(self._memories) - self._tombstones
+
+    def capture(self) -> Tuple[List[MemoryItem], 'LiveRows', np.ndarray]:
+        """
+            锁内截取 (存活记忆, 向量, 模长) 的一致视图; 向量是不复制矩阵的只读行视图,
+            [0, n) 行在追加/扩容/压缩时都不会被改写, 截取后可在锁外逐行读取
+        """
+        with self._lock:
+            n = len(self._memories)
+            alive = self._alive[:n].copy() if self._tombstones else None
+            return self.memories[:], LiveRows(self._matrix, n, alive), self.norms.copy()
+
+    def attach_matrix(self, memories: List[MemoryItem], matrix: np.ndarray, norms: np.ndarray):
+        """
+            直接挂载已有的向量矩阵 (如快照里的 np.memmap), 不拷贝;
+            下次添加需要扩容时才会复制到内存
+        """
+        if len(matrix) != len(memories) or len(norms) != len(memories):
+            raise ValueError(f"向量行数 {len(matrix)} 与记忆数 {len(memories)} 不一致")
+        with self._lock:
+            if self._sharded is not None:
+                self._sharded.reset()
+            n = len(memories)
+            self._memories = list(memories)
+            self._matrix = matrix if n else None
+            self._norms = norms if n else None
+            self._types = np.array([_TYPE_CODES[m.memory_type] for m in memories], dtype=np.uint8) if n else None
+            self._ids = np.arange(n, dtype=np.int64) if n else None
+            self._alive = np.ones(n, dtype=bool) if n else None
+            self._next_id = n
+            self._tombstones = 0
+            self._layout += 1
+            self.bump_generation()
+
+    def bump_generation(self):
+        """标记内容已变化 (如重要性衰减), 使依赖 generation 的缓存失效"""
+        self.generation += 1
+
+    def _append_row(self, memory: MemoryItem, embedding: np.ndarray) -> int:
+        """追加一行向量, 容量不足时倍增 (换新数组, 不改写已有行), 返回分配的 id"""
+        n = len(self._memories)
+        if self._matrix is None:
+            self._matrix = np.zeros((64, len(embedding)), dtype=np.float32)
+            self._norms = np.zeros(64, dtype=np.float32)
+            self._types = np.zeros(64, dtype=np.uint8)
+            self._ids = np.zeros(64, dtype=np.int64)
+            self._alive = np.zeros(64, dtype=bool)
+        elif n >= len(self._matrix):
+            capacity = max(len(self._matrix) * 2, 64)
+            matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=np.float32)
+            matrix[:n] = self._matrix[:n]
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[:n] = self._norms[:n]
+            types = np.zeros(capacity, dtype=np.uint8)
+            types[:n] = self._types[:n]
+            ids = np.zeros(capacity, dtype=np.int64)
+            ids[:n] = self._ids[:n]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:n] = self._alive[:n]
+            self._matrix, self._norms, self._types, self._ids, self._alive = matrix, norms, types, ids, alive
+        memory_id = self._next_id
+        self._next_id += 1
+        self._matrix[n] = embedding
+        self._norms[n] = np.linalg.norm(self._matrix[n])
+        self._types[n] = _TYPE_CODES[memory.memory_type]
+        self._ids[n] = memory_id
+        self._alive[n] = True
+        return memory_id
 
+    def _row_of(self, memory_id: int) -> Optional[int]:
+        """id 到行号: 行按 id 递增排列, 二分查找"""
+        n = len(self._memories)
+        if n == 0:
+            return None
+        row = int(np.searchsorted(self._ids[:n], memory_id))
+        if row < n and self._ids[row] == memory_id and self._alive[row]:
+            return row
+        return None
+
+    def find_id(self, memory: MemoryItem) -> Optional[int]:
+        """按对象身份查找记忆的 id (线性扫描), 不存在时返回 None"""
+        with self._lock:
+            for row, m in enumerate(self._memories):
+                if m is memory and self._alive[row]:
+                    return int(self._ids[row])
+        return None
+
+    def get(self, memory_id: int) -> Optional[MemoryItem]:
+        """按 id 取记忆, 已删除或不存在时返回 None"""
+        with self._lock:
+            row = self._row_of(memory_id)
+            return self._memories[row] if row is not None else None
+
+    def _tombstone(self, row: int):
+        self._alive[row] = False
+        self._tombstones += 1
+
+    def delete(self, memory_id: int) -> bool:
+        """删除记忆: 只打墓碑, 检索立即不再返回; 返回是否删除成功"""
+        with self._lock:
+            row = self._row_of(memory_id)
+            if row is None:
+                return False
+            self._tombstone(row)
+            self.generation += 1
+            memory = self._memories[row]
+        events.emit("vector.delete", memory=memory)
+        self._maybe_compact()
+        return True
+
+    def update(self, memory_id: int, memory: MemoryItem, embedding: Optional[np.ndarray] = None) -> Optional[int]:
+        """
+            更新记忆: 旧行打墓碑, 新内容追加为新行, 返回新 id (旧 id 不存在时返回 None)
+            内容不变且未给出向量时直接复用旧向量, 不再请求 embedding
+        """
+        with self._lock:
+            row = self._row_of(memory_id)
+            if row is None:
+                return None
+            if embedding is None and memory.content == self._memories[row].content:
+                embedding = np.array(self._matrix[row])
+        if embedding is None:
+            embedding = self.get_embedding(memory.content)
+        with self._lock:
+            row = self._row_of(memory_id)
+            if row is None:
+                return None # 向量化期间已被删除
+            self._tombstone(row)
+            new_id = self._append_row(memory, np.asarray(embedding))
+            self._memories.append(memory)
+            self.generation += 1
+        events.emit("vector.update", memory=memory)
+        self._maybe_compact()
+        return new_id
+
+    def remove(self, memories: Iterable[MemoryItem]) -> int:
+        """按对象身份删除记忆 (打墓碑), 返回删除的条数"""
+        targets = {id(m) for m in memories}
+        removed = 0
+        with self._lock:
+            for row, m in enumerate(self._memories):
+                if id(m) in targets and self._alive[row]:
+                    self._tombstone(row)
+                    removed += 1
+            if removed:
+                self.generation += 1
+        if removed:
+            self._maybe_compact()
+        return removed
+
+    def _maybe_compact(self):
+        """墓碑占比超过阈值时启动后台压缩 (已有压缩在运行则跳过)"""
+        with self._lock:
+            n = len(self._memories)
+            if n < self.compaction_min_size or self._tombstones <= n * self.compaction_ratio:
+                return
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, name="vector-compaction", daemon=True)
+            self._compaction_thread.start()
+
+    def wait_for_compaction(self):
+        """等待正在运行的后台压缩结束"""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+
+    @metrics.timed("vector_compact")
+    def compact(self) -> int:
+        """
+            压缩: 把存活行重写进新数组并替换, 返回清理的墓碑数
+            重写在锁外基于当时的行快照进行, 期间的检索与写入不受阻塞;
+            替换时再补上压缩期间新追加的行与新打的墓碑
+            多次压缩 (后台/share_index/手动) 由 _compaction_lock 串行化
+        """
+        with self._compaction_lock:
+            return self._compact()
+
+    def _compact(self) -> int:
+        with self._lock:
+            n = len(self._memories)
+            if self._tombstones == 0:
+                return 0
+            matrix, norms, types, ids = self._matrix, self._norms, self._types, self._ids
+            keep = self._alive[:n].copy()
+            memories = self._memories[:n]
+            layout = self._layout
+
+        # 锁外重写: 扩容换新数组, 追加只写 n 之后的行, 这里读取的 [0, n) 行不会变化
+        new_matrix = matrix[:n][keep]
+        new_norms = norms[:n][keep]
+        new_types = types[:n][keep]
+        new_ids = ids[:n][keep]
+        new_memories = [m for m, k in zip(memories, keep) if k]
+
+        with self._lock:
+            if self._layout != layout:
+                return 0 # 重写期间行布局已被替换 (如 attach_matrix), 快照作废
+            size = len(self._memories)
+            # 压缩期间被删除的行沿用墓碑; 新追加的行原样接在后面
+            new_alive = np.concatenate([self._alive[:n][keep], self._alive[n:size]])
+            if size > n:
+                new_matrix = np.concatenate([new_matrix, self._matrix[n:size]])
+                new_norms = np.concatenate([new_norms, self._norms[n:size]])
+                new_types = np.concatenate([new_types, self._types[n:size]])
+                new_ids = np.concatenate([new_ids, self._ids[n:size]])
+                new_memories += self._memories[n:size]
+            cleaned = n - int(keep.sum())
+            if len(new_memories) == 0:
+                self._matrix = self._norms = self._types = self._ids = self._alive = None
+            else:
+                self._matrix, self._norms, self._types = new_matrix, new_norms, new_types
+                self._ids, self._alive = new_ids, new_alive
+            self._memories = new_memories
+            self._tombstones = len(new_alive) - int(new_alive.sum())
+            self._layout += 1
+            if self._sharded is not None:
+                self._sharded.reset()
+            self.generation += 1
+        events.emit("vector.compact", cleaned=cleaned, size=len(new_memories))
+        return cleaned
+
+    @metrics.timed("get_embedding")
     def get_embedding(self, text: str) -> np.ndarray:
         """获取文本的embedding"""
+        if metrics.enabled:
+            metrics.incr("get_embedding", "bytes", len(text.encode('utf-8')))
         embedding = self.embedding_model.embed_query(text)
         return np.array(embedding)
 
-    def add(self, memory: MemoryItem):
-        """添加记忆, 自动向量化"""
-        embedding = self.get_embedding(memory.content)
-        self.memories.append(memory)
-        self.embeddings.append(embedding)
-        print(f"向量化存储: {memory.content}")
+    def get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """批量获取 embedding, 一次请求"""
+        if metrics.enabled:
+            metrics.incr("get_embedding", "bytes", sum(len(t.encode('utf-8')) for t in texts))
+        with metrics.span("get_embedding"):
+            return [np.array(e) for e in self.embedding_model.embed_documents(texts)]
+
+    def add(self, memory: MemoryItem, embedding: Optional[np.ndarray] = None) -> int:
+        """添加记忆, 自动向量化; 已有向量(如导入时)可直接传入; 返回记忆 id"""
+        if embedding is None:
+            embedding = self.get_embedding(memory.content)
+        with self._lock:
+            memory_id = self._append_row(memory, np.asarray(embedding))
+            self._memories.append(memory)
+            self.generation += 1
+        events.emit("vector.add", memory=memory)
+        return memory_id
 
-    def semantic_search(self, query: str, top_k: int=3) -> List[Tuple[MemoryItem, float]]:
-        """语义检索"""
+    def add_many(self, memories: List[MemoryItem]) -> List[int]:
+        """批量添加记忆, 一次 embed_documents 请求; 返回记忆 id"""
+        if not memories:
+            return []
+        return [
+            self.add(memory, embedding)
+            for memory, embedding in zip(memories, self.get_embeddings([m.content for m in memories]))
+        ]
+
+    @metrics.timed("semantic_search")
+    def semantic_search(self, query: str, top_k: int=3,
+                        memory_types: Optional[Iterable[MemoryType]] = None) -> List[Tuple[MemoryItem, float]]:
+        """语义检索, 可按记忆类型过滤"""
         q_embedding = self.get_embedding(query)
-        similarities = []
-        for i, mem_embedding in enumerate(self.embeddings):
-            # 相似度: 点乘 / 模乘
-            similarity = np.dot(mem_embedding, q_embedding) / (
-                np.linalg.norm(mem_embedding) * np.linalg.norm(q_embedding)
-            )
-            similarities.append((self.memories[i], similarity))
-
-        # 降序排序, .sort 直接原地排序
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:top_k]
+        return self.search_by_vector(q_embedding, top_k, memory_types)
+
+    def search_by_vector(self, q_embedding: np.ndarray, top_k: int=3,
+                         memory_types: Optional[Iterable[MemoryType]] = None) -> List[Tuple[MemoryItem, float]]:
+        """按查询向量检索, 相似度: 点乘 / 模乘; 墓碑行不参与排序"""
+        return self.search_by_vectors(np.asarray(q_embedding)[None, :], top_k, memory_types)[0]
+
+    @metrics.timed("semantic_search_many")
+    def semantic_search_many(self, queries: List[str], top_k: int=3,
+                             memory_types: Optional[Iterable[MemoryType]] = None) -> List[List[Tuple[MemoryItem, float]]]:
+        """批量语义检索: 一次 embed_documents 请求, 一次矩阵乘, 返回每个查询各自的 top_k"""
+        if not queries:
+            return []
+        return self.search_by_vectors(np.asarray(self.get_embeddings(queries)), top_k, memory_types)
+
+    def search_by_vectors(self, q_embeddings: np.ndarray, top_k: int=3,
+                          memory_types: Optional[Iterable[MemoryType]] = None) -> List[List[Tuple[MemoryItem, float]]]:
+        """
+            按一组查询向量检索, shape (m, dim) 的查询与向量池做一次矩阵乘;
+            开启粗排且行数足够时, 先在低维矩阵上挑候选, 再只对候选做全维精排
+        """
+        Q = np.atleast_2d(np.asarray(q_embeddings, dtype=np.float32))
+        if top_k <= 0 or len(self) == 0:
+            return [[] for _ in range(len(Q))]
+        Q = Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+
+        if memory_types is None and self._sharded is not None and len(self._memories) >= self.shard_min_size:
+            return self._sharded_search(Q, top_k)
+
+        # 锁内只取当前数组的引用与存活标记的副本, 打分在锁外
+        with self._lock:
+            n = len(self._memories)
+            matrix, norms, types, ids = self._matrix, self._norms, self._types, self._ids
+            alive = self._alive[:n].copy() if self._tombstones else None
+            memories = self._memories
+            layout = self._layout
+        mask = alive
+        if memory_types is not None:
+            type_mask = np.isin(types[:n], [_TYPE_CODES[t] for t in memory_types])
+            mask = type_mask if mask is None else mask & type_mask
+        if mask is not None:
+            top_k = min(top_k, int(mask.sum()))
+
+        candidates = None
+        coarse = self._coarse
+        if coarse is not None and n >= self.coarse_min_size and coarse.sync(matrix, norms, ids, n, layout):
+            candidates = coarse.candidates(Q, top_k, n, layout, mask)
+        if candidates is not None:
+            hits = [rerank(matrix, norms, q, rows, top_k, mask) for q, rows in zip(Q, candidates)]
+        else:
+            similarities = (Q @ matrix[:n].T) / np.maximum(norms[:n], 1e-12)
+            if mask is not None:
+                similarities = np.where(mask, similarities, -np.inf)
+            hits = [
+                (rows, similarities[q, rows])
+                for q, rows in enumerate(top_k_indices_2d(similarities, top_k))
+            ]
+        return [[(memories[i], float(s)) for i, s in zip(rows, scores)] for rows, scores in hits]
+
+    def enable_coarse_search(self, dim: int = 128, method: str = 'pca', oversample: int = 8,
+                             min_size: int = 20000, refit_ratio: float = 0.5):
+        """
+            开启两阶段检索: 记忆数不少于 min_size 时, 先在 dim 维投影矩阵上取 top_k * oversample 个候选,
+            再用全维向量精排; method 为 'pca' (按已存向量拟合) 或 'prefix' (前缀截断, 适合 Matryoshka 模型)
+            已有向量时 dim 必须小于向量维度; 向量池为空时无法校验, 之后向量维度不大于 dim 则检索退回全量
+        """
+        with self._lock:
+            full = self._matrix.shape[1] if self._matrix is not None else None
+        if full is not None and dim >= full:
+            raise ValueError(f"粗排维度 {dim} 不小于向量维度 {full}")
+        self._coarse = CoarseIndex(dim, method, oversample, refit_ratio=refit_ratio)
+        self.coarse_min_size = min_size
+
+    def disable_coarse_search(self):
+        self._coarse = None
+
+    def settings(self) -> Dict:
+        """压缩/粗排/分片配置, 换用新的 store (如加载快照) 时用 apply_settings 复现"""
+        settings = {
+            'compaction_ratio': self.compaction_ratio,
+            'compaction_min_size': self.compaction_min_size,
+            'coarse': None,
+            'sharding': None
+        }
+        if self._coarse is not None:
+            settings['coarse'] = dict(dim=self._coarse.dim, method=self._coarse.method,
+                                      oversample=self._coarse.oversample, min_size=self.coarse_min_size,
+                                      refit_ratio=self._coarse.refit_ratio)
+        if self._sharded is not None:
+            settings['sharding'] = dict(num_shards=self._sharded.num_shards, max_workers=self._sharded.max_workers,
+                                        min_size=self.shard_min_size, rebuild_ratio=self.shard_rebuild_ratio)
+        return settings
+
+    def apply_settings(self, settings: Dict):
+        self.compaction_ratio = settings['compaction_ratio']
+        self.compaction_min_size = settings['compaction_min_size']
+        if settings['coarse'] is not None:
+            self.enable_coarse_search(**settings['coarse'])
+        if settings['sharding'] is not None:
+            self.enable_sharding(**settings['sharding'])
+
+    def close(self):
+        """释放分片检索的进程池与共享内存, 丢弃粗排矩阵"""
+        self.disable_sharding()
+        self.disable_coarse_search()
+
+    def enable_sharding(self, num_shards: Optional[int] = None, max_workers: Optional[int] = None,
+                        min_size: int = 50000, rebuild_ratio: float = 0.1):
+        """
+            开启多进程分片检索: 记忆数不少于 min_size 时, 检索交给共享内存上的进程池
+            索引建立后新增的记忆在本进程直接打分, 新增部分超过 rebuild_ratio 时整体重建
+        """
+        from store.sharded import ShardedVectorIndex
+        self.disable_sharding()
+        self._sharded = ShardedVectorIndex(num_shards, max_workers)
+        self.shard_min_size = min_size
+        self.shard_rebuild_ratio = rebuild_ratio
+
+    def disable_sharding(self):
+        """关闭分片检索并释放共享内存与进程池"""
+        if self._sharded is not None:
+            self._sharded.close()
+            self._sharded = None
+
+    def share_index(self) -> Dict:
+        """
+            返回分片索引清单, 其它服务进程可用 ShardedVectorIndex.attach(manifest)
+            只读挂载同一份向量, 返回的行号与本 store 的 memories 下标一致 (先压缩掉墓碑)
+        """
+        if self._sharded is None:
+            raise RuntimeError("未开启分片检索, 请先调用 enable_sharding")
+        with self._compaction_lock, self._lock, self._shard_build_lock:
+            self.compact()
+            n = len(self._memories)
+            current = self._sharded.current
+            if current is None or current.tag != self._layout or current.size != n:
+                self._sharded.build(self._normalized_rows(0, n), tag=self._layout)
+            return self._sharded.manifest()
+
+    def _normalized_rows(self, start: int, end: int) -> np.ndarray:
+        return self._matrix[start:end] / np.maximum(self._norms[start:end], 1e-12)[:, None]
+
+    def _shards_stale(self, shard_set, n: int, layout: int) -> bool:
+        """分片不存在/行布局已变 (压缩等) 或索引之后新增超过 rebuild_ratio 时需要重建"""
+        if shard_set is None or shard_set.tag != layout:
+            return True
+        return (n - shard_set.size) > shard_set.size * self.shard_rebuild_ratio
+
+    def _rebuild_sharded(self, sharded: 'ShardedVectorIndex', matrix: np.ndarray, norms: np.ndarray,
+                         n: int, layout: int):
+        """锁外重建分片: [0, n) 行在数组替换前不会被改写, 直接从取到的引用拷贝"""
+        with self._shard_build_lock:
+            shard_set = sharded.current
+            if not self._shards_stale(shard_set, n, layout):
+                return shard_set # 其它检索刚重建过
+            normalized = matrix[:n] / np.maximum(norms[:n], 1e-12)[:, None]
+            return sharded.build(normalized, tag=layout)
+
+    def _sharded_search(self, Q: np.ndarray, top_k: int) -> List[List[Tuple[MemoryItem, float]]]:
+        """
+            分片并行打分, 整批查询一次下发给进程池; 索引之后新增的尾部在本进程打分, 最后去掉墓碑行合并
+            锁内只取数组引用与当前一代分片, 重建与打分都在锁外, 不阻塞写入和其它检索
+        """
+        with self._lock:
+            n = len(self._memories)
+            matrix, norms = self._matrix, self._norms
+            alive = self._alive[:n].copy() if self._tombstones else None
+            memories = self._memories
+            layout = self._layout
+            sharded = self._sharded
+            shard_set = sharded.current
+        if self._shards_stale(shard_set, n, layout):
+            shard_set = self._rebuild_sharded(sharded, matrix, norms, n, layout)
+
+        indexed = shard_set.size
+        # 多取墓碑数 (以及其它检索按更新的行数重建出的多余行) 那么多的候选, 过滤后仍能凑满 top_k
+        dead = n - int(alive.sum()) if alive is not None else 0
+        k = top_k + dead + max(indexed - n, 0)
+        rows, scores = sharded.search(Q, k, shard_set)
+        if n > indexed:
+            tail = Q @ (matrix[indexed:n] / np.maximum(norms[indexed:n], 1e-12)[:, None]).T
+            tail_rows = top_k_indices_2d(tail, k)
+            rows = np.concatenate([rows, tail_rows + indexed], axis=1)
+            scores = np.concatenate([scores, np.take_along_axis(tail, tail_rows, axis=1)], axis=1)
+
+        results = []
+        for q_rows, q_scores in zip(rows, scores):
+            keep = q_rows < n
+            if alive is not None:
+                keep &= alive[np.minimum(q_rows, n - 1)]
+            q_rows, q_scores = q_rows[keep], q_scores[keep]
+            order = top_k_indices(q_scores, top_k)
+            results.append([(memories[i], float(s)) for i, s in zip(q_rows[order], q_scores[order])])
+        return results
+
+
+class LiveRows:
+    """向量矩阵存活行的只读视图: 逐行迭代时跳过墓碑, 只有转成数组时才复制"""
+
+    def __init__(self, matrix: Optional[np.ndarray], n: int, alive: Optional[np.ndarray] = None):
+        self._matrix = matrix
+        self._n = n if matrix is not None else 0
+        self._alive = alive
+
+    def __len__(self) -> int:
+        return self._n if self._alive is None else int(self._alive.sum())
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self), self._matrix.shape[1] if self._matrix is not None else 0)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for row in range(self._n):
+            if self._alive is None or self._alive[row]:
+                yield self._matrix[row]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        if self._matrix is None:
+            array = np.empty((0, 0), dtype=np.float32)
+        else:
+            array = self._matrix[:self._n]
+            if self._alive is not None:
+                array = array[self._alive]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """返回分数最高的 top_k 个下标 (降序), argpartition 避免全量排序"""
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def top_k_indices_2d(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """按行返回分数最高的 top_k 个下标 (每行降序), shape (m, top_k)"""
+    m, n = scores.shape
+    if top_k <= 0:
+        return np.empty((m, 0), dtype=np.int64)
+    if top_k >= n:
+        return np.argsort(-scores, axis=1, kind='stable')
+    candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
 
         
 ############################### 测试部分 ###############################
-vec_store = VectorMemoryStore(embeddings)
-
 def main():
+    from config import get_embeddings
+    vec_store = VectorMemoryStore(get_embeddings())
+
     print("向量化 记忆存储示例: ")
     for mem in sample_memories:
         vec_store.add(mem)
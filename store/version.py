@@ -1,8 +1,14 @@
 from dataclasses import dataclass
 from collections import defaultdict
+from collections.abc import MutableMapping
 from memory import MemoryItem, MemoryType
+from metrics import metrics
+from events import events
 from datetime import datetime
-from typing import List, Dict
+from typing import Iterator, List, Dict, Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from store.cold_tier import ColdSegmentStore
 
 
 @dataclass
@@ -14,15 +20,91 @@ class MemoryVersion:
     confidence: float
     source: str # 'user', 'system', 'inferred'
 
+
+class CurrentVersions(MutableMapping):
+    """
+        key -> 当前记忆
+        分级存储模式下作为冷存储的持有者: 换出的记忆只保存 (段号, 行号), 读取时经 cold_store 取回,
+        不再强引用冷记忆; raw() 返回未解析的存储, 需要遍历时优先用 items()/values() (按段批量取回)
+    """
+
+    def __init__(self):
+        self._items: Dict[str, Union[MemoryItem, Tuple[int, int]]] = {}
+        self.cold_store: Optional['ColdSegmentStore'] = None
+
+    def __getitem__(self, key: str) -> MemoryItem:
+        value = self._items[key]
+        return value if isinstance(value, MemoryItem) else self.cold_store.get(value)
+
+    def __setitem__(self, key: str, memory: MemoryItem):
+        value = self._items.get(key)
+        if isinstance(value, tuple) and self.cold_store.resident(value) is memory:
+            # 仍是同一条冷记忆 (如冲突解决保留旧记忆): 保持位置, 变化写回冷存储
+            self.cold_store.write_back(value, memory)
+            return
+        self._items[key] = memory
+
+    def __delitem__(self, key: str):
+        del self._items[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def raw(self) -> Dict[str, Union[MemoryItem, Tuple[int, int]]]:
+        return self._items
+
+    def resident(self) -> Iterator[Tuple[str, MemoryItem]]:
+        """只遍历在内存中的当前记忆"""
+        for key, value in self._items.items():
+            if isinstance(value, MemoryItem):
+                yield key, value
+
+    def items(self) -> List[Tuple[str, MemoryItem]]:
+        keys = list(self._items)
+        values = [self._items[key] for key in keys]
+        cold = [i for i, value in enumerate(values) if not isinstance(value, MemoryItem)]
+        if cold:
+            for i, memory in zip(cold, self.cold_store.get_many(values[i] for i in cold)):
+                values[i] = memory
+        return list(zip(keys, values))
+
+    def values(self) -> List[MemoryItem]:
+        return [memory for _, memory in self.items()]
+
+    # ColdSegmentStore 持有者回调
+    def cold_spilled(self, pairs: List[Tuple[MemoryItem, Tuple[int, int]]]):
+        refs = {id(memory): ref for memory, ref in pairs}
+        for key, value in self._items.items():
+            if isinstance(value, MemoryItem) and id(value) in refs:
+                self._items[key] = refs[id(value)]
+
+    def cold_restored(self, pairs: List[Tuple[Tuple[int, int], MemoryItem]]):
+        memories = dict(pairs)
+        for key, value in self._items.items():
+            if isinstance(value, tuple) and value in memories:
+                self._items[key] = memories[value]
+
+    def cold_removed(self, refs: List[Tuple[int, int]]):
+        # 冷记忆被删除 (过期等) 后仍是该 key 的当前版本, 与热层一致: 取回对象继续持有
+        refs = set(refs)
+        for key, value in self._items.items():
+            if isinstance(value, tuple) and value in refs:
+                self._items[key] = self.cold_store.get(value)
+
+
 class MemoryUpdateManager:
     """记忆更新与冲突解决管理器"""
 
     def __init__(self):
         # 存储每个key的版本历史
         self.version_history: Dict[str, List[MemoryVersion]] = defaultdict(list)
-        self.current_version: Dict[str, MemoryItem] = {}
+        self.current_version = CurrentVersions()
         self.decay_rate = 0.1 # 每天衰减10%
 
+    @metrics.timed("add_or_update")
     def add_or_update(self, key: str, new_memory:MemoryItem, source: str='system'):
         """添加或更新记忆(带版本控制)"""
         # 创建版本目录
@@ -39,25 +121,22 @@ class MemoryUpdateManager:
         # 判断是否冲突
         if key in self.current_version:
             old_memory = self.current_version[key]
-            print(f"⚠️  检测到记忆更新: {key}")
-            print(f"   旧版本: {old_memory.content}")
-            print(f"   新版本: {new_memory.content}")
-            print(f"   版本号: v{version_num}")
+            events.emit("version.update", key=key, old=old_memory, new=new_memory, version=version_num)
 
             # 解决冲突
             resolved = self._resolve_conflict(old_memory, new_memory, source)
             self.current_version[key] = resolved
-            print(f"   ✅ 冲突已解决，采用: {resolved.content}")
+            events.emit("version.resolved", memory=resolved)
         else:
             self.current_version[key] = new_memory
-            print(f"✨ 新增记忆: {key} -> {new_memory.content}")
+            events.emit("version.add", key=key, memory=new_memory)
 
         
     def _resolve_conflict(self, old: MemoryItem, new: MemoryItem, source: str):
         """解决冲突策略"""
         # 1. 用户反馈优先级最高
         if source == 'user':
-            print(f"   🎯 策略: 用户反馈优先")
+            events.emit("version.strategy_user")
             return new
         
         # 2. 置信度加权
@@ -65,35 +144,46 @@ class MemoryUpdateManager:
         new_weight = new.confidence
 
         if new_weight > old_weight:
-            print(f"   ⚖️  策略: 高置信度优先 (新:{new_weight:.2f} > 旧:{old_weight:.2f})")
+            events.emit("version.strategy_new", new=new_weight, old=old_weight)
             return new
         elif new_weight < old_weight:
-            print(f"   ⚖️  策略: 保持高置信度 (旧:{old_weight:.2f} > 新:{new_weight:.2f})")
+            events.emit("version.strategy_old", new=new_weight, old=old_weight)
             # 增加旧记忆的频率
             old.frequency += 1
             return old
         else:
             # 3: 相同置信度，选择最新的
-            print(f"   ⏰ 策略: 时间优先（置信度相同）")
+            events.emit("version.strategy_time")
             return new if new.timestamp > old.timestamp else old
 
     def apply_time_decay(self, days_passed: float = 1.0):
         """应用时间衰减"""
-        print(f"\n⏳ 应用时间衰减 (经过{days_passed}天)...\n")
+        events.emit("decay.start", days=days_passed)
+
+        # 剩余比例：每天衰减 decay_rate 比例, 衰减了 days_passed 天
+        decay_factor = (1 - self.decay_rate) ** days_passed
+        cold_store = self.current_version.cold_store
+        for key, memory in self.current_version.raw().items():
+            if not isinstance(memory, MemoryItem):
+                # 换出的记忆: 类型与重要性都在冷存储的常驻列上, 不用解析段文件
+                if cold_store.memory_type(memory) in [MemoryType.USER_PROFILE, MemoryType.PREFERENCES]:
+                    if events.enabled:
+                        events.emit("decay.skip", key=key, memory=cold_store.get(memory))
+                    continue
+                old_importance, new_importance = cold_store.scale_importance(memory, decay_factor)
+                events.emit("decay.apply", key=key, old=old_importance, new=new_importance)
+                continue
 
-        for key, memory in self.current_version.items():
             # 某些类型不衰减
             if memory.memory_type in [MemoryType.USER_PROFILE, MemoryType.PREFERENCES]:
-                print(f"    {key}: 不衰减 (类型: {memory.memory_type.value})")
+                events.emit("decay.skip", key=key, memory=memory)
                 continue
             
             # 计算衰减
             old_importance = memory.importance
-            # 剩余比例：每天衰减 decay_rate 比例, 衰减了 days_passed 天
-            decay_factor = (1 - self.decay_rate) ** days_passed
             memory.importance = old_importance * decay_factor
 
-            print(f"  {key}: {old_importance:.3f} -> {memory.importance:.3f}")
+            events.emit("decay.apply", key=key, old=old_importance, new=memory.importance)
 
     def get_version_history(self, key: str) -> List[MemoryVersion]:
         """获取版本历史"""
@@ -114,14 +204,14 @@ class MemoryUpdateManager:
             confidence=target_version.confidence
         )
         self.current_version[key] = rolled_back # 会滚到目标版本
-        print(f"🔙 已回滚 {key} 到版本 v{version_num}")
+        events.emit("version.rollback", key=key, version=version_num)
         return True
 
 
 ############################### 测试部分 ###############################
-update_manager = MemoryUpdateManager()
-
 def main():
+    update_manager = MemoryUpdateManager()
+
     print("✅ 记忆更新管理器创建成功")    
 
     # 演示记忆更新与冲突解决
@@ -1,10 +1,15 @@
 from memory import MemoryItem, MemoryType
-from store.kv_store import KeyValueMemoryStore, kv_store
-from store.vector_store import VectorMemoryStore, vec_store
+from events import events
+from store.kv_store import KeyValueMemoryStore
+from store.vector_store import VectorMemoryStore
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Dict
-from collections import defaultdict
+from typing import Dict, List, Optional
+from collections import defaultdict, deque
+import time
+
+LOG_CONTENT_LENGTH = 50 # 写入日志中保留的内容长度
 
 class WriteStrategy(Enum):
     """写入策略类型"""
@@ -13,18 +18,81 @@ class WriteStrategy(Enum):
     EVENT_BASED = "事件触发"
     FEEDBACK_BASED = "用户反馈"
 
+@dataclass(slots=True)
+class WriteLogEntry:
+    """写入日志项: 只保存写入时刻的截断内容与类型, 不持有记忆对象; 时间戳需要展示时再转换"""
+    timestamp: float
+    strategy: WriteStrategy
+    memory_type: str
+    content: str
+    extra: Dict = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        """转换为字典格式"""
+        return {
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'strategy': self.strategy.value,
+            'memory_type': self.memory_type,
+            'content': self.content,
+            'extra': self.extra
+        }
+
+class ThroughputWindow:
+    """
+        按秒分桶的环形计数器:
+        记录 O(1), 查询最近 window 秒的速率只需扫描 window 个桶
+    """
+
+    def __init__(self, horizon: int = 300):
+        self.horizon = horizon # 最长可查询的窗口(秒)
+        self.seconds = [-1] * horizon
+        self.counts = [0] * horizon
+
+    def record(self, now: float, n: int = 1):
+        second = int(now)
+        idx = second % self.horizon
+        if self.seconds[idx] != second:
+            self.seconds[idx] = second
+            self.counts[idx] = 0
+        self.counts[idx] += n
+
+    def rate(self, window: int, now: Optional[float] = None) -> float:
+        """最近 window 秒内的平均每秒写入数"""
+        window = min(window, self.horizon)
+        current = int(time.time() if now is None else now)
+        total = 0
+        for second in range(current - window + 1, current + 1):
+            idx = second % self.horizon
+            if self.seconds[idx] == second:
+                total += self.counts[idx]
+        return total / window
+
 class MemoryWriter:
     """记忆写入管理器"""
 
-    def __init__(self, kv_store: KeyValueMemoryStore, vector_store: VectorMemoryStore):
+    # 速率查询窗口: 名称 -> 秒
+    RATE_WINDOWS = {'1m': 60, '5m': 300}
+
+    def __init__(self, kv_store: KeyValueMemoryStore, vector_store: VectorMemoryStore,
+                 log_capacity: int = 1000):
         self.kv_store = kv_store
         self.vector_store = vector_store
         self.batch_buffer: List[MemoryItem] = []
-        self.write_log: List[Dict] = []
+        # 最近写入日志, 定长环形缓冲区, 旧记录自动丢弃
+        self.write_log: deque = deque(maxlen=log_capacity)
+
+        # 累计计数与速率, 每次写入 O(1) 更新
+        self.total_writes = 0
+        self.strategy_counts: Dict[WriteStrategy, int] = defaultdict(int)
+        self.type_counts: Dict[MemoryType, int] = defaultdict(int)
+        horizon = max(self.RATE_WINDOWS.values())
+        self.total_throughput = ThroughputWindow(horizon)
+        self.strategy_throughput: Dict[WriteStrategy, ThroughputWindow] = defaultdict(lambda: ThroughputWindow(horizon))
+        self.type_throughput: Dict[MemoryType, ThroughputWindow] = defaultdict(lambda: ThroughputWindow(horizon))
 
     def write_realtime(self, key: str, memory: MemoryItem):
         """实时写入 - 立即存储关键信息"""
-        print(f"⚡ [实时写入] 触发")
+        events.emit("writer.realtime")
         self.kv_store.set(key, memory)
         self.vector_store.add(memory)
         self._log_write(WriteStrategy.REALTIME, memory)
@@ -32,15 +100,15 @@ class MemoryWriter:
     def add_to_batch(self, memory: MemoryItem):
         """添加到批处理缓冲区"""
         self.batch_buffer.append(memory)
-        print(f"📦 [批处理] 已加入缓冲区，当前缓冲: {len(self.batch_buffer)} 条")
+        events.emit("writer.batch_add", size=len(self.batch_buffer))
 
     def flush_batch(self):
         """批量写入"""
         if not self.batch_buffer:
-            print("📦 [批处理] 缓冲区为空，无需写入")
+            events.emit("writer.batch_empty")
             return
 
-        print(f"\n📦 [批处理] 开始写入 {len(self.batch_buffer)} 条记忆...")
+        events.emit("writer.batch_start", size=len(self.batch_buffer))
         for i, memory in enumerate(self.batch_buffer, 1):
             key = f"batch_{datetime.now().timestamp()}_{i}"
             self.kv_store.set(key, memory)
@@ -49,11 +117,11 @@ class MemoryWriter:
 
         count = len(self.batch_buffer)
         self.batch_buffer.clear()
-        print(f"✅ [批处理] 完成，已写入 {count} 条记忆")
+        events.emit("writer.batch_done", size=count)
 
     def write_on_event(self, event_type: str, memory: MemoryItem):
         """事件触发写入"""
-        print(f"🎯 [事件触发] 事件: {event_type}")
+        events.emit("writer.event", event_type=event_type)
         key = f"event_{event_type}_{datetime.now().timestamp()}"
         self.kv_store.set(key, memory)
         self.vector_store.add(memory)
@@ -61,35 +129,60 @@ class MemoryWriter:
 
     def write_from_feedback(self, user_command: str, memory: MemoryItem):
         """用户反馈触发写入"""
-        print(f"💬 [用户反馈] 指令: {user_command}")
+        events.emit("writer.feedback", command=user_command)
         key = f"feedback_{datetime.now().timestamp()}"
         self.kv_store.set(key, memory)
         self.vector_store.add(memory)
         self._log_write(WriteStrategy.FEEDBACK_BASED, memory, {'command': user_command})
 
     def _log_write(self, strategy: WriteStrategy, memory: MemoryItem, extra: Dict = None):
-        """记录写入日志"""
-        log_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'strategy': strategy.value,
-            'memory_type': memory.memory_type.value,
-            'content': memory.content[:50],
-            'extra': extra or {}
-        }
-        self.write_log.append(log_entry)
+        """记录写入日志, 同时更新计数与速率"""
+        now = time.time()
+        self.write_log.append(WriteLogEntry(
+            now, strategy, memory.memory_type.value, memory.content[:LOG_CONTENT_LENGTH], dict(extra or {})
+        ))
+
+        self.total_writes += 1
+        self.strategy_counts[strategy] += 1
+        self.type_counts[memory.memory_type] += 1
+        self.total_throughput.record(now)
+        self.strategy_throughput[strategy].record(now)
+        self.type_throughput[memory.memory_type].record(now)
 
     def get_write_statistics(self) -> Dict:
-        """获取写入统计"""
-        stats = defaultdict(int)
-        for log in self.write_log:
-            stats[log['strategy']] += 1
-        return dict(stats)
+        """获取写入统计 (按策略累计次数)"""
+        return {strategy.value: count for strategy, count in self.strategy_counts.items()}
 
+    def get_type_statistics(self) -> Dict:
+        """获取写入统计 (按记忆类型累计次数)"""
+        return {memory_type.value: count for memory_type, count in self.type_counts.items()}
+
+    def get_write_rates(self) -> Dict:
+        """获取最近 1m/5m 的写入速率 (次/秒), 总体、按策略、按记忆类型"""
+        now = time.time()
+
+        def rates(window: ThroughputWindow) -> Dict[str, float]:
+            return {name: window.rate(seconds, now) for name, seconds in self.RATE_WINDOWS.items()}
+
+        return {
+            'total': rates(self.total_throughput),
+            'strategy': {s.value: rates(w) for s, w in self.strategy_throughput.items()},
+            'memory_type': {t.value: rates(w) for t, w in self.type_throughput.items()}
+        }
+
+    def get_recent_writes(self, n: Optional[int] = None) -> List[Dict]:
+        """获取最近 n 条写入日志 (默认全部缓冲)"""
+        entries = list(self.write_log)
+        if n is not None:
+            entries = entries[-n:] if n > 0 else []
+        return [entry.to_dict() for entry in entries]
 
-############################### 测试部分 ###############################
-writer = MemoryWriter(kv_store, vec_store)
 
+############################### 测试部分 ###############################
 def main():
+    from config import get_embeddings
+    writer = MemoryWriter(KeyValueMemoryStore(), VectorMemoryStore(get_embeddings()))
+
     # 创建写入管理器
     print("✅ 记忆写入管理器创建成功")
 
@@ -167,7 +260,8 @@ def main():
     for strategy, count in stats.items():
         print(f"  {strategy}: {count} 次")
 
-    print(f"\n总写入次数: {sum(stats.values())} 次")
+    print(f"\n总写入次数: {writer.total_writes} 次")
+    print(f"最近 1 分钟写入速率: {writer.get_write_rates()['total']['1m']:.3f} 次/秒")
 
 
 
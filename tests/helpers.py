@@ -0,0 +1,24 @@
+# 测试公用: 用 replay 的本地替身构建 agent, 不需要凭证也不联网
+from agent import SmartMemoryAgent
+from config import config
+from events import events, NullSink
+from memory import MemoryItem, MemoryType
+from replay import StubEmbeddings, StubLLM
+from datetime import datetime
+from typing import Optional
+
+events.set_sink(NullSink())
+
+
+def make_agent(**kwargs) -> SmartMemoryAgent:
+    return SmartMemoryAgent(StubEmbeddings(), StubLLM(), config, **kwargs)
+
+
+def make_memory(content: str, memory_type: MemoryType = MemoryType.FACTS, importance: float = 0.1,
+                confidence: float = 0.5, temporal_validity: Optional[datetime] = None) -> MemoryItem:
+    return MemoryItem(content=content, memory_type=memory_type, timestamp=datetime.now(),
+                      importance=importance, confidence=confidence, temporal_validity=temporal_validity)
+
+
+def recalled(agent: SmartMemoryAgent, query: str, top_k: int = 5):
+    return [memory for memory, _ in agent.recall(query, top_k)]
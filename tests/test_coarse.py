@@ -0,0 +1,59 @@
+# 两阶段检索: 粗排维度不小于向量维度时退回精确检索, 首次二阶矩累加与拟合不在检索线程进行
+from memory import MemoryType
+from replay import StubEmbeddings
+from store.vector_store import VectorMemoryStore
+from tests.helpers import make_memory
+import threading
+import unittest
+import numpy as np
+
+
+def filled_store(count: int = 300, dim: int = 16) -> VectorMemoryStore:
+    store = VectorMemoryStore(StubEmbeddings())
+    rng = np.random.default_rng(0)
+    for i, vector in enumerate(rng.standard_normal((count, dim)).astype(np.float32)):
+        store.add(make_memory(f"记忆{i}", MemoryType.FACTS), vector)
+    return store
+
+
+def contents(results):
+    return [[memory.content for memory, _ in hits] for hits in results]
+
+
+class CoarseSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = np.random.default_rng(1).standard_normal((5, 16)).astype(np.float32)
+
+    def test_dim_not_smaller_than_vectors_falls_back_to_exact(self):
+        exact = filled_store()
+        store = VectorMemoryStore(StubEmbeddings())
+        store.enable_coarse_search(dim=32, min_size=10) # 开启时向量池为空, 无法提前校验
+        for memory, vector in zip(exact.memories, exact.embeddings):
+            store.add(memory, vector)
+        self.assertEqual(contents(store.search_by_vectors(self.queries, 5)),
+                         contents(exact.search_by_vectors(self.queries, 5)))
+
+    def test_first_fit_runs_in_background(self):
+        store = filled_store()
+        store.enable_coarse_search(dim=8, oversample=100, min_size=10)
+        coarse = store._coarse
+        threads = []
+        second_moment = coarse._second_moment
+
+        def recording(*args):
+            threads.append(threading.current_thread())
+            return second_moment(*args)
+
+        coarse._second_moment = recording
+        first = store.search_by_vectors(self.queries, 5)
+        coarse.wait()
+        self.assertTrue(threads)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertEqual(coarse.size, 300)
+        # 候选覆盖全部行时, 粗排 + 精排与精确检索一致
+        self.assertEqual(contents(store.search_by_vectors(self.queries, 5)), contents(first))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# 分级存储开启 (hot_limit=0, 中/短期记忆全部换出) 时, 过期/更新/回滚要同步删除冷存储中的旧记忆;
+# 换出的记忆不再被版本管理/频率追踪强引用, 变化写回冷存储后页被淘汰也不丢失
+from tests.helpers import make_agent, make_memory, recalled
+from datetime import datetime, timedelta
+import gc
+import unittest
+import weakref
+
+
+class ColdTierRemovalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = make_agent()
+        self.agent.enable_tiered_storage(hot_limit=0)
+
+    def tearDown(self):
+        self.agent.cold_store.close()
+
+    def test_expire_removes_cold_memory(self):
+        expired = make_memory("上周的临时任务", temporal_validity=datetime.now() + timedelta(seconds=1))
+        self.agent.update_memory("task", expired)
+        self.agent.spill_cold_memories()
+        self.assertEqual(len(self.agent.cold_store), 1)
+        self.assertIn(expired, recalled(self.agent, expired.content))
+
+        self.assertEqual(self.agent.expire_memories(datetime.now() + timedelta(days=1)), 1)
+        self.assertEqual(len(self.agent.cold_store), 0)
+        self.assertNotIn(expired, recalled(self.agent, expired.content))
+
+    def test_update_replaces_cold_memory(self):
+        old = make_memory("用户住在上海")
+        self.agent.update_memory("city", old)
+        self.agent.spill_cold_memories()
+
+        new = make_memory("用户住在北京")
+        self.assertIs(self.agent.update_memory("city", new, source='user'), new)
+        self.assertEqual(len(self.agent.cold_store), 0)
+        self.assertNotIn(old, recalled(self.agent, old.content))
+        self.assertIn(new, recalled(self.agent, new.content))
+
+    def test_rollback_replaces_cold_memory(self):
+        self.agent.update_memory("city", make_memory("用户住在上海"))
+        current = self.agent.update_memory("city", make_memory("用户住在北京"), source='user')
+        self.agent.spill_cold_memories()
+
+        self.assertTrue(self.agent.rollback_memory("city", 1))
+        self.assertEqual(len(self.agent.cold_store), 0)
+        self.assertNotIn(current, recalled(self.agent, current.content))
+        self.assertEqual(recalled(self.agent, "用户住在上海", 1)[0].content, "用户住在上海")
+
+    def test_retier_promotes_and_moves_cold_memories(self):
+        rising = make_memory("用户是数据科学家", importance=0.3)
+        falling = make_memory("用户在看一本小说", importance=0.3, confidence=0.9)
+        self.agent.update_memory("job", rising)
+        self.agent.update_memory("book", falling)
+        self.agent.spill_cold_memories()
+        self.assertEqual(self.agent.cold_store.count('mid_term'), 2)
+
+        rising.importance, rising.confidence = 1.0, 1.0
+        falling.importance, falling.confidence = 0.0, 0.0
+        moves = self.agent.priority_manager.retier(self.agent.vector_store)
+        self.assertEqual(moves, {'moved': 2, 'mid_term->long_term': 1, 'mid_term->short_term': 1})
+        self.assertIn(rising, self.agent.priority_manager.long_term)
+        self.assertEqual(self.agent.cold_store.count('short_term'), 1)
+        self.assertIn(rising, recalled(self.agent, rising.content))
+
+
+class ColdTierResidencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = make_agent()
+        self.agent.enable_frequency_tracking(promote_threshold=1)
+        self.agent.enable_tiered_storage(hot_limit=0, segment_size=4, cache_segments=1)
+        self.contents = [f"用户去过城市{i}" for i in range(12)]
+        self.refs = []
+        for i, content in enumerate(self.contents):
+            memory = make_memory(content, importance=0.3)
+            self.agent.update_memory(f"city{i}", memory)
+            self.agent.frequency_tracker.register(memory)
+            self.refs.append(weakref.ref(memory))
+        self.agent.spill_cold_memories()
+        self.agent.vector_store.compact() # 墓碑行在压缩前仍引用旧记忆, 小数据量不会自动压缩
+        gc.collect()
+
+    def tearDown(self):
+        self.agent.cold_store.close()
+
+    def test_spilled_memories_are_released(self):
+        self.assertEqual(len(self.agent.cold_store), 12)
+        self.assertEqual([ref for ref in self.refs if ref() is not None], [])
+        current_version = self.agent.update_manager.current_version
+        self.assertTrue(all(isinstance(value, tuple) for value in current_version.raw().values()))
+
+        misses = self.agent.cold_store.page_misses
+        self.assertEqual(current_version["city5"].content, self.contents[5])
+        self.assertEqual(self.agent.cold_store.page_misses, misses + 1)
+        self.assertEqual([m.content for _, m in current_version.items()], self.contents)
+
+    def test_changes_survive_page_eviction(self):
+        self.agent.update_manager.apply_time_decay(1.0)
+        repeat = make_memory(" 用户去过城市1 ")
+        self.assertIsNone(self.agent._track_frequency(repeat))
+        self.assertIsNone(self.agent._track_frequency(repeat))
+
+        current_version = self.agent.update_manager.current_version
+        current_version["city11"] # 换入另一段, 城市1 所在的页被淘汰
+        gc.collect()
+        self.assertIsNone(self.agent.cold_store.resident(current_version.raw()["city1"]))
+        memory = current_version["city1"]
+        self.assertAlmostEqual(memory.importance, 0.3 * 0.9)
+        self.assertEqual(memory.frequency, 2) # 登记时未计数, 两次重复后 sketch 估计为 2
+
+    def test_promotion_restores_object(self):
+        memory = self.agent.update_manager.current_version["city2"]
+        memory.importance, memory.confidence = 1.0, 1.0
+        self.agent.priority_manager.retier(self.agent.vector_store)
+        self.assertIs(self.agent.update_manager.current_version.raw()["city2"], memory)
+        self.assertIs(self.agent.frequency_tracker.stored(make_memory("用户去过城市2")), memory)
+        self.assertIn(memory, self.agent.priority_manager.long_term)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# 增量整合: 跨多轮逐条加入的重复记忆也要并入同一个簇; LLM 或后台轮次失败不能丢掉待合并的记忆
+from memory import MemoryType
+from replay import StubEmbeddings
+from store.consolidation import MemoryConsolidator
+from store.vector_store import VectorMemoryStore
+from store.version import MemoryUpdateManager
+from tests.helpers import make_memory
+import time
+import unittest
+import numpy as np
+
+
+class IncrementalConsolidationTest(unittest.TestCase):
+
+    def test_duplicates_across_runs_merge_into_seeded_cluster(self):
+        vector_store = VectorMemoryStore(StubEmbeddings())
+        update_manager = MemoryUpdateManager()
+        consolidator = MemoryConsolidator(vector_store, update_manager)
+        rng = np.random.default_rng(0)
+        base = rng.standard_normal(64).astype(np.float32)
+
+        contents = ["用户喜欢喝咖啡", "用户爱喝咖啡", "用户每天都喝咖啡"]
+        stats = []
+        for i, content in enumerate(contents):
+            memory = make_memory(content, MemoryType.FACTS)
+            vector_store.add(memory, base + 0.01 * rng.standard_normal(64).astype(np.float32))
+            update_manager.add_or_update(f"fact_{i}", memory)
+            stats.append(consolidator.consolidate())
+
+        self.assertEqual(stats[0]['merged'], 0)
+        self.assertEqual([s['clusters'] for s in stats[1:]], [1, 1])
+        self.assertEqual(len(vector_store), 1)
+        merged = vector_store.memories[0]
+        self.assertEqual(merged.frequency, 3)
+        self.assertEqual(merged.metadata['consolidated_from'], 3)
+
+    def test_deleted_seed_is_replaced(self):
+        vector_store = VectorMemoryStore(StubEmbeddings())
+        consolidator = MemoryConsolidator(vector_store, MemoryUpdateManager())
+        base = np.ones(64, dtype=np.float32)
+
+        seed = make_memory("用户在北京工作")
+        vector_store.add(seed, base)
+        consolidator.consolidate()
+        vector_store.remove([seed])
+
+        for content in ("用户的工作地点是北京", "用户在北京上班"):
+            vector_store.add(make_memory(content), base)
+            consolidator.consolidate()
+        self.assertEqual(len(vector_store), 1)
+        self.assertEqual(vector_store.memories[0].metadata['consolidated_from'], 2)
+
+    def test_llm_failure_still_merges(self):
+        vector_store = VectorMemoryStore(StubEmbeddings())
+        consolidator = MemoryConsolidator(vector_store, MemoryUpdateManager(), llm=FailingLLM())
+        base = np.ones(64, dtype=np.float32)
+        for content in ("用户喜欢喝咖啡", "用户爱喝咖啡", "用户每天都喝咖啡"):
+            vector_store.add(make_memory(content), base)
+
+        stats = consolidator.consolidate(summarize=True)
+        self.assertEqual(stats['merged'], 3)
+        self.assertEqual(len(vector_store), 1)
+
+    def test_background_loop_survives_errors(self):
+        vector_store = VectorMemoryStore(StubEmbeddings())
+        consolidator = MemoryConsolidator(vector_store, MemoryUpdateManager())
+        calls = []
+
+        def flaky(summarize=False):
+            calls.append(summarize)
+            raise ConnectionError("模型服务不可用")
+
+        consolidator.consolidate = flaky
+        consolidator.start_background(interval=0.01)
+        deadline = time.monotonic() + 5
+        while len(calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(consolidator.background_running)
+        consolidator.stop_background()
+        self.assertGreaterEqual(len(calls), 3)
+
+
+class FailingLLM:
+    def invoke(self, prompt):
+        raise ConnectionError("模型服务不可用")
+
+
+if __name__ == "__main__":
+    unittest.main()
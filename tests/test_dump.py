@@ -0,0 +1,100 @@
+# 批量导出/导入: JSONL 与二进制往返一致 (含冷存储与重复向量), 导出期间的更新不影响导出
+from memory import MemoryType
+from store import dump
+from tests.helpers import make_agent, make_memory
+import os
+import tempfile
+import unittest
+import numpy as np
+
+
+def state_of(agent):
+    """按内容比较的状态摘要"""
+    cold = [(m.content, tier) for m, tier, _ in agent.cold_store.iter_entries()] if agent.cold_store else []
+    return {
+        'vector': sorted([m.content for m in agent.vector_store.memories] + [c for c, _ in cold]),
+        'tiers': {
+            tier: sorted([m.content for m in getattr(agent.priority_manager, tier)] +
+                         [c for c, t in cold if t == tier])
+            for tier in dump.TIERS
+        },
+        'kv': {key: m.content for key, m in agent.kv_store.store.items()},
+        'current': {key: m.content for key, m in agent.update_manager.current_version.items()},
+        'history': {key: [v.content for v in h] for key, h in agent.update_manager.version_history.items()}
+    }
+
+
+class DumpRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.agent = make_agent()
+        self.agent.update_memory("city", make_memory("用户住在上海"))
+        self.agent.update_memory("city", make_memory("用户住在北京"), source='user')
+        self.agent.update_memory("job", make_memory("用户是工程师", MemoryType.USER_PROFILE, importance=0.9))
+        self.agent.kv_store.set("name", make_memory("用户叫小王", importance=0.9))
+        self.duplicate = make_memory("同一条记忆存了两行")
+        self.agent.vector_store.add(self.duplicate)
+        self.agent.vector_store.add(self.duplicate)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _round_trip(self, fmt):
+        path = os.path.join(self.tmp.name, f"dump.{fmt}")
+        expected = state_of(self.agent)
+        self.agent.export_memories(path, fmt)
+        restored = make_agent()
+        counts = restored.import_memories(path, fmt)
+        self.assertEqual(counts.get('embedded', 0), 0) # 向量随导出保存, 导入不重新请求
+        self.assertEqual(state_of(restored), expected)
+        rows = [m for m in restored.vector_store.memories if m.content == self.duplicate.content]
+        self.assertEqual(len(rows), 2)
+        self.assertIs(rows[0], rows[1])
+        np.testing.assert_allclose(restored.vector_store.embeddings, self.agent.vector_store.embeddings, rtol=1e-6)
+
+    def test_jsonl_round_trip(self):
+        self._round_trip('jsonl')
+
+    def test_binary_round_trip(self):
+        self._round_trip('binary')
+
+    def test_round_trip_with_cold_entries(self):
+        self.agent.enable_tiered_storage(hot_limit=0)
+        self.assertGreater(self.agent.spill_cold_memories() + len(self.agent.cold_store), 0)
+        for fmt in ('jsonl', 'binary'):
+            path = os.path.join(self.tmp.name, f"cold.{fmt}")
+            expected = state_of(self.agent)
+            self.agent.export_memories(path, fmt)
+            restored = make_agent()
+            restored.import_memories(path, fmt)
+            self.assertEqual(state_of(restored), expected)
+        self.agent.cold_store.close()
+
+    def test_updates_during_export_are_not_seen(self):
+        path = os.path.join(self.tmp.name, "dump.jsonl")
+        write_jsonl = dump.write_jsonl
+
+        def write_with_update(records, path):
+            def interleaved():
+                for i, record in enumerate(records):
+                    yield record
+                    if i >= 3:
+                        continue
+                    self.agent.update_memory(f"new_{i}", make_memory(f"导出期间新增{i}"))
+                    self.agent.kv_store.set(f"new_{i}", make_memory(f"导出期间新增{i}"))
+            return write_jsonl(interleaved(), path)
+
+        dump.write_jsonl = write_with_update
+        try:
+            self.agent.export_memories(path, 'jsonl')
+        finally:
+            dump.write_jsonl = write_jsonl
+        restored = make_agent()
+        restored.import_memories(path)
+        self.assertFalse(any(key.startswith("new_") for key in restored.update_manager.current_version))
+        self.assertFalse(any(key.startswith("new_") for key in restored.kv_store.store))
+
+
+if __name__ == "__main__":
+    unittest.main()
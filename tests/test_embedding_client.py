@@ -0,0 +1,69 @@
+# 并发 embedding 客户端: 没有 HTTP 配置时被包装对象的网络错误同样重试; close 与提交竞争时不留下挂起的请求
+from embedding_client import PooledEmbeddingClient
+from replay import StubEmbeddings
+import threading
+import unittest
+
+
+class FlakyEmbeddings:
+    """前 failures 次调用抛出 error, 之后正常返回"""
+
+    def __init__(self, error: Exception, failures: int):
+        self.stub = StubEmbeddings()
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return self.stub.embed_documents(texts)
+
+
+class PooledEmbeddingClientTest(unittest.TestCase):
+
+    def test_fallback_retries_connection_errors(self):
+        embeddings = FlakyEmbeddings(ConnectionError("connection reset"), failures=2)
+        client = PooledEmbeddingClient(embeddings, backoff_base=0.0)
+        try:
+            self.assertEqual(client.embed_query("你好"), embeddings.stub.embed_query("你好"))
+            self.assertEqual(embeddings.calls, 3)
+        finally:
+            client.close()
+
+    def test_fallback_does_not_retry_other_errors(self):
+        embeddings = FlakyEmbeddings(ValueError("bad input"), failures=1)
+        client = PooledEmbeddingClient(embeddings, backoff_base=0.0)
+        try:
+            with self.assertRaises(ValueError):
+                client.embed_query("你好")
+            self.assertEqual(embeddings.calls, 1)
+        finally:
+            client.close()
+
+    def test_submit_after_close_clears_inflight(self):
+        client = PooledEmbeddingClient(StubEmbeddings())
+        client._executor.shutdown(wait=True) # 模拟 close 在 _closed 检查之后关闭了线程池
+        with self.assertRaises(RuntimeError):
+            client.embed_documents(["你好", "再见"])
+        self.assertEqual(client._inflight, {})
+
+        # 同一文本的后续调用不会等在残留的 Future 上
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self._try_embed(client, "你好")), daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(result[0], RuntimeError)
+
+    @staticmethod
+    def _try_embed(client, text):
+        try:
+            return client.embed_query(text)
+        except RuntimeError as e:
+            return e
+
+
+if __name__ == "__main__":
+    unittest.main()
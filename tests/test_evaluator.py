@@ -0,0 +1,54 @@
+# 评估器分数缓存: 重要性/频率/置信度/类型/权重变化后不会返回旧分数, 批量与单条评估一致
+from evaluator import MemoryValueEvaluator
+from memory import MemoryType
+from tests.helpers import make_memory
+import unittest
+
+
+class ScoreCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.evaluator = MemoryValueEvaluator()
+        self.memory = make_memory("用户在学日语", importance=0.4, confidence=0.6)
+        self.evaluator.evaluate(self.memory)
+
+    def assertFresh(self):
+        """缓存得分与清空缓存后重新计算的一致, 批量评估也一致"""
+        total = self.evaluator.evaluate(self.memory)['total_score']
+        batch = self.evaluator.evaluate_many([self.memory])[0]
+        self.memory._score_cache = None
+        expected = self.evaluator.evaluate(self.memory)['total_score']
+        self.assertAlmostEqual(total, expected)
+        self.assertAlmostEqual(batch, expected)
+        return expected
+
+    def test_unchanged_memory_hits_cache(self):
+        cache = self.memory._score_cache
+        self.evaluator.evaluate(self.memory)
+        self.evaluator.evaluate_many([self.memory])
+        self.assertIs(self.memory._score_cache, cache)
+
+    def test_importance_change_invalidates(self):
+        before = self.assertFresh()
+        self.memory.importance = 0.9
+        self.assertAlmostEqual(self.assertFresh() - before, 0.5 * self.evaluator.weights['importance'])
+
+    def test_frequency_change_invalidates(self):
+        before = self.assertFresh()
+        self.memory.frequency = 10
+        self.assertGreater(self.assertFresh(), before)
+
+    def test_confidence_and_type_change_invalidate(self):
+        before = self.assertFresh()
+        self.memory.confidence = 1.0
+        self.memory.memory_type = MemoryType.USER_PROFILE
+        self.assertGreater(self.assertFresh(), before)
+
+    def test_weight_change_invalidates(self):
+        before = self.assertFresh()
+        self.evaluator.weights['importance'] = 0.0 # 原地修改权重字典
+        self.assertAlmostEqual(before - self.assertFresh(), 0.4 * 0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# 频率追踪: 暂缓计数在并发存储下不丢失, 快照恢复后重复信号仍能对应到已有记忆
+from tests.helpers import make_agent, make_memory
+import os
+import tempfile
+import threading
+import unittest
+
+
+class FrequencyTrackingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = make_agent()
+        self.agent.enable_frequency_tracking(promote_threshold=1000)
+
+    def test_pending_counted_under_concurrency(self):
+        def worker(n):
+            for i in range(200):
+                self.agent._track_frequency(make_memory(f"闲聊{n}-{i}", importance=0.0, confidence=0.0))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.agent.frequency_tracker.pending, 8 * 200)
+
+    def test_repeat_detected_after_snapshot_restore(self):
+        stored = make_memory("用户喜欢喝乌龙茶", importance=0.9, confidence=0.9)
+        self.assertIs(self.agent._track_frequency(stored), stored)
+        self.agent._store_memory(stored)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snapshot")
+            self.agent.save_snapshot(path)
+            self.agent.load_snapshot(path)
+
+            repeat = make_memory("  用户喜欢喝乌龙茶 ", importance=0.9, confidence=0.9)
+            self.assertIsNone(self.agent._track_frequency(repeat))
+            restored = self.agent.frequency_tracker.stored(repeat)
+            self.assertIsNotNone(restored)
+            self.assertEqual(restored.content, stored.content)
+            self.assertEqual(restored.frequency, 2)
+            self.assertEqual(len(self.agent.vector_store.memories), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# 分片并行检索: 结果与精确检索一致 (含墓碑), 其它进程挂载检索后不会删除创建者的分片
+from memory import MemoryType
+from replay import StubEmbeddings
+from store.vector_store import VectorMemoryStore
+from tests.helpers import make_memory
+import json
+import subprocess
+import sys
+import unittest
+import numpy as np
+
+READER = """
+import json, sys
+import numpy as np
+from store.sharded import ShardedVectorIndex
+manifest = json.loads(sys.stdin.read())
+index = ShardedVectorIndex.attach(manifest, max_workers=2)
+rows, _ = index.search(np.ones(manifest['dim'], dtype=np.float32) / np.sqrt(manifest['dim']), 3)
+index.close()
+print(len(rows))
+"""
+
+
+class ShardedSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = VectorMemoryStore(StubEmbeddings(), compaction_min_size=10**9)
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((600, 32)).astype(np.float32)
+        self.memories = [make_memory(f"记忆{i}", MemoryType.FACTS) for i in range(600)]
+        for memory, vector in zip(self.memories, self.vectors):
+            self.store.add(memory, vector)
+        self.queries = rng.standard_normal((4, 32)).astype(np.float32)
+
+    def tearDown(self):
+        self.store.close()
+
+    def _search(self):
+        return [[memory.content for memory, _ in hits] for hits in self.store.search_by_vectors(self.queries, 10)]
+
+    def _assert_matches_exact(self):
+        self.store.disable_sharding()
+        exact = self._search()
+        self.store.enable_sharding(num_shards=3, max_workers=2, min_size=0)
+        self.assertEqual(self._search(), exact)
+
+    def test_matches_exact_search(self):
+        self._assert_matches_exact()
+
+    def test_matches_exact_search_with_tombstones(self):
+        for i in range(0, 600, 3):
+            self.store.delete(i)
+        self.assertGreater(self.store.tombstones, 0)
+        self._assert_matches_exact()
+
+    def test_rows_added_after_build_are_searched(self):
+        self.store.enable_sharding(num_shards=3, max_workers=2, min_size=0, rebuild_ratio=1.0)
+        self._search()
+        target = make_memory("新增记忆", MemoryType.FACTS)
+        self.store.add(target, self.queries[0])
+        self.assertEqual(self.store._sharded.size, 600)
+        self.assertIs(self.store.search_by_vectors(self.queries[:1], 1)[0][0][0], target)
+
+    def test_attached_reader_does_not_unlink_shards(self):
+        self.store.enable_sharding(num_shards=3, max_workers=2, min_size=0)
+        manifest = self.store.share_index()
+        expected = self._search()
+        reader = subprocess.run([sys.executable, "-c", READER], input=json.dumps(manifest),
+                                capture_output=True, text=True, timeout=120)
+        self.assertEqual(reader.returncode, 0, reader.stderr)
+        self.assertEqual(reader.stdout.strip(), "3")
+        self.assertEqual(self._search(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
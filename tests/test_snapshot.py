@@ -0,0 +1,78 @@
+# 整体快照: 保存/加载往返一致 (含冷存储), 替换中途崩溃时加载退回到 .old 备份目录
+from memory import MemoryType
+from store import snapshot
+from tests.helpers import make_agent, make_memory, recalled
+from tests.test_dump import state_of
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "snapshot")
+        self.agent = make_agent()
+        self.agent.update_memory("city", make_memory("用户住在上海"))
+        self.agent.update_memory("city", make_memory("用户住在北京"), source='user')
+        self.agent.update_memory("job", make_memory("用户是工程师", MemoryType.USER_PROFILE, importance=0.9))
+        self.agent.kv_store.set("name", make_memory("用户叫小王", importance=0.9))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        expected = state_of(self.agent)
+        manifest = self.agent.save_snapshot(self.path)
+        self.assertEqual(manifest['count'], len(self.agent.vector_store.memories))
+
+        restored = make_agent()
+        restored.load_snapshot(self.path)
+        self.assertEqual(state_of(restored), expected)
+        self.assertIsInstance(restored.vector_store.embeddings, np.memmap)
+        np.testing.assert_array_equal(restored.vector_store.embeddings, self.agent.vector_store.embeddings)
+        self.assertEqual(recalled(restored, "用户住在北京", 1)[0].content, "用户住在北京")
+
+    def test_round_trip_folds_cold_tier(self):
+        self.agent.enable_tiered_storage(hot_limit=0)
+        try:
+            self.agent.spill_cold_memories()
+            self.assertGreater(len(self.agent.cold_store), 0)
+            expected = state_of(self.agent)
+            self.agent.save_snapshot(self.path)
+        finally:
+            self.agent.cold_store.close()
+
+        restored = make_agent()
+        restored.load_snapshot(self.path)
+        self.assertEqual(state_of(restored), expected) # 未开启分级存储, 冷记忆全部回到内存
+
+    def test_load_falls_back_to_backup(self):
+        self.agent.save_snapshot(self.path)
+        expected = state_of(self.agent)
+
+        # 保存新快照时在两次 rename 之间崩溃: 旧目录已挪到 .old, 新目录还没就位
+        backup = f"{self.path}.old"
+        os.replace(self.path, backup)
+        restored = make_agent()
+        restored.load_snapshot(self.path)
+        self.assertEqual(state_of(restored), expected)
+
+        # 目录存在但不完整 (没有 manifest) 时同样退回到备份
+        os.makedirs(self.path)
+        self.assertEqual(snapshot.resolve_snapshot_path(self.path), backup)
+        shutil.rmtree(self.path)
+
+        # 下一次保存就位后清理备份
+        self.agent.update_memory("city", make_memory("用户住在深圳"), source='user')
+        self.agent.save_snapshot(self.path)
+        self.assertFalse(os.path.exists(backup))
+        restored.load_snapshot(self.path)
+        self.assertEqual(restored.update_manager.current_version["city"].content, "用户住在深圳")
+
+
+if __name__ == "__main__":
+    unittest.main()